@@ -0,0 +1,522 @@
+import os, json, logging
+import math
+import pickle
+import collections, collections.abc
+import numpy
+import networkx as nx
+import shapely.geometry as sg
+
+from spat import facility, spatial_index
+
+
+# Version of the bundle layout, bumped whenever files or their meaning change.
+VERSION = 2
+
+_COMPILED_COLUMNS = ['offsets', 'source', 'target', 'key', 'type', 'sens', 'length', 'valid']
+
+
+class EdgeGeometry(collections.abc.Mapping):
+    """Geometry of every directed edge, backed by flat coordinate arrays.
+
+    LineStrings are created on first access of each edge and kept afterward.
+    """
+    def __init__(self, compiled: facility.CompiledGraph, offsets, coordinates):
+        self.compiled = compiled
+        self.offsets = offsets
+        self.coordinates = coordinates
+        self.cache = {}
+
+    def __getitem__(self, edge):
+        geometry = self.cache.get(edge)
+        if geometry is None:
+            i = self.compiled.edge_index(edge)
+            geometry = sg.LineString(self.coordinates[self.offsets[i]:self.offsets[i + 1]])
+            self.cache[edge] = geometry
+        return geometry
+
+    def __contains__(self, edge):
+        try:
+            self.compiled.edge_index(edge)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.compiled.edges)
+
+    def __len__(self):
+        return len(self.compiled)
+
+
+class EdgeAttributes(collections.abc.Sequence):
+    """Attribute dict of every directed edge, built from columns on first access.
+
+    Columns are lists or memory mapped arrays, whose values come back as Python scalars.
+    Both directions of an edge share the same dict, as they do in networkx.
+    """
+    def __init__(self, columns, reverse):
+        self.columns = columns
+        self.reverse = reverse
+        self.cache = {}
+
+    def __getitem__(self, i):
+        i = min(i, int(self.reverse[i]))
+        data = self.cache.get(i)
+        if data is None:
+            data = {}
+            for name, column in self.columns.items():
+                value = column[i]
+                if isinstance(value, numpy.generic):
+                    value = value.item()
+                if value is not None:
+                    data[name] = value
+            self.cache[i] = data
+        return data
+
+    def __len__(self):
+        return len(self.reverse)
+
+
+class BundleGraph(facility.SpatialGraph):
+    """SpatialGraph backed by the memory mapped arrays of a bundle.
+
+    Queries used by mapmatch, features and IOC run off the compiled view, the edge
+    geometry arrays and the disk spatial indexes. The networkx graph is only built the
+    first time it is accessed.
+    """
+    def __init__(self, directory, manifest):
+        def read(name):
+            return numpy.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+
+        values = {}
+        for name, kind in manifest['attributes'].items():
+            if kind == 'npy':
+                values[name] = read('attribute_' + name)
+            else:
+                with open(os.path.join(directory, 'attribute_' + name + '.pickle'), 'rb') as f:
+                    values[name] = pickle.load(f)
+
+        self._graph = None
+        self.ubodt = None
+        self.contracted = {}
+        if os.path.exists(os.path.join(directory, 'contracted.pickle')):
+            with open(os.path.join(directory, 'contracted.pickle'), 'rb') as f:
+                self.contracted = pickle.load(f)
+        self.nodes = read('node')
+        self.node_xy = read('node_xy')
+        self.canonical = read('canonical')
+        columns = {name: read(name) for name in _COMPILED_COLUMNS}
+        self.compiled = facility.CompiledGraph(
+            self.nodes, attributes=EdgeAttributes(values, read('reverse')), **columns)
+        self.geometry = EdgeGeometry(self.compiled, read('geometry_offsets'), read('geometry'))
+        self.spatial_node_idx = spatial_index.DiskIndex(os.path.join(directory, 'node_index'))
+        self.spatial_edge_idx = spatial_index.DiskIndex(os.path.join(directory, 'edge_index'))
+
+    @property
+    def graph(self):
+        if self._graph is None:
+            graph = nx.MultiGraph()
+            graph.add_nodes_from(
+                (u, {'geometry': sg.Point(x, y)})
+                for u, (x, y) in zip(self.nodes.tolist(), self.node_xy.tolist()))
+            ids = numpy.flatnonzero(self.canonical)
+            graph.add_edges_from(
+                (u, v, k, self.compiled.attributes[i]) for (u, v, k), i in
+                zip(self._edges(ids), ids.tolist()))
+            self._graph = graph
+        return self._graph
+
+    @graph.setter
+    def graph(self, graph):
+        self._graph = graph
+
+    def node_geometry(self, i):
+        x, y = self.node_xy[self.compiled.node_position(i)]
+        return sg.Point(x, y)
+
+    def node_coordinates(self):
+        return self.nodes.tolist(), numpy.asarray(self.node_xy)
+
+    def edge_coordinates(self, edge):
+        i = self.compiled.edge_index(edge)
+        return self.geometry.coordinates[self.geometry.offsets[i]:self.geometry.offsets[i + 1]]
+
+    def undirected_edges(self):
+        return self._edges(numpy.flatnonzero(self.canonical))
+
+    def _edges(self, ids):
+        compiled = self.compiled
+        return list(zip(compiled.source[ids].tolist(), compiled.target[ids].tolist(),
+                        compiled.key[ids].tolist()))
+
+    def compile(self):
+        return self.compiled
+
+
+def save(graph: facility.SpatialGraph, directory):
+    """Writes |graph| as a binary bundle in |directory|.
+
+    The bundle holds a manifest, the node coordinates, the CSR topology and attribute
+    columns of the compiled graph, the geometry of every directed edge as flat
+    coordinate arrays, and STR packed node and edge R-trees. Arrays are .npy files,
+    so that loading memory maps them.
+    """
+    os.makedirs(directory, exist_ok=True)
+    compiled = graph.compile()
+
+    def write(name, array):
+        numpy.save(os.path.join(directory, name + '.npy'), array)
+
+    nodes = numpy.asarray(compiled.nodes, dtype=numpy.int64)
+    node_data = dict(graph.graph.nodes(data=True))
+    node_xy = numpy.array([node_data[u]['geometry'].coords[0][0:2] for u in nodes.tolist()],
+                          dtype=float).reshape(-1, 2)
+    write('node', nodes)
+    write('node_xy', node_xy)
+    for name in _COMPILED_COLUMNS:
+        write(name, getattr(compiled, name))
+
+    # one undirected edge per networkx edge, in the orientation networkx lists it
+    undirected = list(graph.undirected_edges())
+    canonical = numpy.zeros(len(compiled), dtype=bool)
+    reverse = numpy.arange(len(compiled))
+    if undirected:
+        u, v, k = (numpy.array(column, dtype=numpy.int64) for column in zip(*undirected))
+        i, j = compiled.edge_indices(u, v, k), compiled.edge_indices(v, u, k)
+        canonical[i] = True
+        reverse[i], reverse[j] = j, i
+    write('canonical', canonical)
+    write('reverse', reverse)
+
+    attributes = {}
+    names = sorted(set(name for data in compiled.attributes for name in data))
+    for name in names:
+        values = [data.get(name) for data in compiled.attributes]
+        column = _attribute_column(values)
+        if column is not None:
+            write('attribute_' + name, column)
+            attributes[name] = 'npy'
+        else:
+            with open(os.path.join(directory, 'attribute_' + name + '.pickle'), 'wb') as f:
+                pickle.dump(values, f)
+            attributes[name] = 'pickle'
+
+    coordinates = [numpy.asarray(graph.edge_geometry(edge).coords, dtype=float)[:, 0:2]
+                   for edge in compiled.edges]
+    write('geometry_offsets', numpy.cumsum([0] + [len(coords) for coords in coordinates]))
+    write('geometry', numpy.concatenate(coordinates) if coordinates else numpy.empty((0, 2)))
+
+    if graph.contracted:
+        with open(os.path.join(directory, 'contracted.pickle'), 'wb') as f:
+            pickle.dump(graph.contracted, f)
+
+    spatial_index.bulk_load(graph.spatial_node_entries(), os.path.join(directory, 'node_index')).close()
+    spatial_index.bulk_load(graph.spatial_edge_entries(), os.path.join(directory, 'edge_index')).close()
+
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump({
+            'version': VERSION,
+            'node_count': len(nodes),
+            'edge_count': len(compiled),
+            'attributes': attributes,
+        }, f, indent=2)
+
+
+def _attribute_column(values):
+    """Numpy column of |values|, or None if they are not all plain numbers."""
+    if all(isinstance(value, bool) for value in values):
+        return numpy.array(values, dtype=bool)
+    if all(isinstance(value, (int, numpy.integer)) and not isinstance(value, bool) for value in values):
+        return numpy.array(values, dtype=numpy.int64)
+    if all(isinstance(value, (int, float, numpy.number)) and not isinstance(value, bool) for value in values):
+        return numpy.array(values, dtype=float)
+    return None
+
+
+def load(directory):
+    """Loads the bundle in |directory|.
+
+    Arrays are memory mapped, so processes loading the same bundle share their pages.
+    The graph comes back compiled, with its node and edge spatial indexes.
+    """
+    with open(os.path.join(directory, 'manifest.json'), 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != VERSION:
+        raise ValueError("unsupported facility bundle version %s in %s, expected %d" %
+                         (manifest.get('version'), directory, VERSION))
+
+    graph = BundleGraph(directory, manifest)
+    logging.info("loaded facility bundle %s: %d nodes, %d directed edges",
+                 directory, manifest['node_count'], manifest['edge_count'])
+    return graph
+
+
+def open_graph(path, tile_capacity=64, tiled=True):
+    """Opens a facility graph from a bundle directory, a tiled facility or a pickle file.
+
+    A bundle or a pickle comes back compiled with its node and edge spatial indexes.
+    Indexes of a pickle are stored next to it, and only rebuilt when it changes.
+    A tiled facility keeps at most |tile_capacity| tiles resident. Callers working on
+    the whole graph pass |tiled| False, and a tiled facility raises a ValueError.
+    """
+    if os.path.exists(os.path.join(path, 'tiles.json')):
+        if not tiled:
+            raise ValueError("%s is a tiled facility, which only supports mapmatching queries; "
+                             "pass the bundle directory or pickle it was tiled from" % path)
+        return load_tiles(path, tile_capacity)
+    if os.path.isdir(path):
+        return load(path)
+    with open(path, 'rb') as f:
+        graph = pickle.load(f)
+    graph.build_spatial_edge_index(path + '.edge_index', newer_than=path)
+    graph.build_spatial_node_index(path + '.node_index', newer_than=path)
+    graph.compile()
+    return graph
+
+
+class TiledGraph(facility.FacilityQueries):
+    """Facility graph split in square tiles, each stored as a bundle and loaded on demand.
+
+    A tile holds the nodes inside its square and every edge with an endpoint among them,
+    so that the edges leaving a node are all found in the tile of that node, and paths
+    cross tile borders through edges stored in both tiles. At most |capacity| tiles are
+    resident, the least recently used one is dropped first.
+    The networkx graph of the whole facility is never built, nor its compiled view.
+    """
+    def __init__(self, directory, manifest, capacity):
+        def read(name):
+            return numpy.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+
+        self.directory = directory
+        self.capacity = capacity
+        self.tile_size = manifest['tile_size']
+        self.tile_names = [tile['name'] for tile in manifest['tiles']]
+        self.tile_bounds = numpy.array([tile['bounds'] for tile in manifest['tiles']],
+                                       dtype=float).reshape(-1, 4)
+        self.nodes = read('node')
+        self.node_tile = read('node_tile')
+        self.tiles = collections.OrderedDict()
+        self.loads = 0
+        self.ubodt = None
+        self.compiled = None
+
+    def tile(self, i) -> BundleGraph:
+        """Tile |i|, loaded if it is not resident."""
+        tile = self.tiles.get(i)
+        if tile is None:
+            tile = load(os.path.join(self.directory, 'tiles', self.tile_names[i]))
+            tile.build_segment_table()
+            self.tiles[i] = tile
+            self.loads += 1
+            if len(self.tiles) > self.capacity:
+                self.tiles.popitem(last=False)
+        else:
+            self.tiles.move_to_end(i)
+        return tile
+
+    def node_coordinates(self):
+        """Node ids and coordinates, read from the arrays of every tile without loading them."""
+        nodes, node_xy = [], []
+        for name in self.tile_names:
+            directory = os.path.join(self.directory, 'tiles', name)
+            nodes.append(numpy.load(os.path.join(directory, 'node.npy'), mmap_mode='r'))
+            node_xy.append(numpy.load(os.path.join(directory, 'node_xy.npy'), mmap_mode='r'))
+        if not nodes:
+            return [], numpy.empty((0, 2))
+        nodes, first = numpy.unique(numpy.concatenate(nodes), return_index=True)
+        return nodes.tolist(), numpy.concatenate(node_xy)[first]
+
+    def node_tile_index(self, u):
+        j = numpy.searchsorted(self.nodes, u)
+        if j == len(self.nodes) or self.nodes[j] != u:
+            raise KeyError(u)
+        return int(self.node_tile[j])
+
+    def home(self, u) -> BundleGraph:
+        """Tile of node |u|, holding every edge leaving it."""
+        return self.tile(self.node_tile_index(u))
+
+    def tiles_around(self, bounds):
+        """Tiles whose content intersects |bounds|."""
+        b = self.tile_bounds
+        indices = numpy.flatnonzero((b[:, 0] <= bounds[2]) & (b[:, 2] >= bounds[0]) &
+                                    (b[:, 1] <= bounds[3]) & (b[:, 3] >= bounds[1]))
+        return [self.tile(i) for i in indices.tolist()]
+
+    def has_node(self, item):
+        try:
+            self.node_tile_index(item)
+        except KeyError:
+            return False
+        return True
+
+    def has_edge(self, u, v):
+        return self.has_node(u) and any(w == v for _, w, _ in self.adjacent(u))
+
+    def adjacent(self, u):
+        return self.home(u).adjacent(u)
+
+    def valid_circulation(self, edge):
+        return self.home(edge[0]).valid_circulation(edge)
+
+    def edge(self, edge):
+        return self.home(edge[0]).edge(edge)
+
+    def edge_geometry(self, edge):
+        return self.home(edge[0]).edge_geometry(edge)
+
+    def edge_coordinates(self, edge):
+        return self.home(edge[0]).edge_coordinates(edge)
+
+    def node_geometry(self, i):
+        return self.home(i).node_geometry(i)
+
+    def original_edges(self, edge):
+        return self.home(edge[0]).original_edges(edge)
+
+    def search_node_intersection(self, bounds):
+        found = set()
+        for tile in self.tiles_around(bounds):
+            found.update(tile.search_node_intersection(bounds))
+        return iter(sorted(found))
+
+    def search_edge_intersection(self, bounds):
+        found = {}
+        for tile in self.tiles_around(bounds):
+            for item in tile.search_edge_intersection(bounds):
+                u, v, k = item.object
+                found.setdefault((min(u, v), max(u, v), k), item)
+        return iter(found.values())
+
+    def search_node_nearest(self, bounds, count):
+        def position(tile, u):
+            return tile.node_geometry(u).bounds
+        return iter(self._nearest(bounds, count, lambda tile: (
+            (u, u, position(tile, u)) for u in tile.search_node_nearest(bounds, count))))
+
+    def search_edge_nearest(self, bounds, count):
+        def link(item):
+            u, v, k = item.object
+            return min(u, v), max(u, v), k
+        return iter(self._nearest(bounds, count, lambda tile: (
+            (link(item), item, item.bbox) for item in tile.search_edge_nearest(bounds, count))))
+
+    def _nearest(self, bounds, count, candidates_fcn):
+        """The |count| results nearest to |bounds| among tiles around it.
+
+        |candidates_fcn(tile)| yields (key, result, bounds) of the nearest results of a
+        tile. The window around |bounds| grows until it holds all of them.
+        Results are deduplicated by key, as edges and nodes at borders are in two tiles.
+        """
+        everything = (self.tile_bounds[:, 0:2].min(axis=0).tolist() +
+                      self.tile_bounds[:, 2:4].max(axis=0).tolist()) if len(self.tile_bounds) else None
+        radius = self.tile_size
+        while True:
+            window = (bounds[0] - radius, bounds[1] - radius, bounds[2] + radius, bounds[3] + radius)
+            found = {}
+            for tile in self.tiles_around(window):
+                for key, result, result_bounds in candidates_fcn(tile):
+                    found[key] = (_bounds_distance(bounds, result_bounds), result)
+            best = sorted(found.values(), key=lambda x: x[0])
+            complete = everything is None or (
+                window[0] <= everything[0] and window[1] <= everything[1] and
+                window[2] >= everything[2] and window[3] >= everything[3])
+            if complete or (len(best) >= count and best[count - 1][0] <= radius):
+                # like the R-tree, results tied with the last one are kept
+                last = best[min(count, len(best)) - 1][0] if best else 0.0
+                return [result for distance, result in best if distance <= last]
+            radius *= 2.0
+
+    def search_segments(self, bounds):
+        parts = []
+        for tile in self.tiles_around(bounds):
+            parts.extend(tile.search_segments(bounds))
+        return parts
+
+    def edge_segment_table(self, edge):
+        return self.home(edge[0]).segment_table
+
+    def build_segment_table(self):
+        """Tiles build their segment table when they are loaded."""
+        pass
+
+    def compile(self):
+        raise TypeError("a tiled facility has no compiled view of the whole graph, "
+                        "open the bundle directory or pickle it was tiled from")
+
+
+def _bounds_distance(a, b):
+    dx = max(a[0] - b[2], b[0] - a[2], 0.0)
+    dy = max(a[1] - b[3], b[1] - a[3], 0.0)
+    return math.hypot(dx, dy)
+
+
+def save_tiles(graph: facility.SpatialGraph, directory, tile_size):
+    """Writes |graph| as a tiled facility in |directory|, with square tiles of |tile_size|.
+
+    Each tile is a bundle in |directory|/tiles, holding the nodes in its square and every
+    edge with an endpoint among them. The tile of every node and the bounds of every tile
+    are stored at the top of |directory|.
+    """
+    tiles = collections.defaultdict(lambda: ([], []))
+    node_data = dict(graph.graph.nodes(data=True))
+    node_tile = {}
+    for u, data in node_data.items():
+        x, y = data['geometry'].coords[0][0:2]
+        node_tile[u] = (int(math.floor(x / tile_size)), int(math.floor(y / tile_size)))
+        tiles[node_tile[u]][0].append(u)
+    for u, v, k, data in graph.graph.edges(keys=True, data=True):
+        for tile in {node_tile[u], node_tile[v]}:
+            tiles[tile][1].append((u, v, k, data))
+
+    names = sorted(tiles)
+    manifest_tiles = []
+    for i, name in enumerate(names):
+        nodes, edges = tiles[name]
+        tile = facility.SpatialGraph()
+        tile.graph.add_nodes_from((u, node_data[u]) for u in nodes)
+        tile.graph.add_nodes_from((w, node_data[w]) for u, v, _, _ in edges for w in (u, v))
+        tile.graph.add_edges_from(edges)
+        for u, v, k, _ in edges:
+            for edge in ((u, v, k), (v, u, k)):
+                tile.geometry[edge] = graph.edge_geometry(edge)
+                if edge in graph.contracted:
+                    tile.contracted[edge] = graph.contracted[edge]
+
+        bounds = [entry[1] for entry in tile.spatial_node_entries()]
+        bounds += [entry[1] for entry in tile.spatial_edge_entries()]
+        bounds = numpy.array(bounds, dtype=float)
+        tile_name = '%d_%d' % name
+        save(tile, os.path.join(directory, 'tiles', tile_name))
+        manifest_tiles.append({
+            'name': tile_name,
+            'bounds': bounds[:, 0:2].min(axis=0).tolist() + bounds[:, 2:4].max(axis=0).tolist(),
+        })
+
+    index = {name: i for i, name in enumerate(names)}
+    nodes = numpy.array(sorted(node_tile), dtype=numpy.int64)
+    numpy.save(os.path.join(directory, 'node.npy'), nodes)
+    numpy.save(os.path.join(directory, 'node_tile.npy'),
+               numpy.array([index[node_tile[u]] for u in nodes.tolist()], dtype=numpy.int32))
+
+    with open(os.path.join(directory, 'tiles.json'), 'w') as f:
+        json.dump({
+            'version': VERSION,
+            'tile_size': tile_size,
+            'node_count': len(nodes),
+            'tiles': manifest_tiles,
+        }, f, indent=2)
+
+
+def load_tiles(directory, capacity=64):
+    """Opens the tiled facility in |directory|, keeping at most |capacity| tiles resident."""
+    with open(os.path.join(directory, 'tiles.json'), 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != VERSION:
+        raise ValueError("unsupported tiled facility version %s in %s, expected %d" %
+                         (manifest.get('version'), directory, VERSION))
+
+    graph = TiledGraph(directory, manifest, capacity)
+    logging.info("opened tiled facility %s: %d nodes in %d tiles of %.0f",
+                 directory, manifest['node_count'], len(manifest['tiles']), manifest['tile_size'])
+    return graph
@@ -0,0 +1,132 @@
+import os
+import json
+import math
+import tempfile
+import unittest
+import numpy
+
+from spat import bundle, facility, kalman, testing
+from spat.trajectory import mapmatch, smooth
+
+
+class TestBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.graph = testing.make_graph()
+        for i, (u, v, k, data) in enumerate(self.graph.graph.edges(keys=True, data=True)):
+            data['way_id'] = 100 + i
+            if i % 2 == 0:
+                data['link_id'] = 'link%d' % i
+        bundle.save(self.graph, self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_load(self):
+        graph = self.graph
+        loaded = bundle.load(self.directory.name)
+
+        self.assertEqual(loaded.compiled.edges, graph.compiled.edges)
+        for edge in graph.compiled.edges:
+            self.assertEqual(loaded.edge(edge), graph.edge(edge))
+            self.assertEqual(loaded.valid_circulation(edge), graph.valid_circulation(edge))
+            self.assertTrue(loaded.edge_geometry(edge).equals(graph.edge_geometry(edge)))
+        for u in graph.compiled.nodes:
+            self.assertEqual(list(loaded.adjacent(u)), list(graph.adjacent(u)))
+            self.assertTrue(loaded.node_geometry(u).equals(graph.graph.nodes[u]['geometry']))
+        # lookups run on the memory mapped columns, without building dicts
+        self.assertNotIn('edge_id', vars(loaded.compiled))
+        self.assertNotIn('node_index', vars(loaded.compiled))
+
+        self.assertEqual(sorted(loaded.search_node_intersection((-1.0, -1.0, 1.0, 1.0))), [0])
+        bounds = (4.0, -1.0, 6.0, 1.0)
+        edges = [item.object for item in loaded.search_edge_intersection(bounds)]
+        expected = [edge for edge in graph.graph.edges(keys=True)
+                    if facility.sg.box(*graph.edge_geometry(edge).bounds).intersects(facility.sg.box(*bounds))]
+        self.assertEqual(sorted(edges), sorted(expected))
+        self.assertIn((0, 1, 0), edges)
+
+        self.assertEqual(sorted(loaded.graph.edges(keys=True, data=True)),
+                         sorted(graph.graph.edges(keys=True, data=True)))
+
+        graph.build_segment_table()
+        loaded.build_segment_table()
+        self.assertEqual(loaded.segment_table.edges, graph.segment_table.edges)
+        numpy.testing.assert_allclose(loaded.segment_table.origin, graph.segment_table.origin)
+
+    def test_version(self):
+        filename = os.path.join(self.directory.name, 'manifest.json')
+        with open(filename, 'r') as f:
+            manifest = json.load(f)
+        manifest['version'] = bundle.VERSION + 1
+        with open(filename, 'w') as f:
+            json.dump(manifest, f)
+        self.assertRaises(ValueError, bundle.load, self.directory.name)
+
+
+class TestTiles(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.graph = testing.make_grid(6, 10.0)
+        self.graph.build_segment_table()
+        self.graph.compile()
+        bundle.save_tiles(self.graph, self.directory.name, 25.0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_queries(self):
+        graph = self.graph
+        tiled = bundle.open_graph(self.directory.name, tile_capacity=2)
+        self.assertEqual(len(tiled.tile_names), 9)
+
+        nodes, node_xy = tiled.node_coordinates()
+        self.assertEqual(nodes, sorted(graph.compiled.nodes))
+        for u, (x, y) in zip(nodes, node_xy.tolist()):
+            self.assertEqual((x, y), graph.graph.nodes[u]['geometry'].coords[0])
+        self.assertEqual(tiled.loads, 0)
+
+        for u in graph.compiled.nodes:
+            self.assertEqual(sorted(tiled.adjacent(u)), sorted(graph.adjacent(u)))
+            self.assertTrue(tiled.node_geometry(u).equals(graph.graph.nodes[u]['geometry']))
+            for edge in graph.adjacent(u):
+                self.assertEqual(tiled.edge(edge), graph.edge(edge))
+                self.assertEqual(tiled.valid_circulation(edge), graph.valid_circulation(edge))
+                self.assertTrue(tiled.edge_geometry(edge).equals(graph.edge_geometry(edge)))
+            self.assertLessEqual(len(tiled.tiles), 2)
+        self.assertFalse(tiled.has_node(36))
+
+        bounds = (15.0, 15.0, 32.0, 32.0)
+        self.assertEqual(list(tiled.search_node_intersection(bounds)), [14, 15, 20, 21])
+        edges = [item.object for item in tiled.search_edge_intersection(bounds)]
+        self.assertEqual(len(edges), 12)
+        self.assertEqual(sorted(tiled.search_node_nearest((49.0, 49.0, 49.0, 49.0), 1)), [35])
+
+    def test_whole_graph(self):
+        tiled = bundle.open_graph(self.directory.name)
+        self.assertAlmostEqual(tiled.turn_angle((1, 7, 0), (7, 8, 0)), math.pi / 2.0)
+        self.assertRaises(TypeError, tiled.compile)
+        self.assertFalse(hasattr(tiled, 'spatial_node_entries'))
+        self.assertRaises(ValueError, bundle.open_graph, self.directory.name, tiled=False)
+
+    def test_project_state(self):
+        graph = testing.make_loop_graph()
+        graph.compile()
+        directory = os.path.join(self.directory.name, 'mapmatch')
+        bundle.save_tiles(graph, directory, 50.0)
+        tiled = bundle.open_graph(directory, tile_capacity=1)
+
+        states = [kalman.KalmanFilter([30.0, 2.0, 1.0, 0.0], numpy.identity(4) * 10.0),
+                  kalman.KalmanFilter([101.0, 20.0, 0.0, 1.0], numpy.identity(4) * 10.0),
+                  kalman.KalmanFilter([55.0, 95.0, -1.0, 0.5], numpy.identity(4) * 10.0)]
+        transitions = smooth.transition(numpy.ones(len(states) - 1))
+        expected = mapmatch.ProjectionManager(states, graph, mapmatch.LinkManager(graph, transitions))
+        projections = mapmatch.ProjectionManager(states, tiled, mapmatch.LinkManager(tiled, transitions))
+        for i in range(len(states)):
+            self.assertEqual(projections.project_state(i), expected.project_state(i))
+
+
+if __name__ == '__main__':
+    unittest.main()
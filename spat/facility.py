@@ -1,17 +1,311 @@
+import math
+import functools
 import shapefile
-import rtree
 import networkx as nx
 import shapely.geometry as sg
 import geojson
 import numpy
+from scipy import spatial
+
+from spat import utility, spatial_index
+
+
+def segment_distance(origin, direction, length, point):
+    """Euclidean distance between |point| and segments given by their |origin|, unit
+    |direction| and |length|."""
+    w = numpy.asarray(point)[0:2] - origin
+    t = numpy.clip(numpy.einsum('ij,ij->i', w, direction), 0.0, length)
+    w -= direction * t[:, None]
+    return numpy.hypot(w[:, 0], w[:, 1])
+
+
+class SegmentTable:
+    """Flat table of every directed segment of a facility graph.
+
+    Each edge of the graph is stored twice, once per direction, and each direction
+    is split into the segments of its polyline. Segments of a directed edge occupy a
+    contiguous range of rows, in travel order. Directed edges are numbered so that
+    the reverse of edge |i| is edge |i ^ 1|.
+
+    Columns:
+      edge: directed edge id of the segment, index in |edges|.
+      offset: rank of the segment within its edge.
+      origin, direction, normal: start point, unit direction and unit normal (Nx2).
+      length: length of the segment.
+      distance: cumulative length of the edge before the segment.
+      bounds: bounding box of the segment (Nx4).
+    """
+    def __init__(self, edges, coordinates):
+        self.edges = list(edges)
+        self.edge_rows = {}
+
+        polylines = []
+        edge = []
+        offset = []
+        row = 0
+        for i, coords in enumerate(coordinates):
+            coords = numpy.asarray(coords, dtype=float)[:, 0:2]
+            count = len(coords) - 1
+            self.edge_rows[self.edges[i]] = (row, row + count)
+            polylines.append(coords)
+            edge.append(numpy.full(count, i, dtype=numpy.int32))
+            offset.append(numpy.arange(count, dtype=numpy.int32))
+            row += count
+
+        self.edge = numpy.concatenate(edge) if edge else numpy.empty(0, dtype=numpy.int32)
+        self.offset = numpy.concatenate(offset) if offset else numpy.empty(0, dtype=numpy.int32)
+        if polylines:
+            origin = numpy.concatenate([coords[:-1] for coords in polylines])
+            destination = numpy.concatenate([coords[1:] for coords in polylines])
+        else:
+            origin = destination = numpy.empty((0, 2))
+
+        v = destination - origin
+        self.origin = origin
+        self.length = numpy.hypot(v[:, 0], v[:, 1])
+        inverse_length = numpy.divide(1.0, self.length, out=numpy.zeros_like(self.length),
+                                      where=self.length > 0.0)
+        self.direction = v * inverse_length[:, None]
+        self.normal = numpy.column_stack((self.direction[:, 1], -self.direction[:, 0]))
+        self.bounds = numpy.column_stack((numpy.minimum(origin, destination),
+                                          numpy.maximum(origin, destination)))
+
+        self.distance = numpy.cumsum(self.length) - self.length
+        if len(self.edge) > 0:
+            first = numpy.flatnonzero(self.offset == 0)
+            self.distance -= numpy.repeat(self.distance[first], numpy.diff(numpy.append(first, len(self.edge))))
+
+    def __len__(self):
+        return len(self.edge)
+
+    def rows(self, edge):
+        begin, end = self.edge_rows[edge]
+        return range(begin, end)
+
+    def edge_length(self, edge):
+        begin, end = self.edge_rows[edge]
+        return self.distance[end - 1] + self.length[end - 1]
+
+    def point_distance(self, rows, point):
+        """Euclidean distance between |point| and each segment in |rows|."""
+        return segment_distance(self.origin[rows], self.direction[rows], self.length[rows], point)
+
+    def build_spatial_index(self):
+        return spatial_index.bulk_load((i, tuple(bounds), None) for i, bounds in enumerate(self.bounds))
+
+
+class CompiledGraph:
+    """Frozen CSR view of a facility graph.
+
+    Every edge of the graph is present once per direction, except self loops, and
+    directed edges are numbered densely in CSR order: |nodes| are sorted, and edges
+    leaving node |nodes[i]| have ids |offsets[i]| to |offsets[i+1]|, sorted by target
+    and key. Directed edge ids thus follow the (source, target, key) order.
+
+    Columns, indexed by directed edge id:
+      source, target, key: node ids and key of the edge.
+      type, sens: attributes of the edge.
+      length: length of the edge geometry.
+      valid: whether circulation is allowed in the direction of the edge.
+
+    Nodes and edges are looked up with binary searches on the columns, which may be
+    memory mapped, so that nothing runs over every edge when the view is created. The
+    |edges| list and the |node_index| and |edge_id| dicts are built on first access.
+    """
+    def __init__(self, nodes, offsets, source, target, key, type, sens, length, valid, attributes):
+        self.nodes = nodes
+        self.offsets = offsets
+        self.source = source
+        self.target = target
+        self.key = key
+        self.type = type
+        self.sens = sens
+        self.length = length
+        self.valid = valid
+        self.attributes = attributes
+
+    @classmethod
+    def from_graph(cls, graph: nx.MultiGraph, geometry):
+        nodes = sorted(graph.nodes())
+        edges = []
+        attributes = []
+        offsets = [0]
+        for u in nodes:
+            adjacency = graph[u]
+            for v in sorted(adjacency):
+                for k in sorted(adjacency[v]):
+                    edges.append((u, v, k))
+                    attributes.append(adjacency[v][k])
+            offsets.append(len(edges))
+
+        count = len(edges)
+        source = numpy.fromiter((u for u, _, _ in edges), dtype=numpy.int64, count=count)
+        target = numpy.fromiter((v for _, v, _ in edges), dtype=numpy.int64, count=count)
+        key = numpy.fromiter((k for _, _, k in edges), dtype=numpy.int32, count=count)
+        type = numpy.fromiter((data.get('type', -1) for data in attributes), dtype=numpy.int32, count=count)
+        sens = numpy.fromiter((data.get('sens', 0) for data in attributes), dtype=numpy.int32, count=count)
+        length = numpy.fromiter((geometry[edge].length for edge in edges), dtype=float, count=count)
+
+        order = numpy.fromiter((bool(data.get('order', True)) for data in attributes),
+                               dtype=bool, count=count)
+        ordered = (source > target) ^ order
+        valid = (sens == 0) | ((sens > 0) == ordered)
+        return cls(numpy.array(nodes, dtype=numpy.int64), numpy.array(offsets, dtype=numpy.int64),
+                   source, target, key, type, sens, length, valid, attributes)
+
+    def __len__(self):
+        return len(self.source)
+
+    @functools.cached_property
+    def edges(self):
+        return list(zip(self.source.tolist(), self.target.tolist(), self.key.tolist()))
+
+    @functools.cached_property
+    def edge_id(self):
+        return {edge: i for i, edge in enumerate(self.edges)}
+
+    @functools.cached_property
+    def node_index(self):
+        return {u: i for i, u in enumerate(self.nodes.tolist())}
+
+    def node_position(self, u):
+        """Index of node |u| in |nodes|."""
+        i = int(numpy.searchsorted(self.nodes, u))
+        if i == len(self.nodes) or self.nodes[i] != u:
+            raise KeyError(u)
+        return i
+
+    def node_positions(self, nodes):
+        """Index in |nodes| of each node of the array |nodes|."""
+        nodes = numpy.asarray(nodes, dtype=numpy.int64)
+        i = numpy.searchsorted(self.nodes, nodes)
+        found = i < len(self.nodes)
+        found[found] = self.nodes[i[found]] == nodes[found]
+        if not found.all():
+            raise KeyError(nodes[~found][0].item())
+        return i
+
+    def edge_index(self, edge):
+        """Directed edge id of |edge|."""
+        u, v, k = edge
+        i = self.node_position(u)
+        begin, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        for j in range(begin + int(numpy.searchsorted(self.target[begin:end], v)), end):
+            if self.target[j] != v:
+                break
+            if self.key[j] == k:
+                return j
+        raise KeyError(edge)
+
+    def edge_indices(self, source, target, key):
+        """Directed edge ids of the edges (source[i], target[i], key[i]) of three arrays."""
+        target = numpy.asarray(target, dtype=numpy.int64)
+        key = numpy.asarray(key, dtype=numpy.int64)
+        rows = self.node_positions(source)
+        begin, end = self.offsets[rows], self.offsets[rows + 1]
+        ids = numpy.full(len(rows), -1, dtype=numpy.int64)
+        # degrees are small, so edges of each row are scanned in lockstep
+        for d in range(int((end - begin).max(initial=0))):
+            j = begin + d
+            pending = (j < end) & (ids < 0)
+            pending[pending] = (self.target[j[pending]] == target[pending]) & (self.key[j[pending]] == key[pending])
+            ids[pending] = j[pending]
+        if (ids < 0).any():
+            i = numpy.flatnonzero(ids < 0)[0]
+            raise KeyError((numpy.asarray(source)[i].item(), target[i].item(), key[i].item()))
+        return ids
 
-from spat import utility
+    def adjacent(self, u):
+        begin, end = self.adjacent_range(u)
+        return list(zip(self.source[begin:end].tolist(), self.target[begin:end].tolist(),
+                        self.key[begin:end].tolist()))
+
+    def adjacent_ids(self, u):
+        return range(*self.adjacent_range(u))
+
+    def adjacent_range(self, u):
+        i = self.node_position(u)
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+
+def snap_endpoints(endpoints, nodes, node_xy, first_id, distance_threshold):
+    """Assigns a node to each of the (first, last) interleaved segment |endpoints|.
+
+    Endpoints are taken in order. Each one goes to the closest of the |nodes| at
+    |node_xy|, or of the nodes created by earlier endpoints, within a square window of
+    half side |distance_threshold|. Ties go to the most recent node. The last endpoint of
+    a segment ignores the node of its first one. An endpoint without a node creates one,
+    numbered from |first_id|.
+    Window queries are run for all endpoints at once on a KD-tree.
+
+    Returns the node of each endpoint, and the endpoints that created a node.
+    """
+    count = len(nodes)
+    tree = spatial.cKDTree(numpy.concatenate((node_xy.reshape(-1, 2), endpoints)))
+    neighbors = tree.query_ball_point(endpoints, distance_threshold, p=numpy.inf)
+
+    # node of every point, existing nodes first, -1 for endpoints without their own node
+    point_node = list(nodes) + [-1] * len(endpoints)
+    point_xy = tree.data.tolist()
+
+    result = []
+    created = []
+    next_id = first_id
+    for i, (x, y) in enumerate(endpoints.tolist()):
+        ignore = result[-1] if i % 2 == 1 else None
+        best = None
+        min_distance = numpy.inf
+        # existing nodes, then created nodes in creation order
+        for j in sorted(neighbors[i]):
+            k = point_node[j]
+            if k == -1 or k == ignore:
+                continue
+            distance = math.hypot(point_xy[j][0] - x, point_xy[j][1] - y)
+            if distance <= min_distance:
+                min_distance = distance
+                best = k
+        if best is None:
+            best = next_id
+            next_id += 1
+            point_node[count + i] = best
+            created.append(i)
+        result.append(best)
+    return result, created
+
+
+class FacilityQueries:
+    """Queries written against the edge and node accessors of a facility graph only.
+
+    Shared by SpatialGraph and the tiled facility of spat.bundle, which has no
+    networkx graph.
+    """
+    def edge_coordinates(self, edge):
+        return self.edge_geometry(edge).coords
+
+    # turn angle in radians. 0 is staight, negative is right.
+    def turn_angle(self, e1, e2):
+        _, v, _ = e1
+
+        link0 = self.edge_geometry(e1)
+        p0 = link0.coords[-2]
+
+        p1 = utility.point_to_vec(self.node_geometry(v))
+
+        link1 = self.edge_geometry(e2)
+        p2 = link1.coords[1]
+
+        v0 = numpy.array(p1) - numpy.array(p0)
+        v1 = numpy.array(p2) - numpy.array(p1)
+        return math.atan2(numpy.linalg.det([v0,v1]), numpy.dot(v0,v1))
 
 
-class SpatialGraph:
+class SpatialGraph(FacilityQueries):
     def __init__(self):
         self.graph = nx.MultiGraph()
         self.geometry = {}
+        self.ubodt = None
+        self.compiled = None
+        self.contracted = {}
 
     def has_node(self, item):
         return self.graph.has_node(item)
@@ -20,6 +314,11 @@ class SpatialGraph:
         return self.graph.has_edge(u, v)
 
     def adjacent(self, u):
+        if self.compiled is not None:
+            return self.compiled.adjacent(u)
+        return self._adjacent(u)
+
+    def _adjacent(self, u):
         for v in self.graph[u]:
             for k in range(0, self.graph.number_of_edges(u, v)):
                 yield (u, v, k)
@@ -36,7 +335,22 @@ class SpatialGraph:
     def search_edge_nearest(self, bounds, count):
         return self.spatial_edge_idx.nearest(bounds, count, objects=True)
 
+    def search_segment_intersection(self, bounds):
+        return numpy.fromiter(self.spatial_segment_idx.intersection(bounds), dtype=numpy.int64)
+
+    def search_segments(self, bounds):
+        """Segments intersecting |bounds|, as a list of (segment table, rows) pairs."""
+        rows = self.search_segment_intersection(bounds)
+        table = self.segment_table
+        return [(table, rows[utility.intersect_many(table.bounds[rows], bounds)])]
+
+    def edge_segment_table(self, edge):
+        """Segment table holding the rows of |edge|."""
+        return self.segment_table
+
     def valid_circulation(self, edge):
+        if self.compiled is not None:
+            return bool(self.compiled.valid[self.compiled.edge_index(edge)])
         u, v, k = edge
         if self.graph[u][v][k]['sens'] == 0:
             return True
@@ -53,6 +367,8 @@ class SpatialGraph:
         return u, v, k
 
     def edge(self, edge):
+        if self.compiled is not None:
+            return self.compiled.attributes[self.compiled.edge_index(edge)]
         u, v, k = edge
         return self.graph[u][v][k]
 
@@ -73,66 +389,207 @@ class SpatialGraph:
     def node_geometry(self, i):
         return self.graph.node[i]['geometry']
 
-    # turn angle in radians. 0 is staight, negative is right.
-    def turn_angle(self, e1, e2):
-        _, v, _ = e1
+    def compile(self):
+        """Builds the CSR view of the graph, used by adjacency and edge attribute queries.
 
-        link0 = self.edge_geometry(e1)
-        p0 = link0.coords[-2]
+        It must be rebuilt after the graph is modified.
+        """
+        self.compiled = CompiledGraph.from_graph(self.graph, self.geometry)
+        return self.compiled
 
-        p1 = utility.point_to_vec(self.graph.node[v]['geometry'])
+    def node_coordinates(self):
+        """Node ids, and their (x, y) coordinates as a (node count x 2) array."""
+        nodes = list(self.graph.nodes(data=True))
+        return ([n for n, _ in nodes],
+                numpy.array([p['geometry'].coords[0][0:2] for _, p in nodes], dtype=float).reshape(-1, 2))
 
-        link1 = self.edge_geometry(e2)
-        p2 = link1.coords[1]
+    def spatial_node_entries(self):
+        for n, p in self.graph.nodes(data=True):
+            yield n, p['geometry'].bounds, None
 
-        v0 = numpy.array(p1) - numpy.array(p0)
-        v1 = numpy.array(p2) - numpy.array(p1)
-        return numpy.math.atan2(numpy.linalg.det([v0,v1]), numpy.dot(v0,v1))
+    def spatial_edge_entries(self):
+        for i, edge in enumerate(self.undirected_edges()):
+            yield i, self.edge_geometry(edge).bounds, edge
+
+    def build_spatial_node_index(self, filename=None, newer_than=None):
+        """Bulk loads the node R-tree, or reopens the one stored at |filename|.
+
+        A stored index older than file |newer_than| is rebuilt.
+        """
+        self.spatial_node_idx = spatial_index.load_or_build(
+            filename, self.spatial_node_entries, newer_than)
+
+    def build_spatial_edge_index(self, filename=None, newer_than=None):
+        """Bulk loads the edge R-tree, or reopens the one stored at |filename|.
+
+        A stored index older than file |newer_than| is rebuilt.
+        """
+        self.spatial_edge_idx = spatial_index.load_or_build(
+            filename, self.spatial_edge_entries, newer_than)
 
-    def build_spatial_node_index(self):
-        self.spatial_node_idx = rtree.index.Index()
-        for n,p in self.graph.nodes_iter(data=True):
-            self.spatial_node_idx.insert(n, p['geometry'].bounds)
+    def undirected_edges(self):
+        """Every edge of the graph once, in the orientation networkx lists it."""
+        return self.graph.edges(keys=True)
 
-    def build_spatial_edge_index(self):
-        self.spatial_edge_idx = rtree.index.Index()
-        for i,edge in enumerate(self.graph.edges_iter(keys=True)):
-            self.spatial_edge_idx.insert(i, self.edge_geometry(edge).bounds, obj=edge)
+    def build_segment_table(self):
+        edges = []
+        for u, v, k in self.undirected_edges():
+            edges.append((u, v, k))
+            edges.append((v, u, k))
+        self.segment_table = SegmentTable(edges, (self.edge_coordinates(edge) for edge in edges))
+        self.spatial_segment_idx = self.segment_table.build_spatial_index()
 
     def import_geobase(self, data, distance_threshold = 1.0):
-        for segment in data:
-            properties = segment['properties']
-
-            first_geom = sg.Point(segment['geometry'].coords[0])
-            last_geom = sg.Point(segment['geometry'].coords[-1])
-
-            def find_node(point, ignore):
-                nodes = self.spatial_node_idx.intersection(
-                    utility.bb_buffer(point, distance_threshold))
-                best = None
-                min_distance = numpy.inf
-                for k in nodes:
-                    if k == ignore:
-                        continue
-                    distance = point.distance(self.graph.node[k]['geometry'])
-                    if distance <= min_distance:
-                        min_distance = distance
-                        best = k
-                if best is None:
-                    best = self.graph.order()
-                    self.graph.add_node(best, geometry = point)
-                    self.spatial_node_idx.insert(best, point.bounds)
-                return best
-
-            first_node = find_node(first_geom, None)
-            last_node = find_node(last_geom, first_node)
-
-            self.graph.add_edge(first_node, last_node,
-                                order = first_node < last_node,
-                                **properties)
-            k = self.graph.number_of_edges(first_node, last_node)-1
-            self.geometry[first_node, last_node, k] = sg.LineString(segment['geometry'].coords)
-            self.geometry[last_node, first_node, k] = sg.LineString(reversed(segment['geometry'].coords))
+        """Adds the |data| segments to the graph, snapping their endpoints to nodes.
+
+        An endpoint is snapped to the closest node within a square window of half side
+        |distance_threshold|, or becomes a new node. The last endpoint of a segment is
+        never snapped to the node of its first one. All endpoints are matched in one
+        KD-tree pass before nodes and edges are added in bulk, which gives the same
+        topology as snapping segments one at a time.
+        New nodes are numbered past the largest node id of the graph. Segments cannot be
+        added to a compressed graph, whose chains no longer have their inner nodes, and
+        a ValueError is raised.
+        """
+        if self.contracted:
+            raise ValueError("cannot import segments into a compressed graph")
+        self.compiled = None
+        segments = [(segment['properties'], segment['geometry'].coords) for segment in data]
+        if not segments:
+            return
+
+        existing = list(self.graph.nodes(data=True))
+        node_xy = numpy.array([p['geometry'].coords[0][0:2] for _, p in existing],
+                              dtype=float).reshape(-1, 2)
+        endpoint_xy = numpy.array([coords[i][0:2] for _, coords in segments for i in (0, -1)],
+                                  dtype=float)
+        endpoints, created = snap_endpoints(
+            endpoint_xy, [n for n, _ in existing], node_xy,
+            max(self.graph) + 1 if len(self.graph) else 0, distance_threshold)
+
+        self.graph.add_nodes_from(
+            (endpoints[i], {'geometry': sg.Point(segments[i // 2][1][0 if i % 2 == 0 else -1])})
+            for i in created)
+
+        edges = []
+        keys = {}
+        for (properties, coords), first_node, last_node in zip(
+                segments, endpoints[0::2], endpoints[1::2]):
+            pair = (min(first_node, last_node), max(first_node, last_node))
+            if pair not in keys:
+                keys[pair] = self.graph.number_of_edges(first_node, last_node)
+            k = keys[pair]
+            keys[pair] += 1
+            edges.append((first_node, last_node, k,
+                          dict(order = first_node < last_node, **properties)))
+            self.geometry[first_node, last_node, k] = sg.LineString(coords)
+            self.geometry[last_node, first_node, k] = sg.LineString(list(reversed(coords)))
+        self.graph.add_edges_from(edges)
+        self.build_spatial_node_index()
+
+    def original_edges(self, edge):
+        """Edges of the graph before compression making up |edge|, in travel order.
+
+        Returns a list of (original edge, begin, end), where begin and end are distances
+        along |edge|.
+        """
+        if edge in self.contracted:
+            return self.contracted[edge]
+        return [(edge, 0.0, self.edge_geometry(edge).length)]
+
+    def compress(self, keep=()):
+        """Merges chains of degree-2 nodes into single edges.
+
+        A node is removed when it joins exactly two edges with the same 'type' and 'sens',
+        whose circulation agrees along the chain, and it is not in |keep|. Attributes of
+        a merged edge are those of its first edge, and its geometry is the concatenation
+        of the chain. Chains closing on themselves are kept.
+        Merged edges map back to the original ones through |original_edges|.
+        New nodes can not be imported afterward, as node ids are no longer dense.
+        Returns the number of removed nodes.
+        """
+        keep = set(keep)
+        graph = self.graph
+        self.compiled = None
+
+        def incident(n):
+            return [(n, v, k) for v, keys in graph[n].items() for k in keys]
+
+        def compatible(e1, e2):
+            # e1 enters the node, e2 leaves it
+            d1, d2 = self.edge(e1), self.edge(e2)
+            if d1.get('type') != d2.get('type') or d1.get('sens') != d2.get('sens'):
+                return False
+            return d1.get('sens', 0) == 0 or self.ordered(e1) == self.ordered(e2)
+
+        removable = set()
+        for n in graph.nodes():
+            if n in keep or graph.degree(n) != 2:
+                continue
+            edges = incident(n)
+            if len(edges) != 2 or any(v == n for _, v, _ in edges):
+                continue
+            (_, a, ka), e2 = edges
+            if compatible((a, n, ka), e2):
+                removable.add(n)
+
+        def walk(edge):
+            """Chain of edges starting with |edge|, up to a node that is not removable."""
+            chain = [edge]
+            while chain[-1][1] in removable and chain[-1][1] != edge[0]:
+                u, v, k = chain[-1]
+                nxt = [e for e in incident(v) if (e[1], e[2]) != (u, k)]
+                if len(nxt) != 1:
+                    break
+                chain.append(nxt[0])
+            return chain
+
+        removed = 0
+        visited = set()
+        for n in list(graph.nodes()):
+            if n not in removable or n in visited:
+                continue
+            (_, a, ka), (_, b, kb) = incident(n)
+            backward = walk((n, a, ka))
+            forward = walk((n, b, kb))
+            chain = [(v, u, k) for u, v, k in reversed(backward)] + forward
+            nodes = [v for _, v, _ in chain[:-1]]
+            visited.update(nodes)
+            s, t = chain[0][0], chain[-1][1]
+            if s == t or len(set(nodes)) != len(nodes):
+                continue
+
+            original = []
+            coordinates = []
+            distance = 0.0
+            for edge in chain:
+                for inner, begin, end in self.original_edges(edge):
+                    original.append((inner, distance + begin, distance + end))
+                coords = list(self.edge_coordinates(edge))
+                coordinates.extend(coords if not coordinates else coords[1:])
+                distance += self.edge_geometry(edge).length
+            data = dict(self.edge(chain[0]))
+            data['order'] = utility.xor(self.ordered(chain[0]), s > t)
+
+            for edge in chain:
+                u, v, k = edge
+                self.geometry.pop((u, v, k), None)
+                self.geometry.pop((v, u, k), None)
+                self.contracted.pop((u, v, k), None)
+                self.contracted.pop((v, u, k), None)
+            graph.remove_nodes_from(nodes)
+            removed += len(nodes)
+
+            graph.add_edge(s, t, **data)
+            k = graph.number_of_edges(s, t) - 1
+            self.geometry[s, t, k] = sg.LineString(coordinates)
+            self.geometry[t, s, k] = sg.LineString(list(reversed(coordinates)))
+            self.contracted[s, t, k] = original
+            self.contracted[t, s, k] = [((v, u, k), distance - end, distance - begin)
+                                        for (u, v, k), begin, end in reversed(original)]
+
+        self.build_spatial_node_index()
+        return removed
 
     def make_shp(self):
         sf = shapefile.Writer(shapefile.POLYLINE)
@@ -169,8 +626,17 @@ class SpatialGraph:
             del odict['spatial_node_idx']
         if 'spatial_edge_idx' in odict:
             del odict['spatial_edge_idx']
+        if 'spatial_segment_idx' in odict:
+            del odict['spatial_segment_idx']
+        if 'segment_table' in odict:
+            del odict['segment_table']
+        odict['ubodt'] = None
+        odict['compiled'] = None
         return odict
 
     def __setstate__(self, odict):
+        self.ubodt = None
+        self.compiled = None
+        self.contracted = {}
         self.__dict__.update(odict)
 
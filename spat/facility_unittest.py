@@ -0,0 +1,124 @@
+import unittest
+import shapely.geometry as sg
+
+from spat import facility, testing
+
+
+class TestCompiledGraph(unittest.TestCase):
+
+    def test_compiled_queries(self):
+        graph = testing.make_graph()
+        nodes = list(graph.graph.nodes())
+        adjacent = {u: list(graph.adjacent(u)) for u in nodes}
+        edges = [edge for u in nodes for edge in adjacent[u]]
+        valid = {edge: graph.valid_circulation(edge) for edge in edges}
+        attributes = {edge: graph.edge(edge) for edge in edges}
+
+        compiled = graph.compile()
+        self.assertEqual(len(compiled), 8)
+        # compiled adjacency is sorted by target and key
+        self.assertEqual({u: list(graph.adjacent(u)) for u in nodes},
+                         {u: sorted(edges) for u, edges in adjacent.items()})
+        self.assertEqual({edge: graph.valid_circulation(edge) for edge in edges}, valid)
+        self.assertEqual({edge: graph.edge(edge) for edge in edges}, attributes)
+
+        for i, (u, v, k) in enumerate(compiled.edges):
+            self.assertEqual(compiled.edge_id[u, v, k], i)
+            self.assertIn(i, compiled.adjacent_ids(u))
+            self.assertEqual((compiled.source[i], compiled.target[i], compiled.key[i]), (u, v, k))
+            self.assertEqual(compiled.type[i], graph.edge((u, v, k))['type'])
+            self.assertAlmostEqual(compiled.length[i], graph.edge_geometry((u, v, k)).length)
+            self.assertEqual(compiled.edge_index((u, v, k)), i)
+        self.assertEqual(compiled.edges, sorted(edges))
+        self.assertEqual(compiled.edge_indices(*zip(*edges)).tolist(), [compiled.edge_id[edge] for edge in edges])
+        self.assertRaises(KeyError, compiled.edge_index, (0, 1, 1))
+        self.assertRaises(KeyError, compiled.edge_index, (9, 1, 0))
+        self.assertRaises(KeyError, compiled.edge_indices, [0, 0], [1, 2], [0, 2])
+
+
+class TestImportGeobase(unittest.TestCase):
+
+    def segments(self, lines):
+        return [{'properties': {'id': i}, 'geometry': sg.LineString(line)}
+                for i, line in enumerate(lines)]
+
+    def test_snapping(self):
+        graph = facility.SpatialGraph()
+        graph.import_geobase(self.segments([
+            [(0.0, 0.0), (10.0, 0.0)],
+            [(10.5, 0.5), (10.0, 10.0)],
+            # short segment, both ends within the threshold of each other
+            [(10.0, 10.0), (10.2, 10.2)],
+            # closer to the last node created at (10.2, 10.2)
+            [(10.2, 10.1), (0.9, 0.9)],
+            [(0.0, 0.0), (10.0, 0.0)],
+        ]), distance_threshold=1.0)
+        edges = sorted((d['id'], min(u, v), max(u, v)) for u, v, d in graph.graph.edges(data=True))
+        self.assertEqual(edges, [(0, 0, 1), (1, 1, 2), (2, 2, 3), (3, 0, 3), (4, 0, 1)])
+        self.assertEqual(graph.graph.order(), 4)
+        self.assertEqual(graph.graph.number_of_edges(0, 1), 2)
+        self.assertEqual(list(graph.edge_geometry((1, 0, 1)).coords), [(10.0, 0.0), (0.0, 0.0)])
+        self.assertTrue(graph.graph.nodes[3]['geometry'].equals(sg.Point(10.2, 10.2)))
+
+        graph.import_geobase(self.segments([[(0.5, -0.5), (-10.0, 0.0)]]), distance_threshold=1.0)
+        self.assertEqual(graph.graph.order(), 5)
+        self.assertTrue(graph.graph.has_edge(0, 4))
+        self.assertEqual(list(graph.search_node_intersection((-11.0, -1.0, -9.0, 1.0))), [4])
+
+    def test_node_ids(self):
+        graph = facility.SpatialGraph()
+        graph.import_geobase(self.segments([[(0.0, 0.0), (10.0, 0.0)], [(10.0, 0.0), (20.0, 0.0)]]))
+        graph.graph.remove_node(1)
+        # new nodes come after the largest id, not after the node count
+        graph.import_geobase(self.segments([[(30.0, 0.0), (40.0, 0.0)]]))
+        self.assertEqual(sorted(graph.graph.nodes()), [0, 2, 3, 4])
+
+
+class TestCompress(unittest.TestCase):
+
+    def make_graph(self, lines):
+        graph = facility.SpatialGraph()
+        graph.import_geobase([{'properties': {'way_id': i, 'type': t, 'sens': sens},
+                               'geometry': sg.LineString(line)}
+                              for i, (line, t, sens) in enumerate(lines)])
+        return graph
+
+    def test_compress(self):
+        graph = self.make_graph([
+            ([(0.0, 0.0), (10.0, 0.0)], 1, 0),
+            ([(20.0, 0.0), (10.0, 0.0)], 1, 0),
+            ([(20.0, 0.0), (25.0, 5.0), (30.0, 0.0)], 1, 0),
+            ([(30.0, 0.0), (30.0, 10.0)], 2, 0),
+            ([(30.0, 0.0), (40.0, 0.0)], 1, 1),
+            ([(40.0, 0.0), (50.0, 0.0)], 1, 1),
+            ([(60.0, 0.0), (50.0, 0.0)], 1, 1),
+        ])
+        self.assertEqual(graph.compress(), 3)
+        self.assertEqual(sorted(graph.graph.nodes()), [0, 3, 4, 6, 7])
+
+        edge = (0, 3, 0)
+        self.assertEqual(list(graph.edge_coordinates(edge)),
+                         [(0.0, 0.0), (10.0, 0.0), (20.0, 0.0), (25.0, 5.0), (30.0, 0.0)])
+        self.assertEqual(graph.edge(edge)['way_id'], 0)
+        original = graph.original_edges(edge)
+        self.assertEqual([e for e, _, _ in original], [(0, 1, 0), (1, 2, 0), (2, 3, 0)])
+        self.assertAlmostEqual(original[2][1], 20.0)
+        self.assertAlmostEqual(original[2][2], graph.edge_geometry(edge).length)
+        reverse = graph.original_edges((3, 0, 0))
+        self.assertEqual([e for e, _, _ in reverse], [(3, 2, 0), (2, 1, 0), (1, 0, 0)])
+        self.assertAlmostEqual(reverse[0][2], original[2][2] - original[2][1])
+
+        # the one way chain merges up to the edge drawn backward
+        self.assertEqual([e for e, _, _ in graph.original_edges((3, 6, 0))], [(3, 5, 0), (5, 6, 0)])
+        self.assertTrue(graph.valid_circulation((3, 6, 0)))
+        self.assertFalse(graph.valid_circulation((6, 3, 0)))
+        self.assertEqual(graph.original_edges((6, 7, 0)), [((6, 7, 0), 0.0, 10.0)])
+        self.assertEqual(sorted(graph.search_node_intersection((-1.0, -1.0, 21.0, 1.0))), [0])
+
+        with self.assertRaises(ValueError):
+            graph.import_geobase([{'properties': {'way_id': 7, 'type': 1, 'sens': 0},
+                                   'geometry': sg.LineString([(60.0, 0.0), (70.0, 0.0)])}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import json
+import itertools
+
+
+class _Reader:
+    """Text buffer over a file, refilled by chunks as values are decoded."""
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self, skip=''):
+        """Next character that is not whitespace or in |skip|, or None at the end."""
+        while True:
+            while self.position < len(self.buffer):
+                c = self.buffer[self.position]
+                if not c.isspace() and c not in skip:
+                    return c
+                self.position += 1
+            if not self.fill():
+                return None
+
+    def expect(self, c, skip=''):
+        found = self.peek(skip)
+        if found != c:
+            raise ValueError("expected %r in GeoJSON stream, found %r" % (c, found))
+        self.position += 1
+
+    def decode(self):
+        """Decodes the next value, reading more chunks until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # a number may go on in the next chunk
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.position = end
+            return value
+
+
+def read_features(f, chunk_size=1 << 20):
+    """Yields the features of the GeoJSON FeatureCollection in file |f|, one at a time.
+
+    The file is read by chunks of |chunk_size| characters and features are decoded as
+    soon as they are complete, so the whole collection is never held in memory.
+    Other members of the collection are decoded and dropped.
+    """
+    reader = _Reader(f, chunk_size)
+    reader.expect('{')
+    while reader.peek(',') != '}':
+        key = reader.decode()
+        reader.expect(':')
+        if key != 'features':
+            reader.decode()
+            continue
+        reader.expect('[')
+        while reader.peek(',') != ']':
+            yield reader.decode()
+        reader.expect(']')
+
+
+def batches(iterable, size):
+    """Splits |iterable| into lists of |size| items, the last one possibly shorter."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
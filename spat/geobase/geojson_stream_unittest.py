@@ -0,0 +1,30 @@
+import io
+import json
+import unittest
+
+from spat.geobase import geojson_stream
+
+
+class TestGeojsonStream(unittest.TestCase):
+
+    def test_read_features(self):
+        features = [{'type': 'Feature', 'properties': {'id': i, 'name': 'features]}'},
+                     'geometry': {'type': 'LineString', 'coordinates': [[i, 1.25], [i + 1, -3e-2]]}}
+                    for i in range(20)]
+        collection = {'type': 'FeatureCollection', 'crs': {'features': [1, 2]},
+                      'features': features, 'count': 12345}
+        text = json.dumps(collection, indent=2)
+        for chunk_size in (1, 7, 1 << 20):
+            read = list(geojson_stream.read_features(io.StringIO(text), chunk_size))
+            self.assertEqual(read, features)
+        self.assertEqual(list(geojson_stream.read_features(io.StringIO('{"features": []}'))), [])
+        with self.assertRaises(ValueError):
+            list(geojson_stream.read_features(io.StringIO('[]')))
+
+    def test_batches(self):
+        self.assertEqual(list(geojson_stream.batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(geojson_stream.batches([], 2)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import sys, argparse, time
+import numpy
+
+from spat import bundle, spatial_index
+
+
+def compare(name, entries, queries):
+    start_time = time.time()
+    incremental = spatial_index.incremental_load(entries)
+    incremental_time = time.time() - start_time
+
+    start_time = time.time()
+    packed = spatial_index.bulk_load(entries)
+    packed_time = time.time() - start_time
+
+    incremental_query, incremental_count = spatial_index.benchmark(incremental, queries)
+    packed_query, packed_count = spatial_index.benchmark(packed, queries)
+    assert incremental_count == packed_count
+
+    print('%s index: %d entries, %d queries, %d results' % (name, len(entries), len(queries), packed_count))
+    print('  incremental: build %.3fs, query %.3fs (%.1f us/query)' %
+          (incremental_time, incremental_query, 1e6 * incremental_query / len(queries)))
+    print('  packed:      build %.3fs, query %.3fs (%.1f us/query)' %
+          (packed_time, packed_query, 1e6 * packed_query / len(queries)))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="""
+      Compare query performance of STR packed and incrementally built R-trees
+      over the nodes and edges of a facility graph.
+      """, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--facility', default='data/mtl_geobase/mtl.pickle',
+                        help='input pickle file or bundle directory containing the facility graph, not a tiled facility')
+    parser.add_argument('--queries', type=int, default=100000,
+                        help='number of random query windows')
+    parser.add_argument('--size', type=float, default=50.0,
+                        help='side of the query windows')
+
+    args = parser.parse_args()
+    print('facility:', args.facility)
+
+    graph = bundle.open_graph(args.facility, tiled=False)
+    nodes = list(graph.spatial_node_entries())
+    edges = list(graph.spatial_edge_entries())
+
+    bounds = numpy.array([entry[1] for entry in edges])
+    extent = (bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max())
+    queries = spatial_index.random_windows(extent, args.size, args.queries)
+
+    compare('node', nodes, queries)
+    compare('edge', edges, queries)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
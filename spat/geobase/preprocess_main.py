@@ -1,26 +1,35 @@
-import sys, argparse
+import sys, argparse, logging
 import pickle, json
+import functools
+import numpy
 import pyproj
 import shapely.geometry as sg
 
-from spat import facility
+from spat import facility, ubodt, bundle, parallel
+from spat.geobase import geojson_stream
 
 
-def preprocess_road(data):
-    src_proj = pyproj.Proj(init='epsg:4326')
-    dst_proj = pyproj.Proj(init='epsg:2950')
+@functools.lru_cache(maxsize=None)
+def road_transformer():
+    """Transformer of road coordinates, created once per process."""
+    return pyproj.Transformer.from_crs('epsg:4326', 'epsg:2950', always_xy=True)
 
-    for segment in data['features']:
-        geometry = []
-        for point in segment['geometry']['coordinates']:
-            coord = pyproj.transform(src_proj, dst_proj,
-                                   float(point[0]),
-                                   float(point[1]))
-            geometry.append(coord)
+
+def preprocess_road(features):
+    """Segments of road |features|, reprojected in a single transformer call."""
+    features = list(features)
+    coordinates = [numpy.array(segment['geometry']['coordinates'], dtype=float)[:, 0:2]
+                   for segment in features]
+    if not coordinates:
+        return
+    x, y = road_transformer().transform(*numpy.concatenate(coordinates).T)
+    xy = numpy.column_stack((x, y))
+    offsets = numpy.cumsum([0] + [len(c) for c in coordinates])
+    for segment, begin, end in zip(features, offsets[:-1], offsets[1:]):
         properties = segment['properties']
 
         yield {
-            'geometry': sg.LineString(geometry),
+            'geometry': sg.LineString(xy[begin:end]),
             'properties': {
                 'way_id': properties['ID_TRC'],
                 'type': properties['CLASSE'],
@@ -29,9 +38,9 @@ def preprocess_road(data):
         }
 
 
-def preprocess_cycling(data):
-    for segment in data['features']:
-        geometry = sg.asShape(segment['geometry'])
+def preprocess_cycling(features):
+    for segment in features:
+        geometry = sg.shape(segment['geometry'])
         p = segment['properties']
         properties = {
             'way_id': p['ID'],
@@ -39,19 +48,31 @@ def preprocess_cycling(data):
             'type': p['TYPE_VOIE'] + 10,
             'sens': 0,
         }
-        if (geometry.type == 'LineString'):
+        if (geometry.geom_type == 'LineString'):
             yield {
-                'geometry': sg.asShape(segment['geometry']),
+                'geometry': geometry,
                 'properties': properties
             }
-        elif (geometry.type == 'MultiLineString'):
-            for line in geometry:
+        elif (geometry.geom_type == 'MultiLineString'):
+            for line in geometry.geoms:
                 yield {
                     'geometry': line,
                     'properties': properties
                 }
 
 
+def read_segments(filename, preprocess, workers, batch_size):
+    """Streams the features of GeoJSON |filename| and preprocesses them into segments.
+
+    Batches of |batch_size| features are preprocessed by |workers| processes, and their
+    segments are yielded in file order.
+    """
+    with open(filename, 'r') as f:
+        batches = geojson_stream.batches(geojson_stream.read_features(f), batch_size)
+        for segments in parallel.fork_map(lambda batch: list(preprocess(batch)), batches, workers):
+            yield from segments
+
+
 def main(argv):
     parser = argparse.ArgumentParser(description="""
       Preprocess montreal geobase into a facility graph.
@@ -63,6 +84,30 @@ def main(argv):
       Supported formats include *.json, *.csv""")
     parser.add_argument('--geojson',
                         help='output geojson file to export constrained geometry')
+    parser.add_argument('--bundle',
+                        help='output directory of the binary bundle of the graph, loaded with memory mapping')
+    parser.add_argument('--compress', action='store_true',
+                        help="""merge chains of degree-2 nodes whose edges share type and direction.
+    Merged edges keep a mapping back to the original ones""")
+    parser.add_argument('--original',
+                        help="""output pickle file of the graph before compression. Trajectories mapmatched
+    with --original_edges lie on its edges, and it is the facility to pass to the tools reading them""")
+    parser.add_argument('--tiles',
+                        help='output directory of the tiled graph, whose tiles are loaded on demand')
+    parser.add_argument('--tile_size', type=float, default=2000.0,
+                        help='side of the square tiles of the tiled graph')
+    parser.add_argument('--ubodt',
+                        help='output npy file of the upper-bounded origin-destination table of the graph')
+    parser.add_argument('--ubodt_distance', type=float, default=1000.0,
+                        help='upper bound on the network distance between pairs of the UBODT')
+    parser.add_argument('--road', default='data/mtl_geobase/road.json',
+                        help='input geojson file of the road network')
+    parser.add_argument('--cycling', default='data/mtl_geobase/cycling.json',
+                        help='input geojson file of the cycling network')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes preprocessing features')
+    parser.add_argument('--batch_size', type=int, default=1000,
+                        help='number of features sent to a worker at once')
 
     args = parser.parse_args()
     print('output file:', args.ofile)
@@ -70,15 +115,29 @@ def main(argv):
     distance_threshold = 6.0
 
     graph = facility.SpatialGraph()
-    graph.build_spatial_node_index()
-    with open("data/mtl_geobase/road.json", 'r') as f:
-        graph.import_geobase(preprocess_road(json.load(f)), distance_threshold)
-    with open("data/mtl_geobase/cycling.json", 'r') as f:
-        graph.import_geobase(preprocess_cycling(json.load(f)), distance_threshold)
+    graph.import_geobase(read_segments(args.road, preprocess_road, args.workers, args.batch_size),
+                         distance_threshold)
+    graph.import_geobase(read_segments(args.cycling, preprocess_cycling, args.workers, args.batch_size),
+                         distance_threshold)
+    if args.compress:
+        if args.original is not None:
+            with open(args.original, 'wb+') as f:
+                pickle.dump(graph, f)
+        logging.info("compression removed %d nodes", graph.compress())
+    logging.info("facility graph: %d nodes, %d edges", graph.graph.order(), graph.graph.size())
 
     with open(args.ofile, 'wb+') as f:
         pickle.dump(graph, f)
 
+    if args.bundle is not None:
+        bundle.save(graph, args.bundle)
+
+    if args.tiles is not None:
+        bundle.save_tiles(graph, args.tiles, args.tile_size)
+
+    if args.ubodt is not None:
+        ubodt.build(graph, args.ubodt_distance).save(args.ubodt)
+
     if args.geojson is not None:
         with open(args.geojson, 'w+') as f:
             json.dump(graph.make_geojson(2150), f, indent=2)
@@ -1,6 +1,6 @@
 import math
 import numpy as np
-from scipy import linalg
+from scipy import linalg, special
 
 
 def xcov(X, Y):
@@ -14,7 +14,7 @@ def logerfc(x):
 
     t = 1.0 / (1.0 + 0.5 * x)
     # use Horner's method
-    return math.log(t) - x*x + (-1.26551223 +
+    return np.log(t) - x*x + (-1.26551223 +
                                 t * ( 1.00002368 +
                                       t * ( 0.37409196 +
                                             t * ( 0.09678418 +
@@ -115,11 +115,219 @@ def truncate_gaussian(a, b):
     return l, u * sign, var
 
 
+def truncate_gaussian_many(a, b):
+    """Vectorized |truncate_gaussian| over arrays of bounds.
+
+    Elements for which the truncated distribution can't be evaluated
+    (where the scalar version raises ValueError) have a non-finite log probability.
+
+    Args:
+      a: left bounds
+      b: right bounds
+
+    Returns:
+      log of probability
+      updated mean
+      updated variance
+    """
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=float), np.asarray(b, dtype=float))
+    l = np.empty(a.shape)
+    u = np.empty(a.shape)
+    var = np.empty(a.shape)
+    alpha = math.sqrt(2) / (2 * math.sqrt(math.pi))
+
+    with np.errstate(all='ignore'):
+        right = a == -np.inf
+        left = ~right & (b == np.inf)
+        both = ~right & ~left
+
+        # x < b
+        d = b[right]
+        l[right] = np.where(d < 0.0,
+                            logerfc(-d / math.sqrt(2)) - math.log(2),
+                            np.log(special.erfc(-d / math.sqrt(2)) / 2))
+        c = np.exp(-(d*d) / 2 - l[right])
+        u[right] = -alpha * c
+        var[right] = -alpha * c * (d - 2*u[right]) + u[right]**2 + 1.0
+
+        # a < x
+        c = a[left]
+        l[left] = np.where(c > 0.0,
+                           logerfc(c / math.sqrt(2)) - math.log(2),
+                           np.log(special.erfc(c / math.sqrt(2)) / 2))
+        e = np.exp(-(c*c) / 2 - l[left])
+        u[left] = alpha * e
+        var[left] = alpha * e * (c - 2*u[left]) + u[left]**2 + 1.0
+
+        # a < x < b
+        c = a[both]
+        d = b[both]
+        straddle = np.sign(c) != np.sign(d)
+        sign = np.where(straddle, 1.0, np.sign(c))
+        flip = sign < 0
+        c, d = np.where(flip, -d, c), np.where(flip, -c, d)
+        e = logerfc(c / math.sqrt(2))
+        f = logerfc(d / math.sqrt(2))
+        l[both] = np.where(straddle,
+                           np.log((special.erf(d / math.sqrt(2)) - special.erf(c / math.sqrt(2))) / 2),
+                           e + np.log(1.0 - np.exp(f - e)) - math.log(2))
+        g = np.exp(-(c*c) / 2 - l[both])
+        h = np.exp(-(d*d) / 2 - l[both])
+        mean = alpha * (g - h)
+        u[both] = mean * sign
+        var[both] = alpha * (g * (c - 2*mean) - h * (d - 2*mean)) + mean**2 + 1.0
+
+    return l, u, var
+
+
+def inv2(A):
+    """Closed-form inverse of a stack of 2x2 matrices (...x2x2)."""
+    A = np.asarray(A)
+    det = A[..., 0, 0] * A[..., 1, 1] - A[..., 0, 1] * A[..., 1, 0]
+    inverse = np.empty(A.shape)
+    inverse[..., 0, 0] = A[..., 1, 1]
+    inverse[..., 0, 1] = -A[..., 0, 1]
+    inverse[..., 1, 0] = -A[..., 1, 0]
+    inverse[..., 1, 1] = A[..., 0, 0]
+    return inverse / det[..., None, None]
+
+
+def det2(A):
+    """Determinant of a stack of 2x2 matrices (...x2x2)."""
+    return A[..., 0, 0] * A[..., 1, 1] - A[..., 0, 1] * A[..., 1, 0]
+
+
+def inv3(A):
+    """Closed-form inverse of a stack of 3x3 matrices (...x3x3)."""
+    A = np.asarray(A)
+    a, b, c = A[..., 0, 0], A[..., 0, 1], A[..., 0, 2]
+    d, e, f = A[..., 1, 0], A[..., 1, 1], A[..., 1, 2]
+    g, h, i = A[..., 2, 0], A[..., 2, 1], A[..., 2, 2]
+    inverse = np.empty(A.shape)
+    inverse[..., 0, 0] = e*i - f*h
+    inverse[..., 0, 1] = c*h - b*i
+    inverse[..., 0, 2] = b*f - c*e
+    inverse[..., 1, 0] = f*g - d*i
+    inverse[..., 1, 1] = a*i - c*g
+    inverse[..., 1, 2] = c*d - a*f
+    inverse[..., 2, 0] = d*h - e*g
+    inverse[..., 2, 1] = b*g - a*h
+    inverse[..., 2, 2] = a*e - b*d
+    det = a * inverse[..., 0, 0] + b * inverse[..., 1, 0] + c * inverse[..., 2, 0]
+    return inverse / det[..., None, None]
+
+
+def inv4(A):
+    """Closed-form inverse of a stack of 4x4 matrices (...x4x4) by 2x2 blocks.
+
+    The upper left block must be invertible, which holds for covariance matrices.
+    """
+    A = np.asarray(A)
+    B = A[..., 0:2, 2:4]
+    C = A[..., 2:4, 0:2]
+    Ai = inv2(A[..., 0:2, 0:2])
+    AiB = np.matmul(Ai, B)
+    CAi = np.matmul(C, Ai)
+    Si = inv2(A[..., 2:4, 2:4] - np.matmul(C, AiB))
+    inverse = np.empty(A.shape)
+    inverse[..., 0:2, 0:2] = Ai + np.matmul(np.matmul(AiB, Si), CAi)
+    inverse[..., 0:2, 2:4] = -np.matmul(AiB, Si)
+    inverse[..., 2:4, 0:2] = -np.matmul(Si, CAi)
+    inverse[..., 2:4, 2:4] = Si
+    return inverse
+
+
+def det4(A):
+    """Closed-form determinant of a stack of 4x4 matrices (...x4x4) by 2x2 blocks."""
+    A = np.asarray(A)
+    Ai = inv2(A[..., 0:2, 0:2])
+    S = A[..., 2:4, 2:4] - np.matmul(np.matmul(A[..., 2:4, 0:2], Ai), A[..., 0:2, 2:4])
+    return det2(A[..., 0:2, 0:2]) * det2(S)
+
+
+def unscented_measurment_update(x, P, y, h, R):
+    """Array version of |KalmanFilter.unscented_measurment_update|.
+
+    Args:
+      x, P: state mean and covariance.
+      y: observation.
+      h: observation model, maps an array of sigma points (2n x n)
+        to their observations (2n x m).
+      R: observation covariance.
+
+    Returns:
+      updated mean
+      updated covariance
+      measurment distance
+    """
+    n = x.shape[0]
+    m = len(y)
+    w, V = np.linalg.eigh(n * P)
+    noise = np.dot(V * np.sqrt(np.maximum(w, 0.0)), V.T)
+    sigmax = np.concatenate((x + noise, x - noise))
+    sigmay = h(sigmax)
+
+    dx = sigmax - np.mean(sigmax, 0)
+    mean = np.mean(sigmay, 0)
+    dy = sigmay - mean
+    Py = np.dot(dy.T, dy) / (2*n) + R
+    Pxy = np.dot(dx.T, dy) / (2*n)
+    S = inv2(Py) if m == 2 else inv3(Py) if m == 3 else np.linalg.inv(Py)
+    z = np.asarray(y) - mean
+    K = np.dot(Pxy, S)
+    distance = np.dot(np.dot(S, z), z)
+    return x + np.dot(K, z), P - np.dot(np.dot(K, Py), K.T), distance / 2
+
+
+def rts_smooth(x, P, F, Q):
+    """Rauch-Tung-Striebel smoother over a whole sequence of filtered states.
+
+    Equivalent to chaining |KalmanFilter.smooth_update| backward from the last state.
+    Smoother gains only depend on filtered covariances, so they are computed for every
+    step at once, leaving a backward recursion of small matrix products.
+
+    Args:
+      x, P: filtered means (T x n) and covariances (T x n x n).
+      F, Q: transition and process noise, either one n x n matrix
+        or one per step, (T-1) x n x n, where step t goes from state t to t+1.
+
+    Returns:
+      smoothed means and covariances
+    """
+    x = np.array(x, dtype=float)
+    P = np.array(P, dtype=float)
+    F = np.broadcast_to(np.asarray(F, dtype=float), P[:-1].shape)
+    Q = np.broadcast_to(np.asarray(Q, dtype=float), P[:-1].shape)
+
+    predicted_x = np.einsum('tij,tj->ti', F, x[:-1])
+    predicted_P = np.matmul(np.matmul(F, P[:-1]), F.transpose(0, 2, 1)) + Q
+    inverse = inv4(predicted_P) if P.shape[1] == 4 else np.linalg.inv(predicted_P)
+    gain = np.matmul(np.matmul(P[:-1], F.transpose(0, 2, 1)), inverse)
+
+    for t in reversed(range(len(x) - 1)):
+        K = gain[t]
+        x[t] += np.dot(K, x[t+1] - predicted_x[t])
+        P[t] -= np.dot(np.dot(K, predicted_P[t] - P[t+1]), K.T)
+    return x, P
+
+
 class KalmanFilter:
     def __init__(self, initial_state, initial_state_covariance):
         self.x = np.array(initial_state)
         self.P = np.matrix(initial_state_covariance)
 
+    @classmethod
+    def view(cls, x, P):
+        """Wraps existing arrays without copying them.
+
+        In-place updates (measurment and constraint updates) write through to |x| and |P|,
+        updates that rebind the state (time and smooth updates) don't.
+        """
+        state = cls.__new__(cls)
+        state.x = x
+        state.P = np.asmatrix(P)
+        return state
+
     def copy(self):
         return KalmanFilter(self.x, self.P)
 
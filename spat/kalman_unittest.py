@@ -0,0 +1,67 @@
+import unittest
+import numpy as np
+
+from spat import kalman
+
+
+class TestKalman(unittest.TestCase):
+
+    def test_truncate_gaussian_many(self):
+        bounds = [(-np.inf, 0.5), (-np.inf, -3.0), (1.2, np.inf), (-0.7, np.inf),
+                  (-1.0, 2.0), (0.5, 4.0), (-6.0, -2.5), (3.0, 3.5)]
+        a, b = np.array(bounds).T
+        l, u, var = kalman.truncate_gaussian_many(a, b)
+        for i, (ai, bi) in enumerate(bounds):
+            expected = kalman.truncate_gaussian(ai, bi)
+            np.testing.assert_allclose([l[i], u[i], var[i]], expected, rtol=1e-9, atol=1e-12)
+
+    def test_truncate_gaussian_many_invalid(self):
+        self.assertRaises(ValueError, kalman.truncate_gaussian, 2.0, 2.0)
+        l, u, var = kalman.truncate_gaussian_many([2.0], [2.0])
+        self.assertFalse(np.isfinite(l[0]))
+
+    def test_inv2(self):
+        A = np.array([[[4.0, 1.0], [1.0, 3.0]], [[2.0, -1.0], [0.5, 1.0]]])
+        np.testing.assert_allclose(kalman.inv2(A), np.linalg.inv(A))
+
+    def test_inv4_det4(self):
+        rng = np.random.RandomState(0)
+        M = rng.randn(3, 4, 4)
+        A = np.matmul(M, M.transpose(0, 2, 1)) + np.identity(4)
+        np.testing.assert_allclose(kalman.inv4(A), np.linalg.inv(A), atol=1e-12)
+        np.testing.assert_allclose(kalman.det4(A), np.linalg.det(A))
+        np.testing.assert_allclose(kalman.inv3(A[:, 0:3, 0:3]), np.linalg.inv(A[:, 0:3, 0:3]), atol=1e-12)
+
+    def test_unscented_measurment_update(self):
+        def h(x):
+            return np.stack((x[..., 0], x[..., 1], np.hypot(x[..., 2], x[..., 3])), axis=-1)
+
+        state = kalman.KalmanFilter([1.0, 2.0, 3.0, -1.0], np.identity(4) * 4.0 + 0.5)
+        R = np.diag([2.0, 3.0, 1.0])
+        y = [1.5, 1.0, 2.0]
+        x, P, distance = kalman.unscented_measurment_update(state.x, np.asarray(state.P), y, h, R)
+        expected = state.unscented_measurment_update(y, h, R)
+        self.assertAlmostEqual(distance, expected)
+        np.testing.assert_allclose(x, state.x)
+        np.testing.assert_allclose(P, state.P, atol=1e-12)
+
+    def test_rts_smooth(self):
+        rng = np.random.RandomState(1)
+        F = np.identity(4)
+        F[0][2] = 1.0
+        F[1][3] = 1.0
+        Q = np.diag([2.0, 2.0, 2.0, 2.0])
+        states = []
+        for t in range(20):
+            M = rng.randn(4, 4)
+            states.append(kalman.KalmanFilter(rng.randn(4) * 10.0, np.dot(M, M.T) + np.identity(4)))
+
+        x, P = kalman.rts_smooth([s.x for s in states], [np.asarray(s.P) for s in states], F, Q)
+        for t in reversed(range(len(states) - 1)):
+            states[t].smooth_update(states[t+1], F, Q)
+        np.testing.assert_allclose(x, [s.x for s in states], atol=1e-9)
+        np.testing.assert_allclose(P, [s.P for s in states], atol=1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,9 @@
 import math
 import logging
+import array
 
 #from fibonacci_heap_mod import Fibonacci_heap
-from spat.priority_queue import PriorityQueue
+from spat.priority_queue import IndexedPriorityQueue, BoundedPriorityQueue
 
 
 def no_handicap(key):
@@ -37,9 +38,23 @@ class MarkovGraph:
 
     def find_best(self, origin, goal, heuristic_fcn,
                   priority_threshold=math.inf, progress_fcn=None,
-                  max_visited=None):
-
-        queue = PriorityQueue()
+                  max_visited=None, max_queue=None):
+        """Finds the lowest cost path from |origin| to |goal| with A*.
+
+        Returns the keys of the path, or None if |goal| was not reached.
+        |max_visited| bounds the number of visited states. |max_queue| bounds the number of
+        queued states, turning the search into a beam search that drops the states with
+        the highest priority.
+        """
+
+        # Keys are interned to dense ids on discovery. Search state is kept in arrays
+        # indexed by id, and the queue holds each id once with decrease-key.
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        search = SearchState()
+        if max_queue is None:
+            queue = IndexedPriorityQueue()
+        else:
+            queue = BoundedPriorityQueue(max_queue)
 
         origin_node = self.state_projection(origin)
 
@@ -47,48 +62,46 @@ class MarkovGraph:
         handicap_cost = self.handicap_fcn(origin_node)
         heuristic = heuristic_fcn(origin_node)
 
-        queue.put(origin, cost + handicap_cost + heuristic)
-        cost_table = {
-            origin: (cost, cost + handicap_cost)
-        }
-        priority_table = {
-            origin: cost + handicap_cost + heuristic
-        }
-        backtrack_chain = {
-            origin: None
-        }
-        visited = {}
+        origin_id = search.intern(origin)
+        search.update(origin_id, cost, -1, cost + handicap_cost + heuristic)
+        queue.put(origin_id, cost + handicap_cost + heuristic)
+
+        ids = search.ids
+        keys = search.keys
+        visited = search.visited
+        visited_count = 0
         progress_table = {}
 
         current_key = None
 
         logging.debug("Max Visited: %d", max_visited)
         while not queue.empty():
-            current_key = queue.get()
+            current_id = queue.get()
+            current_key = keys[current_id]
             if current_key == goal:
                 break
 
-            if current_key in visited:
-                continue
-
             if progress_fcn:
                 step, progress = progress_fcn(current_key)
                 if step in progress_table and progress < progress_table[step]:
                     continue
                 progress_table[step] = progress
-            visited[current_key] = True
-            if max_visited is not None and len(visited) > max_visited:
+            visited[current_id] = 1
+            visited_count += 1
+            if max_visited is not None and visited_count > max_visited:
                 break
 
             current_node = self.state_projection(current_key)
 
-            logging.debug("Visited: %d", len(visited))
-            logging.debug("Visit: %s", str(current_node))
+            if debug:
+                logging.debug("Visited: %d", visited_count)
+                logging.debug("Visit: %s", str(current_node))
 
-            base_cost = cost_table[current_key][0]
+            base_cost = search.cost[current_id]
 
             for next_key in self.transition_generator(current_node):
-                if next_key in visited:
+                next_id = ids.get(next_key)
+                if next_id is not None and visited[next_id]:
                     continue
 
                 if progress_fcn:
@@ -98,7 +111,8 @@ class MarkovGraph:
 
                 next_node = self.state_projection(next_key)
 
-                logging.debug("Discover: %s", str(next_node))
+                if debug:
+                    logging.debug("Discover: %s", str(next_node))
 
                 state_cost = self.state_cost_fcn(next_node)
 
@@ -111,30 +125,61 @@ class MarkovGraph:
 
                 if new_cost == math.inf:
                     continue
-                #    (next_node in cost_table and new_cost + handicap_cost >= cost_table[next_key][1])):
-                #    continue
 
                 heuristic = heuristic_fcn(next_node)
                 priority = new_cost + handicap_cost + heuristic
                 if priority >= priority_threshold:
                     continue
-                if next_key in priority_table and priority >= priority_table[next_key]:
+                if next_id is not None and priority >= search.priority[next_id]:
                     continue
 
-                logging.debug("priority, cost, heuristic: %.4f, %.4f, %.4f", priority, new_cost + handicap_cost, heuristic)
+                if debug:
+                    logging.debug("priority, cost, heuristic: %.4f, %.4f, %.4f",
+                                  priority, new_cost + handicap_cost, heuristic)
 
-                queue.put(next_key, priority)
-                cost_table[next_key] = (new_cost, new_cost + handicap_cost)
-                priority_table[next_key] = priority
-                backtrack_chain[next_key] = current_key
+                if next_id is None:
+                    next_id = search.intern(next_key)
+                search.update(next_id, new_cost, current_id, priority)
+                queue.put(next_id, priority)
 
         if current_key != goal:
             return None
 
-        def backtrack():
-            key = current_key
-            while key is not None:
-                yield key
-                key = backtrack_chain[key]
+        return reversed([keys[i] for i in search.backtrack(current_id)])
 
-        return reversed(list(backtrack()))
+
+class SearchState:
+    """Search state of |MarkovGraph.find_best|, indexed by dense key ids.
+
+    Costs, priorities, back-pointers and visited flags are stored in typed arrays
+    that grow as keys are discovered.
+    """
+    def __init__(self):
+        self.ids = {}
+        self.keys = []
+        self.cost = array.array('d')
+        self.priority = array.array('d')
+        self.predecessor = array.array('q')
+        self.visited = bytearray()
+
+    def intern(self, key):
+        i = len(self.keys)
+        self.ids[key] = i
+        self.keys.append(key)
+        self.cost.append(math.inf)
+        self.priority.append(math.inf)
+        self.predecessor.append(-1)
+        self.visited.append(0)
+        return i
+
+    def update(self, i, cost, predecessor, priority):
+        self.cost[i] = cost
+        self.predecessor[i] = predecessor
+        self.priority[i] = priority
+
+    def backtrack(self, i):
+        path = []
+        while i >= 0:
+            path.append(i)
+            i = self.predecessor[i]
+        return path
@@ -22,6 +22,37 @@ class TestMarkov(unittest.TestCase):
         path = chain.find_best(0, 4, heuristic)
         self.assertEqual(list(path), [0, 1, 2, 3, 4])
 
+    def test_search_best_reopen(self):
+        # 2 is first discovered from 1 at a high cost, then through 3 at a lower one
+        edges = {0: {1: 1.0, 3: 2.0}, 1: {2: 10.0}, 3: {2: 1.0}, 2: {4: 1.0}, 4: {}}
+
+        def adjacent(key):
+            return iter(edges[key])
+
+        def cost(key):
+            return 0.0
+
+        def transition(current_key, next_key):
+            return edges[current_key][next_key]
+
+        chain = markov.MarkovGraph(adjacent, cost, transition)
+        path = chain.find_best(0, 4, lambda key: 0.0)
+        self.assertEqual(list(path), [0, 3, 2, 4])
+
+    def test_search_best_max_queue(self):
+        # without a bound, the cheap dead end 1 is explored and dropped in favor of 2
+        edges = {0: {1: 0.5, 2: 1.0}, 1: {}, 2: {3: 1.0}, 3: {}}
+
+        def adjacent(key):
+            return iter(edges[key])
+
+        def transition(current_key, next_key):
+            return edges[current_key][next_key]
+
+        chain = markov.MarkovGraph(adjacent, lambda key: 0.0, transition)
+        self.assertEqual(list(chain.find_best(0, 3, lambda key: 0.0)), [0, 2, 3])
+        self.assertIsNone(chain.find_best(0, 3, lambda key: 0.0, max_queue=1))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,7 +1,7 @@
 import pickle, json
 import sys, getopt, os
 
-from spat.spatial_graph import SpatialGraph
+from spat.facility import SpatialGraph
 
 def main(argv):
   inputfile = ''
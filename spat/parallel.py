@@ -0,0 +1,53 @@
+import os, time, logging
+import math
+import multiprocessing
+
+
+# Function evaluated by the workers. It is set before the pool is forked, so that
+# everything it references (graph, spatial indexes, lookup tables) is inherited
+# copy-on-write by the children instead of being pickled with every task.
+_worker_fcn = None
+
+
+def _evaluate(item):
+    start_time = time.time()
+    result = _worker_fcn(item)
+    return os.getpid(), time.time() - start_time, result
+
+
+def fork_map(fcn, iterable, workers=None, chunksize=1):
+    """Maps |fcn| over |iterable| with a pool of forked worker processes.
+
+    Read-only structures captured by |fcn| are shared with the workers through fork.
+    Only the items and the results go through pickling. Results are yielded in the
+    order of |iterable|, and per-worker throughput is logged once the pool is done.
+
+    Args:
+      fcn: function of a single item, may be a closure.
+      iterable: items to process.
+      workers: number of processes. None or 1 evaluates |fcn| in the current process.
+      chunksize: number of items sent to a worker at once.
+    """
+    global _worker_fcn
+    if workers is None or workers <= 1:
+        for item in iterable:
+            yield fcn(item)
+        return
+
+    throughput = {}
+    start_time = time.time()
+    _worker_fcn = fcn
+    try:
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            for pid, elapsed, result in pool.imap(_evaluate, iterable, chunksize):
+                count, busy = throughput.get(pid, (0, 0.0))
+                throughput[pid] = (count + 1, busy + elapsed)
+                yield result
+    finally:
+        _worker_fcn = None
+
+    for pid, (count, busy) in sorted(throughput.items()):
+        logging.info("worker %d: %d items in %.2fs (%.2f items/s)",
+                     pid, count, busy, count / busy if busy > 0.0 else math.inf)
+    logging.info("pool: %d items in %.2fs", sum(count for count, _ in throughput.values()),
+                 time.time() - start_time)
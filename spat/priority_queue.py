@@ -2,20 +2,197 @@ import heapq
 
 
 class PriorityQueue:
+    """Min priority queue of arbitrary items.
+
+    With |max_size|, it keeps at most that many entries, evicting the ones with the
+    highest priority.
+    """
     def __init__(self, max_size = None):
         self.elements = []
         self.max_size = max_size
+        if max_size is not None:
+            self.bounded = BoundedPriorityQueue(max_size)
+            self.items = {}
+            self.free = []
 
     def empty(self):
+        if self.max_size is not None:
+            return self.bounded.empty()
         return len(self.elements) == 0
 
     def size(self):
+        if self.max_size is not None:
+            return self.bounded.size()
         return len(self.elements)
 
     def put(self, item, priority):
-        heapq.heappush(self.elements, (priority, item))
-        if self.max_size is not None and len(self.elements) > self.max_size:
-            self.elements = self.elements[0:self.max_size]
+        if self.max_size is None:
+            heapq.heappush(self.elements, (priority, item))
+            return
+        # entries are recycled, so that the bounded queue only ever sees max_size + 1 ids
+        entry = self.free.pop() if self.free else len(self.items)
+        self.items[entry] = item
+        evicted = self.bounded.put(entry, priority)
+        if evicted is not None:
+            del self.items[evicted]
+            self.free.append(evicted)
+
+    def get(self):
+        if self.max_size is None:
+            return heapq.heappop(self.elements)[1]
+        entry = self.bounded.get()
+        self.free.append(entry)
+        return self.items.pop(entry)
+
+
+class IndexedPriorityQueue:
+    """Binary min heap of integer items with decrease-key.
+
+    Items are small non negative integers, typically dense ids given to search states.
+    An item is queued at most once: putting an item that is already in the queue
+    moves it to its new priority instead of pushing a duplicate entry.
+    """
+    def __init__(self):
+        self.heap = []
+        self.priorities = []
+        self.position = []
+
+    def empty(self):
+        return len(self.heap) == 0
+
+    def size(self):
+        return len(self.heap)
+
+    def __contains__(self, item):
+        return item < len(self.position) and self.position[item] >= 0
+
+    def priority(self, item):
+        return self.priorities[item]
+
+    def put(self, item, priority):
+        if item >= len(self.position):
+            grow = item + 1 - len(self.position)
+            self.position.extend([-1] * grow)
+            self.priorities.extend([0.0] * grow)
+
+        i = self.position[item]
+        if i < 0:
+            self.heap.append(item)
+            self.priorities[item] = priority
+            self._sift_up(len(self.heap) - 1)
+        elif priority < self.priorities[item]:
+            self.priorities[item] = priority
+            self._sift_up(i)
+        else:
+            self.priorities[item] = priority
+            self._sift_down(i)
+
+    def top(self):
+        return self.heap[0]
 
     def get(self):
-        return heapq.heappop(self.elements)[1]
+        heap = self.heap
+        item = heap[0]
+        last = heap.pop()
+        self.position[item] = -1
+        if heap:
+            heap[0] = last
+            self._sift_down(0)
+        return item
+
+    def remove(self, item):
+        heap = self.heap
+        i = self.position[item]
+        self.position[item] = -1
+        last = heap.pop()
+        if i < len(heap):
+            heap[i] = last
+            self.position[last] = i
+            self._sift_up(i)
+            self._sift_down(self.position[last])
+
+    def _sift_up(self, i):
+        heap, priorities, position = self.heap, self.priorities, self.position
+        item = heap[i]
+        priority = priorities[item]
+        while i > 0:
+            parent = (i - 1) >> 1
+            parent_item = heap[parent]
+            if priorities[parent_item] <= priority:
+                break
+            heap[i] = parent_item
+            position[parent_item] = i
+            i = parent
+        heap[i] = item
+        position[item] = i
+
+    def _sift_down(self, i):
+        heap, priorities, position = self.heap, self.priorities, self.position
+        count = len(heap)
+        item = heap[i]
+        priority = priorities[item]
+        while True:
+            child = 2 * i + 1
+            if child >= count:
+                break
+            if child + 1 < count and priorities[heap[child + 1]] < priorities[heap[child]]:
+                child += 1
+            child_item = heap[child]
+            if priorities[child_item] >= priority:
+                break
+            heap[i] = child_item
+            position[child_item] = i
+            i = child
+        heap[i] = item
+        position[item] = i
+
+
+class BoundedPriorityQueue:
+    """Double-ended priority queue of integer items holding at most |max_size| items.
+
+    Items are kept in two indexed heaps, one ordered by lowest priority and one by
+    highest, so that both the best and the worst item are removed in O(log n).
+    When the queue is full, putting a new item evicts the worst one.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lowest = IndexedPriorityQueue()
+        self.highest = IndexedPriorityQueue()
+
+    def empty(self):
+        return self.lowest.empty()
+
+    def size(self):
+        return self.lowest.size()
+
+    def __contains__(self, item):
+        return item in self.lowest
+
+    def priority(self, item):
+        return self.lowest.priority(item)
+
+    def put(self, item, priority):
+        """Puts or moves |item|, and returns the item evicted to make room, if any.
+
+        The evicted item may be |item| itself when it is worse than everything queued.
+        """
+        if item not in self.lowest and self.lowest.size() >= self.max_size:
+            if priority >= -self.highest.priority(self.highest.top()):
+                return item
+            evicted = self.highest.get()
+            self.lowest.remove(evicted)
+        else:
+            evicted = None
+        self.lowest.put(item, priority)
+        self.highest.put(item, -priority)
+        return evicted
+
+    def get(self):
+        item = self.lowest.get()
+        self.highest.remove(item)
+        return item
+
+    def get_worst(self):
+        item = self.highest.get()
+        self.lowest.remove(item)
+        return item
@@ -0,0 +1,78 @@
+import random
+import unittest
+
+from spat import priority_queue
+
+
+class TestIndexedPriorityQueue(unittest.TestCase):
+
+    def test_order(self):
+        rng = random.Random(0)
+        queue = priority_queue.IndexedPriorityQueue()
+        priorities = {}
+        for item in rng.sample(range(200), 100):
+            priorities[item] = rng.random()
+            queue.put(item, priorities[item])
+        # move some items up and some down
+        for item in rng.sample(sorted(priorities), 40):
+            priorities[item] += rng.uniform(-1.0, 1.0)
+            queue.put(item, priorities[item])
+
+        self.assertEqual(queue.size(), len(priorities))
+        result = []
+        while not queue.empty():
+            result.append(queue.get())
+        self.assertEqual(result, sorted(priorities, key=priorities.get))
+
+    def test_contains(self):
+        queue = priority_queue.IndexedPriorityQueue()
+        queue.put(3, 1.0)
+        queue.put(1, 2.0)
+        self.assertIn(3, queue)
+        self.assertNotIn(2, queue)
+        self.assertNotIn(10, queue)
+        self.assertEqual(queue.get(), 3)
+        self.assertNotIn(3, queue)
+        self.assertEqual(queue.priority(1), 2.0)
+
+
+class TestBoundedPriorityQueue(unittest.TestCase):
+
+    def test_evict_worst(self):
+        rng = random.Random(1)
+        queue = priority_queue.BoundedPriorityQueue(10)
+        priorities = {}
+        for item in range(100):
+            priorities[item] = rng.random()
+            queue.put(item, priorities[item])
+            self.assertLessEqual(queue.size(), 10)
+        kept = sorted(priorities, key=priorities.get)[0:10]
+        result = []
+        while not queue.empty():
+            result.append(queue.get())
+        self.assertEqual(result, kept)
+
+    def test_put_returns_evicted(self):
+        queue = priority_queue.BoundedPriorityQueue(2)
+        self.assertIsNone(queue.put(0, 3.0))
+        self.assertIsNone(queue.put(1, 1.0))
+        self.assertEqual(queue.put(2, 5.0), 2)
+        self.assertEqual(queue.put(3, 2.0), 0)
+        self.assertIsNone(queue.put(3, 0.5))
+        self.assertEqual(queue.get_worst(), 1)
+        self.assertEqual(queue.get(), 3)
+
+
+class TestPriorityQueue(unittest.TestCase):
+
+    def test_max_size(self):
+        queue = priority_queue.PriorityQueue(3)
+        for item, priority in [('a', 4.0), ('b', 1.0), ('c', 5.0), ('d', 2.0), ('e', 3.0)]:
+            queue.put(item, priority)
+        self.assertEqual(queue.size(), 3)
+        self.assertEqual([queue.get() for _ in range(3)], ['b', 'd', 'e'])
+        self.assertTrue(queue.empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
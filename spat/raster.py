@@ -1,5 +1,8 @@
+import os
+import collections
+import numpy
 import pyproj as proj
-from osgeo import gdalnumeric, gdal
+from osgeo import gdal
 
 def world2Pixel(geoMatrix, x, y):
     """
@@ -17,15 +20,135 @@ def world2Pixel(geoMatrix, x, y):
     #print pixel, line
     return (pixel, line)
 
+def world2PixelArray(geoMatrix, x, y):
+    """
+    Continuous pixel and line coordinates of arrays of geospatial coordinates,
+    where the center of the upper left pixel is at (0.5, 0.5)
+    """
+    return (numpy.asarray(x) - geoMatrix[0]) / geoMatrix[1], (numpy.asarray(y) - geoMatrix[3]) / geoMatrix[5]
+
 class RasterImage:
-    def __init__(self, path, src_proj = 'epsg:2950'):
-        self.srcArray = gdalnumeric.LoadFile(path)
-        self.srcImage = gdal.Open(path)
-        self.geoTrans = self.srcImage.GetGeoTransform()
-        self.srcProj = proj.Proj(init=src_proj)
-
-    def at(self, coord, dst_proj):
-        x, y = coord
-        coord = proj.transform(self.srcProj, dst_proj, x, y)
-        pixel, line = world2Pixel(self.geoTrans, coord[0], coord[1])
-        return self.srcArray[line][pixel]
\ No newline at end of file
+    """Single band raster, such as a digital elevation model, sampled at coordinates of |src_proj|.
+
+    The raster is read by blocks of |block_size| (width, height) pixels, the natural
+    blocks of the band by default, and the last |cache_size| blocks read are kept in memory.
+    Coordinates are reprojected to the raster projection, or to |dst_proj| when given.
+    Samples outside of the raster take the value of the closest border pixel.
+    """
+    def __init__(self, path, src_proj = 'epsg:2950', cache_size = 256, block_size = None):
+        self.path = path
+        self.pid = None
+        self.band = None
+        image = gdal.Open(path)
+        band = image.GetRasterBand(1)
+        self._setup(image.RasterXSize, image.RasterYSize, image.GetGeoTransform(),
+                    block_size or tuple(band.GetBlockSize()), src_proj,
+                    image.GetProjection() or 'epsg:4326', cache_size)
+
+    @classmethod
+    def from_array(cls, array, geo_transform, src_proj = 'epsg:2950', raster_proj = 'epsg:4326',
+                   cache_size = 256, block_size = (256, 256)):
+        """Raster of a 2d |array|, which may be memory mapped with numpy.load(mmap_mode='r')."""
+        raster = cls.__new__(cls)
+        raster.path = None
+        raster.array = array
+        raster._setup(array.shape[1], array.shape[0], geo_transform, block_size, src_proj, raster_proj, cache_size)
+        return raster
+
+    def _setup(self, width, height, geo_transform, block_size, src_proj, raster_proj, cache_size):
+        self.width = width
+        self.height = height
+        self.geoTrans = geo_transform
+        self.block_size = block_size
+        self.blocks_x = -(-width // block_size[0])
+        self.srcProj = src_proj
+        self.rasterProj = raster_proj
+        self.transformers = {}
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+        self.reads = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['pid'] = None
+        state['band'] = None
+        state['image'] = None
+        return state
+
+    def _read(self, xoff, yoff, xsize, ysize):
+        if self.path is None:
+            return numpy.asarray(self.array[yoff:yoff + ysize, xoff:xoff + xsize], dtype=float)
+        # forked workers open their own dataset instead of sharing the parent file offset
+        if self.pid != os.getpid():
+            self.image = gdal.Open(self.path)
+            self.band = self.image.GetRasterBand(1)
+            self.pid = os.getpid()
+        return self.band.ReadAsArray(xoff, yoff, xsize, ysize).astype(float)
+
+    def _block(self, block):
+        data = self.cache.get(block)
+        if data is not None:
+            self.cache.move_to_end(block)
+            return data
+        by, bx = divmod(block, self.blocks_x)
+        xoff, yoff = bx * self.block_size[0], by * self.block_size[1]
+        data = self._read(xoff, yoff,
+                          min(self.block_size[0], self.width - xoff),
+                          min(self.block_size[1], self.height - yoff))
+        self.reads += 1
+        self.cache[block] = data
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return data
+
+    def values(self, pixels, lines):
+        """Values of the pixels at integer |pixels| and |lines| arrays, read block by block."""
+        pixels = numpy.clip(pixels, 0, self.width - 1)
+        lines = numpy.clip(lines, 0, self.height - 1)
+        bw, bh = self.block_size
+        blocks, inverse = numpy.unique((lines // bh) * self.blocks_x + pixels // bw, return_inverse=True)
+        order = numpy.argsort(inverse, kind='stable')
+        bounds = numpy.searchsorted(inverse[order], numpy.arange(len(blocks) + 1))
+
+        result = numpy.empty(len(pixels))
+        for i, block in enumerate(blocks.tolist()):
+            selected = order[bounds[i]:bounds[i + 1]]
+            by, bx = divmod(block, self.blocks_x)
+            result[selected] = self._block(block)[lines[selected] - by * bh, pixels[selected] - bx * bw]
+        return result
+
+    def transformer(self, dst_proj = None):
+        if dst_proj is None:
+            dst_proj = self.rasterProj
+        key = getattr(dst_proj, 'srs', dst_proj)
+        if key not in self.transformers:
+            self.transformers[key] = proj.Transformer.from_crs(
+                self.srcProj, getattr(dst_proj, 'crs', dst_proj), always_xy=True)
+        return self.transformers[key]
+
+    def sample(self, coords, mode = 'nearest', dst_proj = None):
+        """Values of the raster at a sequence of (x, y) |coords|, reprojected in one call.
+
+        |mode| is 'nearest' for the value of the pixel containing each coordinate, or
+        'bilinear' to interpolate between the centers of the four closest pixels.
+        """
+        coords = numpy.asarray(coords, dtype=float).reshape(-1, 2)
+        if len(coords) == 0:
+            return numpy.empty(0)
+        x, y = self.transformer(dst_proj).transform(coords[:, 0], coords[:, 1])
+        pixel, line = world2PixelArray(self.geoTrans, x, y)
+        if mode == 'nearest':
+            return self.values(numpy.floor(pixel).astype(numpy.int64), numpy.floor(line).astype(numpy.int64))
+        if mode != 'bilinear':
+            raise ValueError("unknown sampling mode %r" % mode)
+
+        pixel, line = pixel - 0.5, line - 0.5
+        p0, l0 = numpy.floor(pixel), numpy.floor(line)
+        tp, tl = pixel - p0, line - l0
+        p0, l0 = p0.astype(numpy.int64), l0.astype(numpy.int64)
+        top = (1.0 - tp) * self.values(p0, l0) + tp * self.values(p0 + 1, l0)
+        bottom = (1.0 - tp) * self.values(p0, l0 + 1) + tp * self.values(p0 + 1, l0 + 1)
+        return (1.0 - tl) * top + tl * bottom
+
+    def at(self, coord, dst_proj = None, mode = 'nearest'):
+        return self.sample([coord], mode, dst_proj)[0]
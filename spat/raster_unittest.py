@@ -0,0 +1,62 @@
+import unittest
+import numpy
+import pyproj
+
+from spat import raster
+
+
+def make_raster(cache_size=256):
+    array = numpy.arange(30 * 40, dtype=float).reshape(30, 40)
+    # 0.5 degree pixels, upper left corner at (-80, 50)
+    geo_transform = (-80.0, 0.5, 0.0, 50.0, 0.0, -0.5)
+    return array, raster.RasterImage.from_array(array, geo_transform, 'epsg:4326', 'epsg:4326',
+                                                cache_size=cache_size, block_size=(16, 8))
+
+
+class TestRasterImage(unittest.TestCase):
+
+    def test_nearest(self):
+        array, image = make_raster()
+        rng = numpy.random.RandomState(0)
+        coords = numpy.column_stack([rng.uniform(-80.0, -60.0, 200), rng.uniform(35.0, 50.0, 200)])
+        values = image.sample(coords)
+        for (x, y), value in zip(coords.tolist(), values.tolist()):
+            pixel, line = raster.world2Pixel(image.geoTrans, x, y)
+            self.assertEqual(value, array[line][pixel])
+        self.assertEqual(image.at(coords[0]), values[0])
+
+    def test_bilinear(self):
+        array, image = make_raster()
+        # pixel centers, and a point between four pixel centers
+        self.assertEqual(image.sample([(-79.75, 49.75), (-70.25, 40.25)], 'bilinear').tolist(),
+                         [array[0, 0], array[19, 19]])
+        self.assertAlmostEqual(image.at((-79.5, 49.5), mode='bilinear'), array[0:2, 0:2].mean())
+        # borders are clamped
+        self.assertEqual(image.at((-80.0, 50.0), mode='bilinear'), array[0, 0])
+        self.assertEqual(image.at((-100.0, 0.0), mode='bilinear'), array[29, 0])
+        with self.assertRaises(ValueError):
+            image.sample([(-70.0, 40.0)], 'cubic')
+
+    def test_block_cache(self):
+        array, image = make_raster(cache_size=2)
+        image.sample([(-79.0, 49.0), (-78.0, 48.0)])
+        self.assertEqual(image.reads, 1)
+        image.sample([(-79.0, 49.0), (-70.0, 40.0), (-61.0, 36.0)])
+        self.assertEqual(image.reads, 3)
+        self.assertEqual(len(image.cache), 2)
+        image.sample([(-61.0, 36.0)])
+        self.assertEqual(image.reads, 3)
+
+    def test_reproject(self):
+        array, image = make_raster()
+        transformer = pyproj.Transformer.from_crs('epsg:4326', 'epsg:2950', always_xy=True)
+        x, y = transformer.transform([-73.6, -73.55], [45.37, 45.62])
+        projected = raster.RasterImage.from_array(array, image.geoTrans, 'epsg:2950', 'epsg:4326')
+        numpy.testing.assert_array_equal(projected.sample(numpy.column_stack([x, y])),
+                                         image.sample([(-73.6, 45.37), (-73.55, 45.62)]))
+        self.assertEqual(projected.at((x[0], y[0]), pyproj.Proj('epsg:4326')),
+                         image.at((-73.6, 45.37)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import os, time
+import rtree
+import numpy
+
+
+def bulk_load(entries, path=None):
+    """Builds an R-tree of (id, bounds, object) |entries| with STR packing.
+
+    The whole stream is sorted and packed bottom-up by libspatialindex, instead of
+    being inserted one entry at a time. With |path|, the tree is written to
+    |path|.idx and |path|.dat, replacing existing files.
+    """
+    entries = iter(entries)
+    first = next(entries, None)
+
+    properties = rtree.index.Property()
+    if path is not None:
+        properties.overwrite = True
+    arguments = [] if path is None else [path]
+    if first is None:
+        return rtree.index.Index(*arguments, properties=properties)
+
+    def stream():
+        yield first
+        for entry in entries:
+            yield entry
+
+    return rtree.index.Index(*arguments, stream(), properties=properties)
+
+
+def incremental_load(entries):
+    """Builds an in-memory R-tree of |entries| by inserting them one at a time."""
+    index = rtree.index.Index()
+    for i, bounds, obj in entries:
+        index.insert(i, bounds, obj=obj)
+    return index
+
+
+def exists(path, newer_than=None):
+    """Whether an index is stored at |path|, and is not older than file |newer_than|."""
+    files = [path + '.idx', path + '.dat']
+    if not all(os.path.exists(filename) for filename in files):
+        return False
+    if newer_than is not None and os.path.exists(newer_than):
+        return min(os.path.getmtime(filename) for filename in files) >= os.path.getmtime(newer_than)
+    return True
+
+
+class DiskIndex:
+    """R-tree stored on disk, opened by each process on its first query.
+
+    Forked workers share file descriptors with their parent, so each process opens
+    its own handle instead of seeking concurrently in an inherited one.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.pid = None
+        self.index = None
+
+    def _open(self):
+        if self.pid != os.getpid():
+            self.index = rtree.index.Index(self.path)
+            self.pid = os.getpid()
+        return self.index
+
+    def intersection(self, bounds, objects=False):
+        return self._open().intersection(bounds, objects=objects)
+
+    def nearest(self, bounds, count=1, objects=False):
+        return self._open().nearest(bounds, count, objects=objects)
+
+    def __getstate__(self):
+        return {'path': self.path, 'pid': None, 'index': None}
+
+
+def load_or_build(path, entries_fcn, newer_than=None):
+    """Opens the index stored at |path|, or bulk loads it from |entries_fcn()| first.
+
+    The stored index is rebuilt when it is older than file |newer_than|.
+    Without |path|, the index is bulk loaded in memory.
+    """
+    if path is None:
+        return bulk_load(entries_fcn())
+    if not exists(path, newer_than):
+        bulk_load(entries_fcn(), path).close()
+    return DiskIndex(path)
+
+
+def benchmark(index, queries, objects=False):
+    """Times |queries| (bounds) on |index|.
+
+    Returns the total time in seconds and the number of results.
+    """
+    count = 0
+    start_time = time.time()
+    for bounds in queries:
+        for _ in index.intersection(bounds, objects=objects):
+            count += 1
+    return time.time() - start_time, count
+
+
+def random_windows(bounds, size, count, seed=0):
+    """|count| square query windows of side |size| uniformly placed inside |bounds|."""
+    rng = numpy.random.RandomState(seed)
+    x = rng.uniform(bounds[0], max(bounds[0], bounds[2] - size), count)
+    y = rng.uniform(bounds[1], max(bounds[1], bounds[3] - size), count)
+    return [(a, b, a + size, b + size) for a, b in zip(x.tolist(), y.tolist())]
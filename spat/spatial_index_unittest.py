@@ -0,0 +1,54 @@
+import os
+import time
+import tempfile
+import unittest
+
+from spat import spatial_index
+
+
+def make_entries(count):
+    return [(i, (i % 10 * 10.0, i // 10 * 10.0, i % 10 * 10.0 + 15.0, i // 10 * 10.0 + 5.0), ('edge', i))
+            for i in range(count)]
+
+
+class TestSpatialIndex(unittest.TestCase):
+
+    def test_bulk_load(self):
+        entries = make_entries(100)
+        incremental = spatial_index.incremental_load(entries)
+        packed = spatial_index.bulk_load(entries)
+        for bounds in spatial_index.random_windows((0.0, 0.0, 100.0, 100.0), 12.0, 50):
+            self.assertEqual(sorted(packed.intersection(bounds)), sorted(incremental.intersection(bounds)))
+        self.assertEqual([item.object for item in packed.intersection((0.0, 0.0, 1.0, 1.0), objects=True)],
+                         [('edge', 0)])
+
+    def test_bulk_load_empty(self):
+        index = spatial_index.bulk_load([])
+        self.assertEqual(list(index.intersection((0.0, 0.0, 1.0, 1.0))), [])
+
+    def test_load_or_build(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'graph.pickle')
+            path = os.path.join(directory, 'graph.pickle.edge_index')
+            with open(source, 'w') as f:
+                f.write('graph')
+            built = []
+
+            def entries():
+                built.append(True)
+                return make_entries(20)
+
+            index = spatial_index.load_or_build(path, entries, newer_than=source)
+            self.assertEqual(sorted(index.intersection((0.0, 0.0, 1.0, 1.0))), [0])
+            spatial_index.load_or_build(path, entries, newer_than=source)
+            self.assertEqual(len(built), 1)
+
+            later = time.time() + 10.0
+            os.utime(source, (later, later))
+            self.assertFalse(spatial_index.exists(path, newer_than=source))
+            spatial_index.load_or_build(path, entries, newer_than=source)
+            self.assertEqual(len(built), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -33,6 +33,64 @@ class RunningStats:
     return math.sqrt(self.totalWeight) * self.M3 / (self.M2 ** (3.0/2.0))
 
 
+class RunningStatsArray:
+  """Weighted moments of |size| independent series, like RunningStats, held in arrays.
+
+  Values are pushed by batches of (index, value, weight). The moments of a batch are
+  computed per index and combined with the running moments, so that an index may
+  appear several times in a batch. Accumulators over separate data merge the same way.
+  """
+  def __init__(self, size):
+    self.totalWeight = numpy.zeros(size)
+    self.m = numpy.zeros(size)
+    self.M2 = numpy.zeros(size)
+    self.M3 = numpy.zeros(size)
+
+  def __len__(self):
+    return len(self.m)
+
+  def push(self, indices, x, w = None):
+    indices = numpy.asarray(indices, dtype=numpy.int64)
+    x = numpy.asarray(x, dtype=float)
+    w = numpy.ones(len(x)) if w is None else numpy.asarray(w, dtype=float)
+    size = len(self)
+
+    batch = RunningStatsArray.__new__(RunningStatsArray)
+    batch.totalWeight = numpy.bincount(indices, w, size)
+    batch.m = numpy.zeros(size)
+    numpy.divide(numpy.bincount(indices, w * x, size), batch.totalWeight,
+                 out=batch.m, where=batch.totalWeight > 0.0)
+    delta = x - batch.m[indices]
+    batch.M2 = numpy.bincount(indices, w * delta ** 2, size)
+    batch.M3 = numpy.bincount(indices, w * delta ** 3, size)
+    return self.merge(batch)
+
+  def merge(self, other):
+    na, nb = self.totalWeight, other.totalWeight
+    n = na + nb
+    nonzero = n > 0.0
+    safe_n = numpy.where(nonzero, n, 1.0)
+    delta = other.m - self.m
+
+    m = numpy.where(nonzero, self.m + delta * nb / safe_n, 0.0)
+    M2 = self.M2 + other.M2 + delta ** 2 * na * nb / safe_n
+    M3 = (self.M3 + other.M3 + delta ** 3 * na * nb * (na - nb) / safe_n ** 2 +
+          3.0 * delta * (na * other.M2 - nb * self.M2) / safe_n)
+    self.totalWeight, self.m, self.M2, self.M3 = n, m, M2, M3
+    return self
+
+  def mean(self):
+    return numpy.where(self.totalWeight > 0.0, self.m, numpy.nan)
+
+  def variance(self):
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+      return numpy.where(self.totalWeight > 0.0, self.M2 / self.totalWeight, numpy.nan)
+
+  def skewness(self):
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+      return numpy.where(self.M2 > 0.0, numpy.sqrt(self.totalWeight) * self.M3 / self.M2 ** 1.5, numpy.nan)
+
+
 """data = [1.0, 1.0, 2.0, 3.0]
 wdata = [(2.0, 1.0), (1.0, 2.0), (1.0, 3.0)]
 stats = RunningStats()
@@ -0,0 +1,44 @@
+import unittest
+import numpy
+
+from spat import stats
+
+
+class TestRunningStatsArray(unittest.TestCase):
+
+    def test_push(self):
+        rng = numpy.random.RandomState(0)
+        indices = rng.randint(0, 4, 200)
+        x = rng.gamma(2.0, 1.0, 200)
+        w = rng.uniform(0.5, 2.0, 200)
+
+        array = stats.RunningStatsArray(5)
+        for begin in range(0, 200, 60):
+            array.push(indices[begin:begin + 60], x[begin:begin + 60], w[begin:begin + 60])
+
+        for i in range(4):
+            expected = stats.RunningStats()
+            for xi, wi in zip(x[indices == i], w[indices == i]):
+                expected.push(xi, wi)
+            self.assertAlmostEqual(array.totalWeight[i], expected.totalWeight)
+            self.assertAlmostEqual(array.mean()[i], expected.mean())
+            self.assertAlmostEqual(array.variance()[i], expected.variance())
+            self.assertAlmostEqual(array.skewness()[i], expected.skewness())
+        self.assertTrue(numpy.isnan(array.mean()[4]))
+        self.assertTrue(numpy.isnan(array.skewness()[4]))
+
+    def test_merge(self):
+        rng = numpy.random.RandomState(1)
+        indices = rng.randint(0, 3, 100)
+        x = rng.normal(5.0, 2.0, 100)
+        whole = stats.RunningStatsArray(3).push(indices, x)
+        a = stats.RunningStatsArray(3).push(indices[0:30], x[0:30])
+        b = stats.RunningStatsArray(3).push(indices[30:], x[30:])
+        a.merge(b)
+        numpy.testing.assert_allclose(a.mean(), whole.mean())
+        numpy.testing.assert_allclose(a.variance(), whole.variance())
+        numpy.testing.assert_allclose(a.skewness(), whole.skewness())
+
+
+if __name__ == '__main__':
+    unittest.main()
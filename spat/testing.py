@@ -0,0 +1,70 @@
+"""Fixtures shared by the unit tests of spat."""
+import shapely.geometry as sg
+
+from spat import facility
+
+
+def make_graph():
+    """Triangle with two parallel edges between nodes 0 and 2, of every circulation."""
+    graph = facility.SpatialGraph()
+    lines = [
+        ([(0.0, 0.0), (10.0, 0.0)], 0),
+        ([(10.0, 0.0), (10.0, 10.0)], 1),
+        ([(10.0, 10.0), (0.0, 0.0)], -1),
+        ([(0.0, 0.0), (5.0, 5.0), (10.0, 10.0)], 1),
+    ]
+    nodes = {}
+    for line, sens in lines:
+        u, v = [nodes.setdefault(p, len(nodes)) for p in (line[0], line[-1])]
+        for n, p in ((u, line[0]), (v, line[-1])):
+            graph.graph.add_node(n, geometry=sg.Point(p))
+        k = graph.graph.add_edge(u, v, order=u < v, type=11 + len(graph.geometry), sens=sens)
+        graph.geometry[u, v, k] = sg.LineString(line)
+        graph.geometry[v, u, k] = sg.LineString(list(reversed(line)))
+    return graph
+
+
+def make_grid(size, spacing):
+    """Square grid of |size| by |size| nodes, |spacing| apart, with a longer edge parallel to (0, 1)."""
+    graph = facility.SpatialGraph()
+    for i in range(size):
+        for j in range(size):
+            graph.graph.add_node(i * size + j, geometry=sg.Point(i * spacing, j * spacing))
+
+    def add_edge(u, v, line):
+        k = graph.graph.add_edge(u, v, order=u < v, type=11, sens=0)
+        graph.geometry[u, v, k] = sg.LineString(line)
+        graph.geometry[v, u, k] = sg.LineString(list(reversed(line)))
+
+    for i in range(size):
+        for j in range(size):
+            u = i * size + j
+            p = (i * spacing, j * spacing)
+            if i + 1 < size:
+                add_edge(u, u + size, [p, ((i + 1) * spacing, j * spacing)])
+            if j + 1 < size:
+                add_edge(u, u + 1, [p, (i * spacing, (j + 1) * spacing)])
+    # longer parallel edge, never on a shortest path
+    add_edge(0, 1, [(0.0, 0.0), (-spacing, spacing / 2.0), (0.0, spacing)])
+    return graph
+
+
+def make_loop_graph():
+    """Loop of four straight or polyline edges, with its segment table."""
+    graph = facility.SpatialGraph()
+    lines = [
+        [(0.0, 0.0), (50.0, 0.0), (100.0, 0.0)],
+        [(100.0, 0.0), (100.0, 80.0)],
+        [(0.0, 0.0), (0.0, 60.0), (0.0, 120.0)],
+        [(100.0, 80.0), (0.0, 120.0)],
+    ]
+    nodes = {}
+    for line in lines:
+        u, v = [nodes.setdefault(p, len(nodes)) for p in (line[0], line[-1])]
+        for n, p in ((u, line[0]), (v, line[-1])):
+            graph.graph.add_node(n, geometry=sg.Point(p))
+        k = graph.graph.add_edge(u, v, order=u < v, type=11, sens=0)
+        graph.geometry[u, v, k] = sg.LineString(line)
+        graph.geometry[v, u, k] = sg.LineString(list(reversed(line)))
+    graph.build_segment_table()
+    return graph
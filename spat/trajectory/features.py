@@ -1,32 +1,86 @@
+import os
 import logging
+import fnmatch, csv, json, pickle, hashlib
 import math
 import itertools
 import numpy
+from scipy import spatial
 import shapefile
-import rtree
 import pyproj
 import shapely.geometry as sg
+from shapely import prepared
 
-from spat import utility, raster
+from spat import utility, facility, raster, parallel
 
 
 class RegionPartition:
-    def __init__(self, filename):
+    """Regions of a polygon shapefile, keyed by the integer id of their first field.
+
+    Points are located through a grid of |grid_size| cells along the longest side of
+    the regions extent: cells inside a single region answer for their points, and only
+    the points of cells crossing a region boundary are tested against the prepared
+    polygons.
+    """
+    def __init__(self, filename, grid_size=256):
         sf = shapefile.Reader(filename)
 
         self.regions = {}
-        self.spatial_idx = rtree.index.Index()
         for s, r in zip(sf.iterShapes(), sf.iterRecords()):
-            ring = sg.Polygon(s.points)
-            self.spatial_idx.insert(r[0], ring.bounds)
-            self.regions[r[0]] = ring
+            self.regions[r[0]] = sg.Polygon(s.points)
+        self.prepared = {i: prepared.prep(region) for i, region in self.regions.items()}
+        self.build_grid(grid_size)
+
+    def build_grid(self, grid_size):
+        if not self.regions:
+            self.grid_bounds = (0.0, 0.0, 0.0, 0.0)
+            self.cell_size = 1.0
+            self.grid = numpy.full((0, 0), -1, dtype=numpy.int64)
+            self.candidates = {}
+            return
+        bounds = numpy.array([region.bounds for region in self.regions.values()])
+        self.grid_bounds = tuple(bounds[:, 0:2].min(axis=0)) + tuple(bounds[:, 2:4].max(axis=0))
+        x0, y0, x1, y1 = self.grid_bounds
+        self.cell_size = max(x1 - x0, y1 - y0, 1e-9) / grid_size
+        shape = (int(math.ceil((y1 - y0) / self.cell_size)) or 1, int(math.ceil((x1 - x0) / self.cell_size)) or 1)
+
+        # region id of the cells inside one region, -1 outside of every region, -2 across boundaries
+        self.grid = numpy.full(shape, -1, dtype=numpy.int64)
+        self.candidates = {}
+        for i, region in self.regions.items():
+            bx0, by0, bx1, by1 = region.bounds
+            for row in range(int((by0 - y0) // self.cell_size), min(int((by1 - y0) // self.cell_size) + 1, shape[0])):
+                for column in range(int((bx0 - x0) // self.cell_size),
+                                    min(int((bx1 - x0) // self.cell_size) + 1, shape[1])):
+                    cell = sg.box(x0 + column * self.cell_size, y0 + row * self.cell_size,
+                                  x0 + (column + 1) * self.cell_size, y0 + (row + 1) * self.cell_size)
+                    if not self.prepared[i].intersects(cell):
+                        continue
+                    candidates = self.candidates.setdefault((row, column), [])
+                    candidates.append(i)
+                    if len(candidates) == 1 and self.prepared[i].contains(cell):
+                        self.grid[row, column] = i
+                    else:
+                        self.grid[row, column] = -2
 
     def fit(self, point):
-        neighbors = self.spatial_idx.intersection(point.bounds)
-        for i in neighbors:
-            if self.regions[i].contains(point):
-                return i
-        return None
+        """Region id of the shapely |point|, -1 outside of every region."""
+        return int(self.fit_many([point.coords[0][0:2]])[0])
+
+    def fit_many(self, points):
+        """Region id of each of the (x, y) rows of |points|, -1 outside of every region."""
+        xy = numpy.asarray(points, dtype=float).reshape(-1, 2)
+        x0, y0, _, _ = self.grid_bounds
+        row = numpy.floor((xy[:, 1] - y0) / self.cell_size).astype(numpy.int64)
+        column = numpy.floor((xy[:, 0] - x0) / self.cell_size).astype(numpy.int64)
+        inside = (row >= 0) & (row < self.grid.shape[0]) & (column >= 0) & (column < self.grid.shape[1])
+
+        result = numpy.full(len(xy), -1, dtype=numpy.int64)
+        result[inside] = self.grid[row[inside], column[inside]]
+        for j in numpy.flatnonzero(result == -2).tolist():
+            point = sg.Point(xy[j])
+            result[j] = next((i for i in self.candidates[row[j], column[j]]
+                              if self.prepared[i].contains(point)), -1)
+        return result
 
 
 def extract_length(trajectory, predicate):
@@ -55,25 +109,62 @@ def load_traffic_lights(file):
     return load_point_list(file)
 
 
-def match_intersections(points, graph):
+def match_nodes(xy, graph):
+    """Closest node of |graph| to each of the (x, y) rows of |xy|, found with one KD-tree query."""
+    xy = numpy.asarray(xy, dtype=float).reshape(-1, 2)
+    nodes, node_xy = graph.node_coordinates()
+    if len(xy) == 0 or len(nodes) == 0:
+        return [None] * len(xy)
+    _, closest = spatial.cKDTree(node_xy).query(xy)
+    return numpy.asarray(nodes)[closest].tolist()
+
+
+def group_intersections(nodes):
+    """Indices of the points matched to each node, from the node of every point."""
     intersection_index = {}
-    for i, p in enumerate(points):
-        geom = p['geometry']
-        nearby = graph.search_node_nearest(utility.bb_bounds(geom.x, geom.y, 2, 2), 3)
-
-        min_distance = math.inf
-        best_node = None
-        for node in nearby:
-            distance = graph.node_geometry(node).distance(geom)
-            if distance < min_distance:
-                min_distance = distance
-                best_node = node
-        if best_node not in intersection_index:
-            intersection_index[best_node] = []
-        intersection_index[best_node].append(i)
+    for i, node in enumerate(nodes):
+        intersection_index.setdefault(node, []).append(i)
     return intersection_index
 
 
+def match_intersections(points, graph):
+    return group_intersections(match_nodes([p['geometry'].coords[0][0:2] for p in points], graph))
+
+
+def _file_version(path):
+    if os.path.isdir(path):
+        for name in ('tiles.json', 'manifest.json'):
+            if os.path.exists(os.path.join(path, name)):
+                path = os.path.join(path, name)
+                break
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+def load_matched_layer(filename, graph, cache_directory=None, facility=None):
+    """Matches the points of shapefile layer |filename| to graph nodes, like match_intersections.
+
+    With |cache_directory|, the node of every point is stored there, keyed by the layer
+    file and the facility file |facility| of |graph| with their modification times, so
+    that later runs on the same layer and facility skip the matching.
+    """
+    cache = None
+    if cache_directory is not None and facility is not None:
+        layer = filename + '.shp' if os.path.exists(filename + '.shp') else filename
+        key = hashlib.sha1(repr((_file_version(layer), _file_version(facility))).encode()).hexdigest()
+        cache = os.path.join(cache_directory, '%s.%s.pickle' % (os.path.basename(filename), key[0:16]))
+        if os.path.exists(cache):
+            with open(cache, 'rb') as f:
+                return group_intersections(pickle.load(f))
+
+    nodes = match_nodes([p['geometry'].coords[0][0:2] for p in load_point_list(filename)], graph)
+    if cache is not None:
+        os.makedirs(cache_directory, exist_ok=True)
+        with open(cache, 'wb') as f:
+            pickle.dump(nodes, f)
+    return group_intersections(nodes)
+
+
 def extract_intersection(trajectory, predicate):
     count = 0
 
@@ -98,6 +189,16 @@ def extract_turn(trajectory, graph, predicate):
     return count
 
 
+def extract_duration(trajectory):
+    begin = trajectory['segment'][0].begin.idx
+    end = trajectory['segment'][-1].end.idx
+    if trajectory.get('time') is None:
+        return end - begin
+    # states are one per observation, |end| is one past the last state
+    time = trajectory['time']
+    return time[end - 1] - time[begin] + 1.0
+
+
 def extract_nodes(trajectory):
     segments = trajectory['segment']
     for segment in segments:
@@ -105,13 +206,14 @@ def extract_nodes(trajectory):
     yield segments[-1].geometry[-1]
 
 
-def extract_elevation_stats(trajectory, graph, elevation):
-    dst_proj = pyproj.Proj(init='epsg:4326')
+def extract_elevation_stats(trajectory, graph, elevation, dst_proj=None):
+    if dst_proj is None:
+        dst_proj = pyproj.Proj(init='epsg:4326')
+    nodes = list(extract_nodes(trajectory))
+    node_elevation = elevation.sample(nodes, dst_proj=dst_proj).tolist()
     M2 = 0.0
     M3 = 0.0
-    for n1, n2 in utility.pairwise(extract_nodes(trajectory)):
-        e1 = elevation.at(n1, dst_proj)
-        e2 = elevation.at(n2, dst_proj)
+    for (n1, e1), (n2, e2) in utility.pairwise(zip(nodes, node_elevation)):
         d = sg.Point(n1).distance(sg.Point(n2))
         if d > 0.0:
             slope = (e2 - e1) / d
@@ -120,6 +222,11 @@ def extract_elevation_stats(trajectory, graph, elevation):
     return M2, M3
 
 
+def node_elevations(graph, elevation, nodes, dst_proj=None):
+    """Elevations of |nodes| of |graph|, sampled from raster |elevation| in one pass."""
+    return elevation.sample([graph.node_geometry(u).coords[0] for u in nodes], dst_proj=dst_proj)
+
+
 def link_type_predicate(graph, predicate):
     def fn(link):
         if link is None:
@@ -190,23 +297,25 @@ def intersection_collection(collection):
     return fn
 
 
+LINK_TYPE_PREDICATES = [
+    lambda link_type: True,
+    any_cycling_link,
+    designated_roadway,
+    bike_lane,
+    seperate_cycling_link,
+    offroad_link,
+    other_road_type,
+    arterial_link,
+    collector_link,
+    highway_link,
+    local_link,
+]
+
+
 def link_features(length, start_elevation, end_elevation, edge, graph):
     if edge is not None:
         type = graph.edge(edge)['type']
-        edge_predicates = [
-            lambda link: True,
-            any_cycling_link,
-            designated_roadway,
-            bike_lane,
-            seperate_cycling_link,
-            offroad_link,
-            other_road_type,
-            arterial_link,
-            collector_link,
-            highway_link,
-            local_link,
-        ]
-        link_types = map(lambda pred: pred(type), edge_predicates)
+        link_types = map(lambda pred: pred(type), LINK_TYPE_PREDICATES)
     else:
         link_types = itertools.repeat(False, 11)
     slope = 0.0
@@ -216,6 +325,131 @@ def link_features(length, start_elevation, end_elevation, edge, graph):
     return numpy.array(list(link_types) + [link_circulation(graph)(edge), slope**2, slope**3]) * length
 
 
+def link_type_matrix(compiled):
+    """Link type predicates and inverse circulation of every directed edge of |compiled|."""
+    matrix = numpy.empty((len(compiled), 12))
+    types = compiled.type.tolist()
+    for j, predicate in enumerate(LINK_TYPE_PREDICATES):
+        matrix[:, j] = [predicate(t) for t in types]
+    matrix[:, 11] = ~compiled.valid
+    return matrix
+
+
+class LinkTypeTable:
+    """Rows of link_type_matrix by directed edge of a facility |graph|.
+
+    Rows are indexed by the directed edge ids of the compiled view of |graph|. Graphs
+    without one, like tiled facilities, are looked up edge by edge, and their rows kept
+    once computed.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        self.compiled = graph.compiled
+        if self.compiled is None and isinstance(graph, facility.SpatialGraph):
+            self.compiled = graph.compile()
+        self.matrix = link_type_matrix(self.compiled) if self.compiled is not None else None
+        self.rows = {}
+
+    def row(self, edge):
+        if self.matrix is not None:
+            return self.matrix[self.compiled.edge_index(edge)]
+        row = self.rows.get(edge)
+        if row is None:
+            type = self.graph.edge(edge)['type']
+            row = numpy.array([predicate(type) for predicate in LINK_TYPE_PREDICATES] +
+                              [not self.graph.valid_circulation(edge)], dtype=float)
+            self.rows[edge] = row
+        return row
+
+    def lengths(self, segments, out):
+        """Adds the length of matched |segments| on every column of link_type_matrix to |out|.
+
+        Unmatched segments only add their length to the first column.
+        """
+        linked = []
+        for segment in segments:
+            if segment.edge is None:
+                out[0] += sg.LineString(segment.geometry).length
+            else:
+                linked.append(segment)
+        if not linked:
+            return out
+
+        distance = numpy.array([segment.end.projection - segment.begin.projection for segment in linked])
+        if self.matrix is not None:
+            rows = self.matrix[self.compiled.edge_indices(*zip(*(segment.edge for segment in linked)))]
+        else:
+            rows = numpy.array([self.row(segment.edge) for segment in linked])
+        out += numpy.dot(distance, rows)
+        return out
+
+
+class EdgeFeatures:
+    """Link features of every directed edge of a compiled facility graph, per unit of length.
+
+    Rows are indexed by the directed edge ids of |compiled| and hold the columns of
+    |link_features|, with the slope of the whole edge between the elevations of its nodes.
+    The features of a traversal of |length| along an edge are its row scaled by |length|.
+    """
+    def __init__(self, compiled, matrix):
+        self.compiled = compiled
+        self.matrix = matrix
+
+    @classmethod
+    def from_graph(cls, graph, node_elevation):
+        """Builds the table of |graph| where |node_elevation(nodes)| are the elevations of |nodes|."""
+        compiled = graph.compiled if graph.compiled is not None else graph.compile()
+        elevation = numpy.asarray(node_elevation(compiled.nodes.tolist()), dtype=float)
+        rise = (elevation[compiled.node_positions(compiled.target)] -
+                elevation[compiled.node_positions(compiled.source)])
+        slope = numpy.zeros(len(compiled))
+        numpy.divide(rise, compiled.length, out=slope, where=compiled.length > 0.0)
+
+        matrix = numpy.empty((len(compiled), 14))
+        matrix[:, 0:12] = link_type_matrix(compiled)
+        matrix[:, 12] = slope ** 2
+        matrix[:, 13] = slope ** 3
+        return cls(compiled, matrix)
+
+    @classmethod
+    def load_or_build(cls, filename, graph, node_elevation, facility=None, raster_path=None):
+        """Loads the table stored in |filename|, or builds it with |from_graph| and stores it.
+
+        The stored table is keyed by the facility file |facility| of |graph| and the
+        elevation raster |raster_path|, like load_matched_layer, and rebuilt when either
+        changed, or when it does not match the edges of |graph|.
+        """
+        compiled = graph.compiled if graph.compiled is not None else graph.compile()
+        key = hashlib.sha1(repr(tuple(None if path is None else _file_version(path)
+                                      for path in (facility, raster_path))).encode()).hexdigest()
+        if filename is not None and os.path.exists(filename):
+            with numpy.load(filename) as data:
+                if 'key' in data and str(data['key']) == key and data['matrix'].shape == (len(compiled), 14):
+                    return cls(compiled, data['matrix'])
+        table = cls.from_graph(graph, node_elevation)
+        if filename is not None:
+            table.save(filename, key)
+        return table
+
+    def save(self, filename, key=''):
+        # through a file object, so that numpy does not append an extension to |filename|
+        with open(filename, 'wb') as f:
+            numpy.savez(f, matrix=self.matrix, key=numpy.array(key))
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def index(self, edge):
+        return self.compiled.edge_index(edge)
+
+    def link_features(self, length, edge):
+        return self.matrix[self.index(edge)] * length
+
+    def costs(self, weights):
+        """Cost per unit of length of every edge, for link feature |weights|."""
+        return numpy.dot(self.matrix, weights)
+
+
 def intersection_features(a, b, graph, collections):
     assert a[1] == b[0]
     _, v, _ = a
@@ -235,72 +469,175 @@ def intersection_features(a, b, graph, collections):
                        list(map(lambda pred: pred(v), node_predicates)))
 
 
-def extract_features(trajectories, graph):
-    end_of_facility = match_intersections(
-        load_discontinuity("data/discontinuity/end_of_facility"), graph)
-    change_of_facility_type = match_intersections(
-        load_discontinuity("data/discontinuity/change_of_facility_type"), graph)
-    intersections_disc = match_intersections(
-        load_discontinuity("data/intersections/intersections_on_bike_network_with_change_in_road_type"), graph)
-    traffic_lights = match_intersections(
-        load_traffic_lights("data/traffic_lights/All_lights"), graph)
-    elevation = raster.RasterImage("data/elevation/30n090w_20101117_gmted_min075.tif")
-
-    partition = RegionPartition("data/partition/ZT2013_MTL_region")
-
-    features = {}
-    for trajectory in trajectories:
-        logging.info("extracting features for %s", trajectory['id'])
-
-        i = trajectory['id']
-        features[i] = {}
-        features[i]['length'] = extract_length(trajectory,
-                                               lambda link: True)
-        features[i]['length_cycling'] = extract_length(trajectory,
-                                                       link_type_predicate(graph, any_cycling_link))
-        features[i]['length_designated_roadway'] = extract_length(trajectory,
-                                                                  link_type_predicate(graph, designated_roadway))
-        features[i]['length_bike_lane'] = extract_length(trajectory,
-                                                         link_type_predicate(graph, bike_lane))
-        features[i]['length_seperate_cycling_link'] = extract_length(trajectory,
-                                                                     link_type_predicate(graph, seperate_cycling_link))
-        features[i]['length_offroad'] = extract_length(trajectory,
-                                                       link_type_predicate(graph, offroad_link))
-        features[i]['length_other_road'] = extract_length(trajectory,
-                                                          link_type_predicate(graph, other_road_type))
-        features[i]['length_arterial'] = extract_length(trajectory,
-                                                        link_type_predicate(graph, arterial_link))
-        features[i]['length_collector'] = extract_length(trajectory,
-                                                         link_type_predicate(graph, collector_link))
-        features[i]['length_highway'] = extract_length(trajectory,
-                                                       link_type_predicate(graph, highway_link))
-        features[i]['length_local'] = extract_length(trajectory,
-                                                     link_type_predicate(graph, local_link))
-        features[i]['length_inverse'] = extract_length(trajectory, link_circulation(graph))
-
-        features[i]['left_turn'] = extract_turn(trajectory, graph, left_turn)
-        features[i]['right_turn'] = extract_turn(trajectory, graph, right_turn)
-
-        features[i]['intersections'] = extract_intersection(trajectory, lambda link: True)
-        features[i]['end_of_facility'] = extract_intersection(trajectory,
-                                                              intersection_collection(end_of_facility))
-        features[i]['change_of_facility_type'] = extract_intersection(trajectory,
-                                                                      intersection_collection(change_of_facility_type))
-        features[i]['intersections_disc'] = extract_intersection(trajectory,
-                                                                 intersection_collection(intersections_disc))
-        features[i]['traffic_lights'] = extract_intersection(trajectory,
-                                                             intersection_collection(traffic_lights))
-
-        partition_begin = partition.fit(sg.Point(trajectory['segment'][0].geometry[0]))
-        partition_end = partition.fit(sg.Point(trajectory['segment'][-1].geometry[-1]))
-        features[i]['partition'] = (partition_begin, partition_end)
-
-        features[i]['duration'] = (trajectory['segment'][-1].end.idx -
-                                   trajectory['segment'][0].begin.idx)
-        features[i]['avg_speed'] = features[i]['length'] / features[i]['duration']
-
-        elev_M2, elev_M3 = extract_elevation_stats(trajectory, graph, elevation)
-        features[i]['elev_m2'] = elev_M2
-        features[i]['elev_m3'] = elev_M3
-
-    return features
+FEATURE_COLUMNS = [
+    'length',
+    'length_cycling',
+    'length_designated_roadway',
+    'length_bike_lane',
+    'length_seperate_cycling_link',
+    'length_offroad',
+    'length_other_road',
+    'length_arterial',
+    'length_collector',
+    'length_highway',
+    'length_local',
+    'length_inverse',
+    'elev_m2',
+    'elev_m3',
+    'left_turn',
+    'right_turn',
+    'intersections',
+    'end_of_facility',
+    'change_of_facility_type',
+    'intersections_disc',
+    'traffic_lights',
+    'duration',
+    'avg_speed',
+    'partition_begin',
+    'partition_end',
+]
+# columns of the link and intersection features learned by spat.trajectory.ioc
+IOC_COLUMNS = FEATURE_COLUMNS[0:21]
+INTERSECTION_COLLECTIONS = ['end_of_facility', 'change_of_facility_type', 'intersections_disc', 'traffic_lights']
+
+
+class FeatureExtractor:
+    """Extracts the FEATURE_COLUMNS of mapmatched trajectories into rows of a feature matrix.
+
+    Link types and circulation are looked up by edge in a LinkTypeTable of |graph|, and
+    intersection collections by node.
+    Partitions are region ids of |partition|, or nan outside of every region. They are
+    located for all trajectories at once by |matrix|, and left to nan by |extract|.
+    """
+    def __init__(self, graph, intersection_collections, elevation, partition, dst_proj=None):
+        self.graph = graph
+        self.link_types = LinkTypeTable(graph)
+        self.node_flags = {}
+        for j, name in enumerate(INTERSECTION_COLLECTIONS):
+            for node in intersection_collections[name]:
+                self.node_flags.setdefault(node, numpy.zeros(len(INTERSECTION_COLLECTIONS)))[j] = 1.0
+        self.elevation = elevation
+        self.partition = partition
+        self.dst_proj = dst_proj if dst_proj is not None else pyproj.Proj(init='epsg:4326')
+
+    def extract(self, trajectory, row):
+        """Fills |row| with the features of |trajectory|."""
+        segments = trajectory['segment']
+        row[:] = 0.0
+        self.link_types.lengths(segments, row[0:12])
+        intersection = row[17:21]
+        for segment in segments:
+            edge = segment.edge
+            if edge is not None and segment.end.attached:
+                row[16] += 1.0
+                flags = self.node_flags.get(edge[1])
+                if flags is not None:
+                    intersection += flags
+
+        for segment0, segment1 in utility.pairwise(segments):
+            if (segment0.edge is not None and segment0.end.attached and
+                segment1.edge is not None and segment1.begin.attached):
+                angle = math.degrees(self.graph.turn_angle(segment0.edge, segment1.edge))
+                row[14] += left_turn(angle)
+                row[15] += right_turn(angle)
+
+        row[12:14] = extract_elevation_stats(trajectory, self.graph, self.elevation, self.dst_proj)
+        row[21] = extract_duration(trajectory)
+        row[22] = row[0] / row[21] if row[21] else numpy.inf
+        row[23:25] = numpy.nan
+        return row
+
+    def matrix(self, trajectories, workers=None, chunksize=16):
+        """Ids and feature matrix (trajectory count x FEATURE_COLUMNS) of |trajectories|.
+
+        With |workers|, rows are extracted by forked processes, |chunksize| trajectories
+        at a time. The graph, lookup tables and trajectories are inherited by the workers,
+        only trajectory indices and feature rows go through pickling. Rows are kept in
+        the order of |trajectories|.
+        """
+        trajectories = list(trajectories)
+
+        def extract(i):
+            logging.info("extracting features for %s", trajectories[i]['id'])
+            return self.extract(trajectories[i], numpy.empty(len(FEATURE_COLUMNS)))
+
+        rows = list(parallel.fork_map(extract, range(len(trajectories)), workers, chunksize))
+        ids = [trajectory['id'] for trajectory in trajectories]
+        if not rows:
+            return ids, numpy.empty((0, len(FEATURE_COLUMNS)))
+        matrix = numpy.array(rows)
+        if self.partition is not None:
+            for j, end in ((23, 0), (24, -1)):
+                regions = self.partition.fit_many(
+                    [trajectory['segment'][end].geometry[end][0:2] for trajectory in trajectories])
+                matrix[:, j] = numpy.where(regions >= 0, regions, numpy.nan)
+        return ids, matrix
+
+
+INTERSECTION_LAYERS = {
+    'end_of_facility': "data/discontinuity/end_of_facility",
+    'change_of_facility_type': "data/discontinuity/change_of_facility_type",
+    'intersections_disc': "data/intersections/intersections_on_bike_network_with_change_in_road_type",
+    'traffic_lights': "data/traffic_lights/All_lights",
+}
+
+
+def load_intersection_collections(graph, cache_directory=None, facility=None):
+    """Matched nodes of every INTERSECTION_LAYERS, see load_matched_layer."""
+    return {name: load_matched_layer(filename, graph, cache_directory, facility)
+            for name, filename in INTERSECTION_LAYERS.items()}
+
+
+def extract_features(trajectories, graph, workers=None, chunksize=16, cache_directory=None, facility=None):
+    """Ids and feature matrix of |trajectories|, with columns FEATURE_COLUMNS.
+
+    See FeatureExtractor.matrix for |workers| and |chunksize|, and load_matched_layer
+    for |cache_directory| and |facility|.
+    """
+    extractor = FeatureExtractor(
+        graph, load_intersection_collections(graph, cache_directory, facility),
+        raster.RasterImage("data/elevation/30n090w_20101117_gmted_min075.tif"),
+        RegionPartition("data/partition/ZT2013_MTL_region"))
+    return extractor.matrix(trajectories, workers, chunksize)
+
+
+def save_feature_table(ids, matrix, filename):
+    """Writes the feature matrix of trajectories |ids| as *.json columns or *.csv rows."""
+    with open(filename, 'w') as f:
+        if fnmatch.fnmatch(filename, '*.csv'):
+            writer = csv.writer(f)
+            writer.writerow(['id'] + FEATURE_COLUMNS)
+            for i, row in zip(ids, matrix.tolist()):
+                writer.writerow([i] + row)
+        else:
+            json.dump({'columns': FEATURE_COLUMNS, 'id': list(ids),
+                       'features': matrix.tolist()}, f)
+
+
+def load_feature_table(filename):
+    """Ids and feature matrix, with columns FEATURE_COLUMNS, stored in |filename|.
+
+    Json files written before the columnar format, with one dict of features per
+    trajectory id, are also read.
+    """
+    with open(filename, 'r') as f:
+        if fnmatch.fnmatch(filename, '*.csv'):
+            reader = csv.reader(f)
+            header = next(reader)
+            rows = list(reader)
+            ids = [row[0] for row in rows]
+            matrix = numpy.array([row[1:] for row in rows], dtype=float).reshape(-1, len(header) - 1)
+            columns = header[1:]
+        else:
+            data = json.load(f)
+            if 'columns' in data:
+                ids, columns = data['id'], data['columns']
+                matrix = numpy.array(data['features'], dtype=float).reshape(-1, len(columns))
+            else:
+                ids = list(data.keys())
+                columns = [c for c in FEATURE_COLUMNS if not c.startswith('partition')]
+                matrix = numpy.array([[data[i][c] for c in columns] for i in ids], dtype=float)
+    table = numpy.full((len(ids), len(FEATURE_COLUMNS)), numpy.nan)
+    for j, column in enumerate(columns):
+        table[:, FEATURE_COLUMNS.index(column)] = matrix[:, j]
+    return ids, table
@@ -1,13 +1,15 @@
-import sys, argparse, fnmatch, logging
-import pickle, csv, json
+import sys, argparse, logging
+import pickle
 
 from spat.trajectory import features
+from spat import bundle
 
 
 def main(argv):
     parser = argparse.ArgumentParser(description="""
     Extract several features from mapmatched bike trajectories.
-    Features are:
+    The output is a feature matrix with one row per trajectory and the columns
+    of spat.trajectory.features.FEATURE_COLUMNS:
     length
     length_cycling
     length_designated_roadway
@@ -22,13 +24,23 @@ def main(argv):
     parser.add_argument('-i', '--ifile', default = 'data/bike_path/mm.pickle',
                         help='input pickle file of mapmatched (with spat.trajectory.mapmatch) data.')
     parser.add_argument('--facility', default = 'data/mtl_geobase/mtl.pickle',
-                        help="""input pickle file containing the facility graph 
-    (with spat.geobase.preprocess) representing the road network""")
+                        help="""input pickle file or bundle directory containing the facility graph
+    (with spat.geobase.preprocess) representing the road network. Trajectories mapmatched with
+    --original_edges take the uncompressed graph (spat.geobase.preprocess --original)""")
     parser.add_argument('-o', '--ofile',
                         default = ['data/bike_path/features.json'], nargs='+',
-                        help="""output file containing an array of segments. 
+                        help="""output file containing the feature matrix.
     Supported formats include *.json, *.csv""")
 
+    parser.add_argument('--intersection_cache',
+                        help="""directory caching the graph nodes matched by the intersection and
+    traffic light layers, for each facility. Without it, layers are matched on every run""")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="""number of worker processes. The facility graph, lookup tables and
+    trajectories are loaded once and shared with the workers""")
+    parser.add_argument('--chunksize', type=int, default=16,
+                        help='number of trajectories sent to a worker at once')
+
     args = parser.parse_args()
     print('input file:', args.ifile)
     print('facility:', args.facility)
@@ -36,24 +48,16 @@ def main(argv):
 
     logging.basicConfig(level=logging.DEBUG)
 
-    with open(args.facility, 'rb') as f:
-        graph = pickle.load(f)
-    graph.build_spatial_node_index()
+    graph = bundle.open_graph(args.facility)
 
     with open(args.ifile, 'rb') as f:
         data = pickle.load(f)
 
-    observed_features = features.extract_features(data, graph)
+    ids, observed_features = features.extract_features(data, graph, args.workers, args.chunksize,
+                                                       args.intersection_cache, args.facility)
 
     for output in args.ofile:
-        with open(output, 'w+') as f:
-            if fnmatch.fnmatch(output, '*.csv'):
-                writer = csv.writer(f)
-                for row in observed_features:
-                    print(row.values())
-                    writer.writerow(row.values())
-            elif fnmatch.fnmatch(output, '*.json'):
-                json.dump(observed_features, f, indent=2)
+        features.save_feature_table(ids, observed_features, output)
 
 if __name__ == "__main__":
     main(sys.argv[1:])
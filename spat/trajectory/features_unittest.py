@@ -0,0 +1,210 @@
+import os
+import tempfile
+import unittest
+import numpy
+import shapefile
+import shapely.geometry as sg
+
+from spat import bundle, raster
+from spat.trajectory import features, testing
+
+
+class TestEdgeFeatures(unittest.TestCase):
+
+    def test_link_features(self):
+        graph = testing.make_graph()
+        elevation = {0: 10.0, 1: 12.0, 2: 7.0, 3: 7.5}
+        table = features.EdgeFeatures.from_graph(graph, lambda nodes: [elevation[u] for u in nodes])
+        self.assertEqual(len(table), 10)
+        for edge in graph.compiled.edges:
+            length = graph.edge_geometry(edge).length
+            expected = features.link_features(length, elevation[edge[0]], elevation[edge[1]], edge, graph)
+            numpy.testing.assert_allclose(table.link_features(length, edge), expected)
+            numpy.testing.assert_allclose(table.link_features(length / 4.0, edge), expected / 4.0)
+
+        weights = numpy.arange(14.0)
+        costs = table.costs(weights)
+        for edge in graph.compiled.edges:
+            self.assertAlmostEqual(costs[table.index(edge)] * 3.0,
+                                   numpy.dot(table.link_features(3.0, edge), weights))
+
+    def test_load_or_build(self):
+        graph = testing.make_graph()
+        calls = []
+
+        def elevation(nodes):
+            calls.extend(nodes)
+            return [float(u) for u in nodes]
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'edge_features.npy')
+            table = features.EdgeFeatures.load_or_build(filename, graph, elevation)
+            self.assertEqual(len(calls), 4)
+            loaded = features.EdgeFeatures.load_or_build(filename, graph, elevation)
+            self.assertEqual(len(calls), 4)
+            numpy.testing.assert_array_equal(loaded.matrix, table.matrix)
+
+            # stale table of another graph
+            graph.graph.remove_edge(0, 2)
+            graph.compile()
+            rebuilt = features.EdgeFeatures.load_or_build(filename, graph, elevation)
+            self.assertEqual(len(calls), 8)
+            self.assertEqual(len(rebuilt), 8)
+
+    def test_load_or_build_key(self):
+        graph = testing.make_graph()
+        calls = []
+
+        def elevation(nodes):
+            calls.extend(nodes)
+            return [float(u) for u in nodes]
+
+        with tempfile.TemporaryDirectory() as directory:
+            facility = os.path.join(directory, 'facility')
+            bundle.save(graph, facility)
+            raster_path = os.path.join(directory, 'elevation.tif')
+            open(raster_path, 'w').close()
+            filename = os.path.join(directory, 'edge_features')
+            features.EdgeFeatures.load_or_build(filename, graph, elevation, facility, raster_path)
+            features.EdgeFeatures.load_or_build(filename, graph, elevation, facility, raster_path)
+            self.assertEqual(len(calls), 4)
+
+            # facility saved again in place, with a manifest older than the table
+            manifest = os.path.join(facility, 'manifest.json')
+            mtime = os.stat(filename).st_mtime_ns - 10**9
+            bundle.save(graph, facility)
+            os.utime(manifest, ns=(mtime, mtime))
+            features.EdgeFeatures.load_or_build(filename, graph, elevation, facility, raster_path)
+            self.assertEqual(len(calls), 8)
+
+            other_raster = os.path.join(directory, 'other.tif')
+            open(other_raster, 'w').close()
+            features.EdgeFeatures.load_or_build(filename, graph, elevation, facility, other_raster)
+            self.assertEqual(len(calls), 12)
+
+
+class TestFeatureExtractor(testing.BundleTestCase):
+
+    def test_extract(self):
+        graph = self.graph
+        trajectory = testing.make_trajectory(graph)
+        collections = {'end_of_facility': {1: [0]}, 'change_of_facility_type': {2: [0], 3: [1]},
+                       'intersections_disc': {}, 'traffic_lights': {0: [0, 1]}}
+        array = numpy.random.RandomState(0).uniform(0.0, 50.0, (16, 16))
+        elevation = raster.RasterImage.from_array(array, (-10.0, 10.0, 0.0, 140.0, 0.0, -10.0),
+                                                  'epsg:3857', 'epsg:3857')
+        extractor = features.FeatureExtractor(graph, collections, elevation, None, 'epsg:3857')
+        ids, matrix = extractor.matrix([trajectory, trajectory])
+        self.assertEqual(ids, ['a', 'a'])
+        self.assertEqual(matrix.shape, (2, len(features.FEATURE_COLUMNS)))
+        row = dict(zip(features.FEATURE_COLUMNS, matrix[0].tolist()))
+
+        predicates = [lambda link: True] + [features.link_type_predicate(graph, predicate)
+                                            for predicate in features.LINK_TYPE_PREDICATES[1:]]
+        predicates.append(features.link_circulation(graph))
+        for column, predicate in zip(features.FEATURE_COLUMNS[0:12], predicates):
+            self.assertAlmostEqual(row[column], features.extract_length(trajectory, predicate))
+        elev_m2, elev_m3 = features.extract_elevation_stats(trajectory, graph, elevation, 'epsg:3857')
+        self.assertAlmostEqual(row['elev_m2'], elev_m2)
+        self.assertAlmostEqual(row['elev_m3'], elev_m3)
+        self.assertEqual(row['left_turn'], features.extract_turn(trajectory, graph, features.left_turn))
+        self.assertEqual(row['right_turn'], features.extract_turn(trajectory, graph, features.right_turn))
+        self.assertEqual(row['intersections'], features.extract_intersection(trajectory, lambda node: True))
+        for name, collection in collections.items():
+            self.assertEqual(row[name], features.extract_intersection(
+                trajectory, features.intersection_collection(collection)), name)
+        self.assertEqual(row['duration'], 14)
+        self.assertAlmostEqual(row['avg_speed'], row['length'] / 14)
+        self.assertTrue(numpy.isnan(row['partition_begin']))
+
+        trajectories = [dict(trajectory, id=str(i)) for i in range(5)]
+        parallel_ids, parallel_matrix = extractor.matrix(trajectories, workers=2, chunksize=2)
+        self.assertEqual(parallel_ids, ['0', '1', '2', '3', '4'])
+        numpy.testing.assert_array_equal(parallel_matrix, numpy.tile(matrix[0], (5, 1)))
+
+        for name in ('features.json', 'features.csv'):
+            filename = os.path.join(self.directory.name, name)
+            features.save_feature_table(ids, matrix, filename)
+            loaded_ids, loaded = features.load_feature_table(filename)
+            self.assertEqual(loaded_ids, ids)
+            numpy.testing.assert_array_equal(loaded, matrix)
+
+    def test_tiled(self):
+        graph = self.graph
+        tiles = os.path.join(self.directory.name, 'tiles')
+        bundle.save_tiles(graph, tiles, 60.0)
+        tiled = bundle.open_graph(tiles)
+        trajectory = testing.make_trajectory(graph)
+        collections = {'end_of_facility': {1: [0]}, 'change_of_facility_type': {}, 'intersections_disc': {},
+                       'traffic_lights': {0: [0, 1]}}
+        elevation = raster.RasterImage.from_array(numpy.zeros((16, 16)), (-10.0, 10.0, 0.0, 140.0, 0.0, -10.0),
+                                                  'epsg:3857', 'epsg:3857')
+        _, expected = features.FeatureExtractor(graph, collections, elevation, None, 'epsg:3857').matrix([trajectory])
+        _, matrix = features.FeatureExtractor(tiled, collections, elevation, None, 'epsg:3857').matrix([trajectory])
+        numpy.testing.assert_allclose(matrix, expected)
+
+
+class TestMatchIntersections(testing.BundleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.points = [(1.0, -2.0), (98.0, 3.0), (60.0, 70.0), (5.0, 110.0), (51.0, 1.0)]
+
+    def test_match(self):
+        graph = self.graph
+        matched = features.match_intersections(({'geometry': sg.Point(p)} for p in self.points), graph)
+        self.assertEqual(matched, {0: [0], 1: [1, 4], 2: [2], 3: [3]})
+        self.assertEqual(features.match_intersections([], graph), {})
+
+    def test_cache(self):
+        graph = self.graph
+        layer = os.path.join(self.directory.name, 'lights')
+        writer = shapefile.Writer(layer, shapeType=shapefile.POINT)
+        writer.field('ID', 'N')
+        for i, (x, y) in enumerate(self.points):
+            writer.point(x, y)
+            writer.record(i)
+        writer.close()
+
+        cache = os.path.join(self.directory.name, 'cache')
+        matched = features.load_matched_layer(layer, graph, cache, self.directory.name)
+        self.assertEqual(matched, {0: [0], 1: [1, 4], 2: [2], 3: [3]})
+        self.assertEqual(len(os.listdir(cache)), 1)
+        # served from the cache, without matching
+        self.assertEqual(features.load_matched_layer(layer, None, cache, self.directory.name), matched)
+
+
+class TestRegionPartition(unittest.TestCase):
+
+    def test_fit_many(self):
+        regions = {
+            3: [(0.0, 0.0), (10.0, 0.0), (10.0, 10.0), (0.0, 10.0)],
+            5: [(10.0, 0.0), (20.0, 0.0), (10.0, 10.0)],
+            8: [(0.0, 10.0), (10.0, 10.0), (20.0, 15.0), (12.0, 20.0), (0.0, 20.0)],
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'region')
+            writer = shapefile.Writer(filename, shapeType=shapefile.POLYGON)
+            writer.field('ID', 'N')
+            for i, ring in regions.items():
+                writer.poly([ring + ring[0:1]])
+                writer.record(i)
+            writer.close()
+            partition = features.RegionPartition(filename, grid_size=8)
+
+        self.assertTrue((partition.grid >= 0).any())
+        self.assertTrue((partition.grid == -2).any())
+        points = numpy.random.RandomState(0).uniform(-2.0, 22.0, (2000, 2))
+        regions = partition.fit_many(points)
+        self.assertEqual(regions.dtype, numpy.int64)
+        for point, region in zip(points.tolist(), regions.tolist()):
+            expected = [i for i, polygon in partition.regions.items() if polygon.contains(sg.Point(point))]
+            self.assertEqual(region, expected[0] if expected else -1)
+        self.assertEqual(set(regions.tolist()), {-1, 3, 5, 8})
+        self.assertEqual(partition.fit_many([(5.0, 5.0), (30.0, 5.0)]).tolist(), [3, -1])
+        self.assertEqual(partition.fit(sg.Point(5.0, 5.0)), 3)
+        self.assertEqual(partition.fit(sg.Point(30.0, 5.0)), -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
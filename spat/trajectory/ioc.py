@@ -122,9 +122,15 @@ class Node:
         return graph.node_geometry(self.edge[1]).distance(goal.coordinates()) * greedy_factor
 
 
-def best_path(weights, eigen_vectors, trajectory, graph: facility.SpatialGraph, intersection_collections, elevation, dst_proj):
+def best_path(weights, eigen_vectors, trajectory, graph: facility.SpatialGraph, intersection_collections, elevation, dst_proj,
+              edge_features=None):
+    edge_costs = None
+    if edge_features is not None:
+        edge_costs = edge_features.costs(numpy.dot(eigen_vectors[0:14,:], weights))
 
     def distance_cost(length, start, end, link):
+        if link is not None and edge_costs is not None:
+            return edge_costs[edge_features.index(link)] * length
         start_elevation = elevation.at((start.x, start.y), dst_proj)
         end_elevation = elevation.at((end.x, end.y), dst_proj)
         cost = numpy.dot(numpy.dot(eigen_vectors[0:14,:].T, features.link_features(length, start_elevation, end_elevation, link, graph)), weights)
@@ -157,7 +163,9 @@ def best_path(weights, eigen_vectors, trajectory, graph: facility.SpatialGraph,
 
     feature = numpy.zeros(21)
     for node in path:
-        if isinstance(node, Node):
+        if isinstance(node, Node) and edge_features is not None:
+            feature[0:14] += edge_features.link_features(node.length(), node.edge)
+        elif isinstance(node, Node):
             geometry = graph.edge_geometry(node.edge)
             start = geometry.interpolate(node.begin)
             end = geometry.interpolate(node.end)
@@ -173,13 +181,17 @@ def best_path(weights, eigen_vectors, trajectory, graph: facility.SpatialGraph,
     return path, numpy.dot(eigen_vectors.T, feature)
 
 
-def feature_expectation(weights, eigen_vectors, trajectory, graph: facility.SpatialGraph, intersection_collections, elevation, dst_proj):
-    path, feature = best_path(weights, eigen_vectors, trajectory, graph, intersection_collections, elevation, dst_proj)
+def feature_expectation(weights, eigen_vectors, trajectory, graph: facility.SpatialGraph, intersection_collections, elevation, dst_proj,
+                        edge_features=None):
+    path, feature = best_path(weights, eigen_vectors, trajectory, graph, intersection_collections, elevation, dst_proj,
+                              edge_features)
     return feature
 
 
-def estimate_gradient(param, eigen_values, eigen_vectors, example, graph: facility.SpatialGraph, intersection_collections, elevation, dst_proj):
-    feature = feature_expectation(param, eigen_vectors, example[1], graph, intersection_collections, elevation, dst_proj)
+def estimate_gradient(param, eigen_values, eigen_vectors, example, graph: facility.SpatialGraph, intersection_collections, elevation, dst_proj,
+                      edge_features=None):
+    feature = feature_expectation(param, eigen_vectors, example[1], graph, intersection_collections, elevation, dst_proj,
+                                  edge_features)
     if feature is None:
         return None
     logging.info("example: %s", str(example[0]))
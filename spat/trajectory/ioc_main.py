@@ -1,11 +1,11 @@
 import sys, argparse, logging
-import pickle, json, geojson
+import pickle, geojson
 import shapely.geometry as sg
 import numpy
 import pyproj
 
 from spat.trajectory import ioc, features
-from spat import raster
+from spat import raster, bundle
 
 
 def make_geojson(trajectories, graph):
@@ -32,12 +32,20 @@ def main(argv):
     Learns weiths associated with a vector of features.
     """, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('--features', default = ['data/bike_path/features.json'], nargs='*',
-                        help='input pickle file of preprocessed (with spat.trajectory.preprocess) data.')
+                        help='input feature matrix files (with spat.trajectory.features).')
     parser.add_argument('--mapmatch', default = 'data/bike_path/mm.pickle', nargs='*',
                         help='input pickle file of preprocessed (with spat.trajectory.preprocess) data.')
     parser.add_argument('--facility', default = 'data/mtl_geobase/mtl.pickle',
-                        help="""input pickle file containing the facility graph 
-    (with spat.geobase.preprocess) representing the road network""")
+                        help="""input pickle file or bundle directory containing the facility graph
+    (with spat.geobase.preprocess) representing the road network. Trajectories mapmatched with
+    --original_edges take the uncompressed graph (spat.geobase.preprocess --original)""")
+
+    parser.add_argument('--intersection_cache',
+                        help="""directory caching the graph nodes matched by the intersection and
+    traffic light layers, for each facility. Without it, layers are matched on every run""")
+    parser.add_argument('--edge_features',
+                        help="""cache file of the per edge link features of the facility graph. It is
+    built on first use, and rebuilt when the facility or the elevation raster changes""")
 
     args = parser.parse_args()
     print('features:', args.features)
@@ -51,43 +59,21 @@ def main(argv):
         with open(filename, 'rb') as f:
             mm.extend(pickle.load(f))
 
-    feature_dict = {}
+    feature_ids = []
+    feature_table = []
     for filename in args.features:
-        with open(filename, 'r') as f:
-            feature_dict.update(json.load(f))
+        ids, table = features.load_feature_table(filename)
+        feature_ids.extend(ids)
+        feature_table.append(table)
+    feature_table = numpy.concatenate(feature_table)
+    feature_row = {i: row for row, i in enumerate(feature_ids)}
+    ioc_columns = [features.FEATURE_COLUMNS.index(column) for column in features.IOC_COLUMNS]
 
     elevation = raster.RasterImage("data/elevation/30n090w_20101117_gmted_min075.tif")
     dst_proj = pyproj.Proj(init='epsg:4326')
 
-    observation = []
-    for trajectory in mm:
-        if trajectory['id'] not in feature_dict:
-            continue
-        feature = feature_dict[trajectory['id']]
-        example = numpy.array([
-              feature['length'],
-              feature['length_cycling'],
-              feature['length_designated_roadway'],
-              feature['length_bike_lane'],
-              feature['length_seperate_cycling_link'],
-              feature['length_offroad'],
-              feature['length_other_road'],
-              feature['length_arterial'],
-              feature['length_collector'],
-              feature['length_highway'],
-              feature['length_local'],
-              feature['length_inverse'],
-              feature['elev_m2'],
-              feature['elev_m3'],
-              feature['left_turn'],
-              feature['right_turn'],
-              feature['intersections'],
-              feature['end_of_facility'],
-              feature['change_of_facility_type'],
-              feature['intersections_disc'],
-              feature['traffic_lights'],
-          ])
-        observation.append(example)
+    mm = [trajectory for trajectory in mm if trajectory['id'] in feature_row]
+    observation = [feature_table[feature_row[trajectory['id']], ioc_columns] for trajectory in mm]
 
     #print(observation)
     observation = numpy.array(observation).T
@@ -107,27 +93,19 @@ def main(argv):
 
     examples = []
     for i, trajectory in enumerate(mm):
-        if trajectory['id'] not in feature_dict:
-            continue
         examples.append((observation[:,i], trajectory))
         #print(observation[:, i])
 
-    with open(args.facility, 'rb') as f:
-        graph = pickle.load(f)
-    graph.build_spatial_node_index()
-    graph.build_spatial_edge_index()
-
-    intersection_collections = {
-        'end_of_facility': features.match_intersections(
-            features.load_discontinuity("data/discontinuity/end_of_facility"), graph),
-        'change_of_facility_type': features.match_intersections(
-            features.load_discontinuity("data/discontinuity/change_of_facility_type"), graph),
-        'intersections_disc': features.match_intersections(
-            features.load_discontinuity("data/intersections/intersections_on_bike_network_with_change_in_road_type"),
-            graph),
-        'traffic_lights': features.match_intersections(
-            features.load_traffic_lights("data/traffic_lights/All_lights"), graph),
-    }
+    graph = bundle.open_graph(args.facility)
+
+    intersection_collections = features.load_intersection_collections(graph, args.intersection_cache, args.facility)
+
+    edge_features = None
+    if not isinstance(graph, bundle.TiledGraph):
+        edge_features = features.EdgeFeatures.load_or_build(
+            args.edge_features, graph,
+            lambda nodes: features.node_elevations(graph, elevation, nodes, dst_proj),
+            facility=args.facility, raster_path=elevation.path)
 
     params = numpy.dot(numpy.ones(21), eigen_vectors)
     print(params)
@@ -135,7 +113,8 @@ def main(argv):
     params = ioc.inverse_optimal_control(
         examples,
         lambda param, examples: ioc.estimate_gradient(param, eigen_values, eigen_vectors, examples, graph,
-                                                      intersection_collections, elevation, dst_proj), params,
+                                                      intersection_collections, elevation, dst_proj,
+                                                      edge_features), params,
         0.01, 0.1, 10)
 
     logging.info("params: %s", str(params))
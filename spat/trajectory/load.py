@@ -19,11 +19,13 @@ def load_csv(data):
     src_proj = pyproj.Proj(init='epsg:4326')
     dst_proj = pyproj.Proj(init='epsg:2950')
 
+    epoch = datetime.datetime(1970, 1, 1)
+
     observations = []
     accuracy = []
     link = []
+    time = []
     previous_id = -1
-    previous_time = None
     for row in data:
         current_id = row[0]
         if current_id != previous_id:
@@ -33,23 +35,16 @@ def load_csv(data):
                     'observations': observations,
                     'accuracy': accuracy,
                     'id': previous_id,
-                    'link': link
+                    'link': link,
+                    'time': time
                 }
                 observations = []
                 accuracy = []
                 link = []
+                time = []
             previous_id = current_id
-            previous_time = None
 
         current_time = datetime.datetime.strptime(row[time_idx], '%Y-%m-%d %H:%M:%S')
-        while (previous_time is not None and
-                previous_time + datetime.timedelta(seconds=1) < current_time):
-            observations.append(None)
-            accuracy.append(None)
-            link.append(None)
-            previous_time += datetime.timedelta(seconds=1)
-
-        previous_time = current_time
         try:
             coord = pyproj.transform(src_proj, dst_proj,
                                      float(row[longitude_idx]),
@@ -63,6 +58,7 @@ def load_csv(data):
         observations.append(obs)
         accuracy.append(acc)
         link.append((int(row[src_node_idx]), int(row[dst_node_idx])))
+        time.append((current_time - epoch).total_seconds())
 
 
 def load_all(files, max_count):
@@ -5,7 +5,7 @@ from scipy import linalg, spatial
 import shapely.geometry as sg
 
 from spat import markov, utility, facility, kalman
-from spat.trajectory import features, model
+from spat.trajectory import features, model, smooth
 
 
 def ellipse_bounds(state, quantile):
@@ -23,19 +23,119 @@ def projection_distance_cost(state1, state2, travelled_distance):
     return state1.measurment_distance(state2.x[0] + travelled_distance, [1.0, 0.0], [state2.P[0, 0]])
 
 
+def project_segments(state: kalman.KalmanFilter, normal, direction, normal_distance,
+                     direction_distance, length, width):
+    """Projects one state onto K segments at once.
+
+    Vectorized equivalent of |Segment.project| over stacked segment parameters.
+
+    Args:
+      state: state to project.
+      normal, direction: unit normal and direction of each segment (Kx2).
+      normal_distance, direction_distance: offset of each segment along its normal
+        and its direction (K).
+      length: length of each segment (K).
+      width: measurment variance across each segment (K).
+
+    Returns:
+      cost of each projection (K), infinite where it is not possible.
+      constrained states x (Kx4) and P (Kx4x4).
+      projected states x (Kx2) and P (Kx2x2), relative to the segment origin.
+    """
+    K = len(length)
+
+    def projection_along(v):
+        M = numpy.zeros((K, 2, 4))
+        M[:, 0, 0:2] = v
+        M[:, 1, 2:4] = v
+        return M
+
+    H = projection_along(normal)
+    D = projection_along(direction)
+    x = numpy.asarray(state.x, dtype=float)
+    P = numpy.asarray(state.P)
+
+    with numpy.errstate(all='ignore'):
+        # measurment update across the segment
+        U = numpy.matmul(P, H.transpose(0, 2, 1))
+        S = numpy.matmul(H, U)
+        S[:, 0, 0] += width
+        S[:, 1, 1] += 1.0
+        S = kalman.inv2(S)
+        z = numpy.column_stack((normal_distance, numpy.zeros(K))) - numpy.matmul(H, x)
+        cost = numpy.einsum('ki,kij,kj->k', z, S, z) / 2
+        G = numpy.matmul(U, S)
+        X = x + numpy.einsum('kij,kj->ki', G, z)
+        P = P - numpy.matmul(numpy.matmul(G, H), P)
+
+        # inequality constraints along the segment
+        lower = [direction_distance, numpy.zeros(K)]
+        upper = [direction_distance + length, numpy.full(K, 50.0)]
+        for i in range(2):
+            omega = D[:, i, :]
+            Po = numpy.einsum('kij,kj->ki', P, omega)
+            oP = numpy.einsum('kj,kji->ki', omega, P)
+            vv = numpy.einsum('ki,ki->k', omega, Po)
+            v = numpy.sqrt(vv)
+            position = numpy.einsum('ki,ki->k', omega, X)
+            l, u, var = kalman.truncate_gaussian_many((lower[i] - position) / v,
+                                                      (upper[i] - position) / v)
+            cost -= l
+            X += Po * (u / v)[:, None]
+            P += ((var - 1.0) / vv)[:, None, None] * (Po[:, :, None] * oP[:, None, :])
+
+        projected_x = numpy.matmul(D, X[:, :, None])[:, :, 0]
+        projected_x[:, 0] -= direction_distance
+        projected_P = numpy.matmul(numpy.matmul(D, P), D.transpose(0, 2, 1))
+
+    valid = (length > 0.0) & numpy.isfinite(cost)
+    valid &= numpy.isfinite(X).all(axis=1) & numpy.isfinite(P).all(axis=(1, 2))
+    cost[~valid] = numpy.inf
+    return cost, X, P, projected_x, projected_P
+
+
+def gather_segments(parts):
+    """Concatenates the (segment table, rows) |parts| of a segment search.
+
+    A link found in several tables is only kept from the first one.
+    Returns the table, row and link (min node, max node, key) of every segment, and its
+    normal, direction, origin and length columns.
+    """
+    found = {}
+    tables = []
+    rows = []
+    links = []
+    columns = [[], [], [], []]
+    for table, part in parts:
+        keep = []
+        for e in table.edge[part].tolist():
+            u, v, k = table.edges[e]
+            link = (min(u, v), max(u, v), k)
+            keep.append(found.setdefault(link, table) is table)
+            if keep[-1]:
+                tables.append(table)
+                links.append(link)
+        part = part[numpy.array(keep, dtype=bool)]
+        rows.append(part)
+        for column, name in zip(columns, ('normal', 'direction', 'origin', 'length')):
+            column.append(getattr(table, name)[part])
+
+    if not parts:
+        return [], numpy.empty(0, dtype=numpy.int64), [], \
+            [numpy.empty((0, 2)), numpy.empty((0, 2)), numpy.empty((0, 2)), numpy.empty(0)]
+    return tables, numpy.concatenate(rows), links, [numpy.concatenate(column) for column in columns]
+
+
 class Segment:
-    def __init__(self, edge, coordinates, offset: float, width: float, distance: float, transition):
-        self.distance = distance
-        self.origin = numpy.asarray(coordinates[0])
-        self.destination = numpy.asarray(coordinates[1])
+    def __init__(self, edge, table: facility.SegmentTable, row: int, offset: float, width: float):
+        self.distance = table.distance[row]
+        self.origin = table.origin[row]
+        self.length = table.length[row]
         self.width = (width / (2.33*2.0))**2.0
         self.edge = edge
 
-        v = self.destination - self.origin
-        self.length = spatial.distance.euclidean(self.origin, self.destination)
-
-        self.direction = v / self.length
-        self.normal = utility.normal2d(v) / self.length
+        self.direction = table.direction[row]
+        self.normal = table.normal[row]
 
         def projection_along(v):
             return numpy.asmatrix([
@@ -45,9 +145,6 @@ class Segment:
         self.H = projection_along(self.normal)
         self.D = projection_along(self.direction)
 
-        F, Q = transition
-        self.F = self.D * F * self.D.T
-        self.Q = self.D * Q * self.D.T
         self.normal_distance = numpy.dot(self.normal, self.origin) + offset
         self.direction_distance = numpy.dot(self.direction, self.origin)
 
@@ -74,8 +171,9 @@ class Segment:
 
         return cost, state, projected_state
 
-    def advance(self, projected_state):
-        projected_state.time_update(self.F, self.Q)
+    def advance(self, projected_state, transition):
+        F, Q = transition
+        projected_state.time_update(self.D * F * self.D.T, self.D * Q * self.D.T)
         return projected_state
 
     def empty(self):
@@ -83,14 +181,11 @@ class Segment:
 
 
 class Link:
-    def __init__(self, graph: facility.SpatialGraph, transition, edge):
-        self.segments = []
-        self.length = 0.0
-        for coord in utility.pairwise(graph.edge_geometry(edge).coords):
-            #TODO: actually estimate link width and offset based on type and direction
-            segment = Segment(edge, coord, 0.0, 2.0, self.length, transition)
-            self.segments.append(segment)
-            self.length += segment.length
+    def __init__(self, graph: facility.SpatialGraph, edge):
+        table = graph.edge_segment_table(edge)
+        #TODO: actually estimate link width and offset based on type and direction
+        self.segments = [Segment(edge, table, row, 0.0, 2.0) for row in table.rows(edge)]
+        self.length = table.edge_length(edge)
 
     def __len__(self):
         return len(self.segments)
@@ -103,16 +198,23 @@ class Link:
 
 
 class LinkManager:
-    def __init__(self, graph: facility.SpatialGraph, transition):
+    def __init__(self, graph: facility.SpatialGraph, transitions):
         self.graph = graph
-        self.transition = transition
+        self.transitions = transitions
         self.link_table = {}
 
     def at(self, edge) -> Link:
         if edge not in self.link_table:
-            self.link_table[edge] = Link(self.graph, self.transition, edge)
+            self.link_table[edge] = Link(self.graph, edge)
         return self.link_table[edge]
 
+    def transition(self, idx):
+        """Transition from state |idx| to the next one."""
+        F, Q = self.transitions
+        if idx >= len(F):
+            return smooth.transition(1.0)
+        return numpy.asmatrix(F[idx]), Q[idx]
+
 
 class ProjectionManager:
     def __init__(self, states, graph: facility.SpatialGraph, geometry: LinkManager):
@@ -131,32 +233,53 @@ class ProjectionManager:
             if state is None:
                 state = self.states[i]
 
-            center = utility.bb_buffer(sg.Point(state.x[0:2]), 0.0)
             bounds = ellipse_bounds(state, quantile)
-            projections = []
-            projection_costs = []
-
-            def visit_edge(i, edge):
-                self.state_table[i][edge] = []
-                for offset, segment in enumerate(utility.pairwise(self.graph.edge_geometry(edge).coords)):
-                    if utility.intersect(sg.LineString(segment).bounds, bounds):
-                        cost, constrained_state, projected_state = self.at(i, edge, offset)
-                        projections.append((edge, offset, constrained_state, projected_state))
-                        projection_costs.append(cost)
-
             self.state_table[i] = {}
-            for x in self.graph.search_edge_nearest(center, 5):
-                u, v, key = x.object
-                visit_edge(i, (u, v, key))
-                visit_edge(i, (v, u, key))
-
-            k = min(5, len(projections))
-            indices = numpy.argpartition(projection_costs, k-1)[0:k]
-            for k in indices:
-                edge, offset, constrained_state, projected_state = projections[k]
-                cost = projection_costs[k]
-                self.state_table[i][edge].append(offset)
-                self.projection_table[i, edge, offset] = (cost, constrained_state, projected_state)
+
+            tables, rows, links, columns = gather_segments(self.graph.search_segments(bounds))
+
+            # keep segments of the 5 edges nearest to the state, in both directions
+            _, direction, origin, length = columns
+            distance = facility.segment_distance(origin, direction, length, state.x)
+            nearest = []
+            for r in numpy.argsort(distance, kind='stable').tolist():
+                if links[r] not in nearest:
+                    nearest.append(links[r])
+                    edge = int(tables[r].edge[rows[r]])
+                    self.state_table[i][tables[r].edges[edge & ~1]] = []
+                    self.state_table[i][tables[r].edges[edge | 1]] = []
+                    if len(nearest) == 5:
+                        break
+            keep = numpy.flatnonzero([link in nearest for link in links])
+            tables = [tables[r] for r in keep.tolist()]
+            rows = rows[keep]
+            normal, direction, origin, length = [column[keep] for column in columns]
+
+            width = (2.0 / (2.33*2.0))**2.0
+            costs, X, P, projected_x, projected_P = project_segments(
+                self.states[i],
+                normal,
+                direction,
+                numpy.einsum('ij,ij->i', normal, origin),
+                numpy.einsum('ij,ij->i', direction, origin),
+                length,
+                numpy.full(len(rows), width))
+
+            k = min(5, len(rows))
+            if k > 0:
+                indices = numpy.argpartition(costs, k-1)[0:k]
+                for k in indices:
+                    table = tables[k]
+                    edge = table.edges[table.edge[rows[k]]]
+                    offset = int(table.offset[rows[k]])
+                    self.state_table[i][edge].append(offset)
+                    if costs[k] == numpy.inf:
+                        self.projection_table[i, edge, offset] = (numpy.inf, None, None)
+                    else:
+                        self.projection_table[i, edge, offset] = (
+                            costs[k],
+                            kalman.KalmanFilter(X[k], P[k]),
+                            kalman.KalmanFilter(projected_x[k], projected_P[k]))
 
         return self.state_table[i]
 
@@ -188,7 +311,7 @@ class ProjectionManager:
 
 
 class LinkedNode:
-    def __init__(self, edge, offset: int, idx: int, link: Link, cost: float,
+    def __init__(self, edge, offset: int, idx: int, link: Link, transition, cost: float,
                  constrained_state: kalman.KalmanFilter,
                  projected_state: kalman.KalmanFilter):
         self.edge = edge
@@ -202,7 +325,7 @@ class LinkedNode:
         self.segment = self.link[self.offset]
 
         if self.projected_state is not None:
-            self.next_projected_state = self.segment.advance(self.projected_state.copy())
+            self.next_projected_state = self.segment.advance(self.projected_state.copy(), transition)
 
     def __str__(self):
         return "LinkedNode: " + str((self.edge, self.offset, self.idx))
@@ -227,6 +350,7 @@ class LinkedNode:
 
         def make_node(self, states, projections: ProjectionManager, geometry: LinkManager):
             return LinkedNode(self.edge, self.offset, self.idx, geometry.at(self.edge),
+                              geometry.transition(self.idx),
                               *projections.at(self.idx, self.edge, self.offset))
 
         def progress(self):
@@ -251,6 +375,13 @@ class LinkedNode:
 
         yield JumpingNode.Key(self)
 
+        if graph.ubodt is not None:
+            for next_edge in projections.project_state(self.idx + 1):
+                route = graph.ubodt.path(self.edge[1], next_edge[0])
+                if route is not None:
+                    yield RoutedNode.Key(self, route + [next_edge], self.next_projected_state)
+            return
+
         distance = self.link.length - self.segment.distance
         for next_edge in graph.adjacent(self.edge[1]):
             u, v, k = next_edge
@@ -268,6 +399,8 @@ class LinkedNode:
     def cost_to(self, other, distance_cost_fcn, intersection_cost_fcn):
         if isinstance(other, FinalNode):
             return 0.0
+        if isinstance(other, RoutedNode):
+            return other.route_cost(distance_cost_fcn, intersection_cost_fcn)
         cost = 0.0
         if isinstance(other, LinkedNode) or isinstance(other, ForwardingNode):
           cost += distance_cost_fcn(self.distance_to(other), self.coordinates(), other.coordinates(), self.edge)
@@ -366,6 +499,66 @@ class ForwardingNode:
                                  cumulative_distance[self.anchor.idx + 1]))
 
 
+class RoutedNode(ForwardingNode):
+    """Start of the edge of a candidate segment, reached through a UBODT route.
+
+    It replaces the chain of ForwardingNodes leading from |anchor| to |edge|, and
+    its transition from |anchor| costs as much as that chain would.
+    """
+    def __init__(self, anchor: LinkedNode, path, links, projected_state):
+        distance = anchor.link.length - anchor.segment.distance
+        for link in links[:-1]:
+            distance += link.length
+        ForwardingNode.__init__(self, anchor, distance, path[-1], links[-1], projected_state)
+        self.path = path
+        self.links = links
+
+    def __str__(self):
+        return "RoutedNode: " + str((self.anchor.edge, self.anchor.offset, self.anchor.idx,
+                                     self.distance, self.path))
+
+    class Key:
+        def __init__(self, anchor, path, projected_state):
+            self.anchor = anchor
+            self.path = path
+            self.edge = path[-1]
+            self.projected_state = projected_state
+
+        def __eq__(self, other):
+            return (isinstance(other, self.__class__) and
+                    self.anchor.idx == other.anchor.idx and
+                    self.edge == other.edge)
+
+        def __hash__(self):
+            return hash((self.anchor.idx, self.edge))
+
+        def __lt__(self, other):
+            return (self.anchor.idx, self.edge) < (other.anchor.idx, other.edge)
+
+        def make_node(self, states, projections: ProjectionManager, geometry: LinkManager):
+            return RoutedNode(self.anchor, self.path, [geometry.at(edge) for edge in self.path],
+                              self.projected_state)
+
+        def progress(self):
+            return self.edge, self.anchor.idx
+
+    def adjacent_nodes(self, states, projections: ProjectionManager, graph: facility.SpatialGraph, geometry: LinkManager):
+        for offset in projections.search_edge(self.anchor.idx + 1, self.edge, 0):
+            yield LinkedNode.Key(self.edge, offset, self.anchor.idx + 1)
+
+    def route_cost(self, distance_cost_fcn, intersection_cost_fcn):
+        """Cost of the transition from |anchor|, accumulated edge by edge along the route."""
+        cost = 0.0
+        edge = self.anchor.edge
+        coordinates = self.anchor.coordinates()
+        length = abs(self.anchor.link.length - self.anchor.projection())
+        for next_edge, link in zip(self.path, self.links):
+            cost += distance_cost_fcn(length, coordinates, link[0].origin, edge)
+            cost += intersection_cost_fcn(edge, next_edge)
+            edge, coordinates, length = next_edge, link[0].origin, link.length
+        return cost
+
+
 class FloatingNode:
     def __init__(self, idx, state: kalman.KalmanFilter):
         self.idx = idx
@@ -566,7 +759,27 @@ def format_path(path):
             begin_bound = model.MatchedSegment.Bound(node.projection(), False, node.idx)
             geometry = []
 
-        if isinstance(node, ForwardingNode):
+        if isinstance(node, RoutedNode):
+            length = node.anchor.link.length
+            for edge, link in zip(node.path[:-1], node.links[:-1]):
+                end_bound = model.MatchedSegment.Bound(length, True, node.anchor.idx + 1)
+                geometry.append(link[0].origin)
+                yield model.MatchedSegment(current_edge, geometry, begin_bound, end_bound)
+
+                current_edge = edge
+                begin_bound = model.MatchedSegment.Bound(0.0, True, node.anchor.idx + 1)
+                geometry = [link[0].origin]
+                length = link.length
+
+            end_bound = model.MatchedSegment.Bound(length, True, node.anchor.idx + 1)
+            geometry.append(node.coordinates())
+            yield model.MatchedSegment(current_edge, geometry, begin_bound, end_bound)
+
+            current_edge = node.edge
+            begin_bound = model.MatchedSegment.Bound(0.0, True, node.anchor.idx + 1)
+            geometry = [node.coordinates()]
+
+        elif isinstance(node, ForwardingNode):
             end_bound = model.MatchedSegment.Bound(node.anchor.link.length, True, node.anchor.idx + 1)
 
             assert begin_bound is not None and current_edge is not None
@@ -602,12 +815,63 @@ def format_path(path):
         previous_node = node
 
 
-def solve(trajectory, graph, distance_cost_fcn, intersection_cost_fcn, greedy_factor):
-    logging.info("solving mapmatch for %s", trajectory['id'])
+def split_segments(segments, graph):
+    """Splits matched |segments| lying on edges merged by graph compression.
+
+    Each piece lies on one of the original edges, with bounds measured along it. Bounds
+    at cuts between original edges are attached, and their state index is interpolated
+    between the bounds of the segment.
+    """
+    for segment in segments:
+        if segment.edge is None:
+            yield segment
+            continue
+        original = graph.original_edges(segment.edge)
+        if len(original) == 1 and original[0][0] == segment.edge:
+            yield segment
+            continue
+
+        begin, end = segment.begin, segment.end
+        line = graph.edge_geometry(segment.edge)
+        start = begin.projection if begin.projection is not None else 0.0
+        stop = end.projection if end.projection is not None else line.length
+        along = [line.project(sg.Point(p)) for p in segment.geometry]
+
+        def cut(distance):
+            if stop > start:
+                idx = begin.idx + math.ceil((distance - start) / (stop - start) * (end.idx - begin.idx))
+            else:
+                idx = end.idx
+            return model.MatchedSegment.Bound(0.0, True, idx), line.interpolate(distance).coords[0]
+
+        pieces = [(edge, b, e) for edge, b, e in original if b < stop and e > start]
+        if not pieces:
+            pieces = [min(original, key=lambda piece: abs(piece[1] - start))]
+        previous = None
+        for i, (edge, b, e) in enumerate(pieces):
+            last = i == len(pieces) - 1
+            if previous is None:
+                piece_begin = model.MatchedSegment.Bound(
+                    None if begin.projection is None else begin.projection - b, begin.attached, begin.idx)
+                geometry = []
+            else:
+                piece_begin, point = previous
+                geometry = [point]
+            geometry += [p for p, d in zip(segment.geometry, along)
+                         if (previous is None or d > b) and (last or d <= e)]
+            if last:
+                piece_end = model.MatchedSegment.Bound(
+                    None if end.projection is None else end.projection - b, end.attached, end.idx)
+            else:
+                bound, point = cut(e)
+                piece_end = model.MatchedSegment.Bound(e - b, True, bound.idx)
+                geometry.append(point)
+                previous = (bound, point)
+            yield model.MatchedSegment(edge, geometry, piece_begin, piece_end)
 
-    states = trajectory['state']
-    link_manager = LinkManager(graph, trajectory['transition'])
 
+def find_path_astar(states, graph, projections: ProjectionManager, link_manager: LinkManager,
+                    distance_cost_fcn, intersection_cost_fcn, greedy_factor, max_queue=None):
     cumulative_distance = [0.0]
     total_distance = 0.0
     for s1, s2 in utility.pairwise(states):
@@ -615,8 +879,6 @@ def solve(trajectory, graph, distance_cost_fcn, intersection_cost_fcn, greedy_fa
         total_distance += distance
         cumulative_distance.append(total_distance)
 
-    projections = ProjectionManager(states, graph, link_manager)
-
     def adjacent_nodes(key):
         return key.adjacent_nodes(states, projections, graph, link_manager)
 
@@ -641,16 +903,202 @@ def solve(trajectory, graph, distance_cost_fcn, intersection_cost_fcn, greedy_fa
     chain = markov.MarkovGraph(adjacent_nodes, state_cost, transition_cost,
                                handicap_fcn=handicap, state_projection=project)
 
-    start_time = time.time()
     path = chain.find_best(InitialNode(), FinalNode(), heuristic,
-                           priority_threshold=50000.0, progress_fcn=progress, max_visited=len(states) * 20)
-    logging.info("elapsed_time: %.4f", time.time() - start_time)
+                           priority_threshold=50000.0, progress_fcn=progress, max_visited=len(states) * 20,
+                           max_queue=max_queue)
     if path is None:
+        return None
+    return list([project(key) for key in path])
+
+
+# kinds of viterbi transitions
+DIRECT, JUMP, ROUTE = 0, 1, 2
+
+
+def each_distance_cost(distance_cost_fcn):
+    """|distance_cost_many| calling |distance_cost_fcn| on each traversal."""
+    def fn(lengths, starts, ends, link):
+        return numpy.array([distance_cost_fcn(length, start, end, link)
+                            for length, start, end in zip(lengths, starts, ends)], dtype=float)
+    return fn
+
+
+def find_path_viterbi(states, graph, projections: ProjectionManager, link_manager: LinkManager,
+                      distance_cost_fcn, intersection_cost_fcn, distance_cost_many=None, k=5):
+    """Finds the best path with a dynamic program over the candidates of each state.
+
+    Candidates of a state are the |k| cheapest segments retained by |projections|, plus
+    a floating node off the network. Between two consecutive candidates, the transition
+    is the cheapest of moving forward on the same edge, routing to the next edge through
+    the UBODT of |graph|, or jumping, each costed like the nodes of the A* search.
+    A path always exists through floating nodes, and runtime is O(T k^2) for T states.
+
+    Off network and same edge costs of a layer are computed as arrays, with
+    |distance_cost_many(lengths, starts, ends, link)|, the costs of |distance_cost_fcn|
+    for arrays of traversals of |link|. It defaults to calling |distance_cost_fcn| on
+    each of them. Only routed pairs of candidates are costed one at a time.
+
+    Returns the node sequence of the path, in the form expected by |format_path|.
+    """
+    if graph.ubodt is None:
+        raise ValueError("the viterbi solver routes transitions through a UBODT, "
+                         "which the facility graph does not have")
+    if distance_cost_many is None:
+        distance_cost_many = each_distance_cost(distance_cost_fcn)
+    paths = {}
+
+    def candidates(idx):
+        nodes = []
+        for edge, offsets in projections.project_state(idx, 50.0 if idx == 0 else 6.0).items():
+            for offset in offsets:
+                node = LinkedNode.Key(edge, offset, idx).make_node(states, projections, link_manager)
+                if node.cost() < math.inf:
+                    nodes.append(node)
+        nodes.sort(key=lambda node: node.cost())
+        return [FloatingNode(idx, states[idx])] + nodes[0:k]
+
+    def route(source, target):
+        if (source, target) not in paths:
+            paths[source, target] = graph.ubodt.path(source, target)
+        return paths[source, target]
+
+    def projected(nodes, attribute):
+        x = numpy.array([getattr(node, attribute).x[0] for node in nodes])
+        P = numpy.array([getattr(node, attribute).P[0, 0] for node in nodes])
+        return x, P
+
+    def transitions(layer, following_layer):
+        """Transition costs between two layers, and the kind of each best transition.
+
+        Kinds are DIRECT (floating or same edge), JUMP and ROUTE, with the routed
+        nodes of ROUTE transitions keyed by (row, column).
+        """
+        start = numpy.array([node.coordinates() for node in layer])
+        end = numpy.array([node.coordinates() for node in following_layer])
+        n, m = len(start), len(end)
+        rows, columns = numpy.meshgrid(numpy.arange(n), numpy.arange(m), indexing='ij')
+        rows, columns = rows.ravel(), columns.ravel()
+
+        # off the network, from the floating node or jumping from a linked one
+        cost = distance_cost_many(spatial.distance.cdist(start, end).ravel(),
+                                  start[rows], end[columns], None).reshape(n, m)
+        kind = numpy.full((n, m), JUMP, dtype=numpy.int8)
+        kind[0] = DIRECT
+        linked, following = layer[1:], following_layer[1:]
+        if not linked or not following:
+            return cost, kind, {}
+
+        edge = [node.edge for node in linked]
+        following_edge = [node.edge for node in following]
+        same_link = numpy.array([[e == f or (e[1], e[0], e[2]) == f for f in following_edge] for e in edge])
+        cost[1:, 1:][same_link] = math.inf
+
+        # forward on the same edge
+        offset = numpy.array([node.offset for node in linked])
+        following_offset = numpy.array([node.offset for node in following])
+        distance = numpy.array([node.segment.distance for node in linked])
+        following_distance = numpy.array([node.segment.distance for node in following])
+        position = numpy.array([node.projection() for node in linked])
+        following_position = numpy.array([node.projection() for node in following])
+        x, P = projected(linked, 'next_projected_state')
+        following_x, following_P = projected(following, 'projected_state')
+        for e in set(edge) & set(following_edge):
+            on_edge = numpy.array([f == e for f in edge])
+            following_on_edge = numpy.array([f == e for f in following_edge])
+            i, j = numpy.nonzero(on_edge[:, None] & following_on_edge[None, :] &
+                                 (offset[:, None] <= following_offset[None, :]))
+            if len(i) == 0:
+                continue
+            forward = distance_cost_many(numpy.abs(following_position[j] - position[i]),
+                                         start[i + 1], end[j + 1], e)
+            z = following_x[j] + following_distance[j] - distance[i] - x[i]
+            forward += z**2 / (P[i] + following_P[j]) / 2
+            better = forward < cost[i + 1, j + 1]
+            cost[i[better] + 1, j[better] + 1] = forward[better]
+            kind[i[better] + 1, j[better] + 1] = DIRECT
+
+        # routed to the edge of the following candidate
+        routed = {}
+        for i, current in enumerate(linked):
+            for j, candidate in enumerate(following):
+                path = route(current.edge[1], candidate.edge[0])
+                if path is None:
+                    continue
+                node = RoutedNode.Key(current, path + [candidate.edge], current.next_projected_state).make_node(
+                    states, projections, link_manager)
+                c = (current.cost_to(node, distance_cost_fcn, intersection_cost_fcn) +
+                     node.cost_to(candidate, distance_cost_fcn, intersection_cost_fcn))
+                if c < cost[i + 1, j + 1]:
+                    cost[i + 1, j + 1] = c
+                    kind[i + 1, j + 1] = ROUTE
+                    routed[i + 1, j + 1] = node
+        return cost, kind, routed
+
+    layer = candidates(0)
+    total = numpy.array([node.cost() for node in layer])
+    layers = [layer]
+    backtrack = []
+    for idx in range(1, len(states)):
+        following_layer = candidates(idx)
+        cost, kind, routed = transitions(layer, following_layer)
+        cost += total[:, None]
+        best = numpy.argmin(cost, axis=0)
+        columns = numpy.arange(len(following_layer))
+        total = cost[best, columns] + numpy.array([node.cost() for node in following_layer])
+        backtrack.append((best, kind[best, columns], routed))
+        layer = following_layer
+        layers.append(layer)
+
+    j = int(numpy.argmin(total))
+    path = [FinalNode(), layers[-1][j]]
+    for idx in reversed(range(len(backtrack))):
+        best, kind, routed = backtrack[idx]
+        i = int(best[j])
+        if kind[j] == ROUTE:
+            path.append(routed[i, j])
+        elif kind[j] == JUMP:
+            path.append(JumpingNode(layers[idx][i], states[idx + 1]))
+        j = i
+        path.append(layers[idx][j])
+    path.append(InitialNode())
+    path.reverse()
+    return path
+
+
+def solve(trajectory, graph, distance_cost_fcn, intersection_cost_fcn, greedy_factor, solver='astar',
+          max_queue=None, distance_cost_many=None, viterbi_candidates=5):
+    """Mapmatches a smoothed |trajectory| on the facility |graph|.
+
+    |solver| is either 'astar', a best-first search guided by |greedy_factor| that gives
+    up when its search budget is exhausted, or 'viterbi', a dynamic program over the
+    |viterbi_candidates| cheapest candidates of every state. |max_queue| bounds the
+    queue of the A* search.
+    The A* search follows edges one at a time when |graph| has no UBODT. The viterbi
+    solver only routes through the UBODT, and raises a ValueError without one, as it
+    would otherwise reach adjacent edges only and jump to any farther candidate.
+    See find_path_viterbi for |distance_cost_many|.
+    """
+    logging.info("solving mapmatch for %s", trajectory['id'])
+
+    states = trajectory['state']
+    link_manager = LinkManager(graph, smooth.step_transitions(trajectory))
+    projections = ProjectionManager(states, graph, link_manager)
+
+    start_time = time.time()
+    if solver == 'viterbi':
+        nodes = find_path_viterbi(states, graph, projections, link_manager,
+                                  distance_cost_fcn, intersection_cost_fcn, distance_cost_many,
+                                  viterbi_candidates)
+    else:
+        nodes = find_path_astar(states, graph, projections, link_manager,
+                                distance_cost_fcn, intersection_cost_fcn, greedy_factor, max_queue)
+    logging.info("elapsed_time: %.4f", time.time() - start_time)
+    if nodes is None:
         logging.warning("trashing %s due to incomplete mapmatch", trajectory['id'])
         return None
 
-    nodes = list([project(key) for key in path])
     return {'segment': list(format_path(nodes)),
             'id': trajectory['id'],
             #'node': nodes,
-            'count': len(trajectory['state'])}
+            'count': len(trajectory['state']),
+            'time': trajectory.get('time')}
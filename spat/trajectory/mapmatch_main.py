@@ -5,7 +5,7 @@ import numpy
 import pyproj
 
 from spat.trajectory import mapmatch, smooth, load, features
-from spat import raster, utility
+from spat import raster, utility, parallel, ubodt, bundle
 
 
 def make_geojson(trajectories, graph):
@@ -45,7 +45,7 @@ def main(argv):
     parser.add_argument('-i', '--ifile', default = 'data/bike_path/Chunk_1_mm.csv',
                         help='input pickle file of preprocessed (with spat.trajectory.preprocess) data.')
     parser.add_argument('--facility', default = 'data/mtl_geobase/mtl.pickle',
-                        help="""input pickle file containing the facility graph 
+                        help="""input pickle file, bundle directory or tiled graph directory containing the facility graph
     (with spat.geobase.preprocess) representing the road network""")
     parser.add_argument('-o', '--ofile', default = 'data/bike_path/mm_1.pickle',
                         help='output pickle file containing an array of segments')
@@ -53,20 +53,50 @@ def main(argv):
                         help='output geojson file to export constrained geometry')
     parser.add_argument('--factor', default=15.0, type=float,
                         help='heuristic factor. Higher is more greedy')
+    parser.add_argument('--solver', choices=['astar', 'viterbi'], default='astar',
+                        help="""path search. viterbi runs a dynamic program over the candidates of
+    every state, and does not depend on search budgets. It requires --ubodt""")
+    parser.add_argument('--viterbi_candidates', type=int, default=5,
+                        help="""number of candidate segments of each state kept by the viterbi solver,
+    the cheapest ones""")
+    parser.add_argument('--max_queue', type=int, default=None,
+                        help="""maximum number of queued states of the astar solver. States with
+    the highest priority are dropped beyond it""")
     parser.add_argument('--max', type=int, default=None,
                         help='maximum number of trajectory that will be processed')
+    parser.add_argument('--ubodt',
+                        help="""input UBODT file of the facility graph (with spat.geobase.preprocess).
+    Transitions between consecutive states are then routed through it""")
+    parser.add_argument('--tile_capacity', type=int, default=64,
+                        help="""maximum number of resident tiles when the facility is a tiled graph.
+    Tiles around each trajectory are loaded on demand""")
+    parser.add_argument('--original_edges', action='store_true',
+                        help="""report matched segments on the original edges of a compressed facility
+    graph (with spat.geobase.preprocess --compress). The output then refers to the uncompressed
+    graph (saved with spat.geobase.preprocess --original), the facility to pass to the tools reading it""")
+    parser.add_argument('--edge_features',
+                        help="""cache file of the per edge link features of the facility graph. It is
+    built on first use, and rebuilt when the facility or the elevation raster changes""")
+    parser.add_argument('--intersection_cache',
+                        help="""directory caching the graph nodes matched by the intersection and
+    traffic light layers, for each facility. Without it, layers are matched on every run""")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="""number of worker processes. The facility graph and its indexes
+    are loaded once and shared with the workers""")
 
     args = parser.parse_args()
+    if args.solver == 'viterbi' and args.ubodt is None:
+        parser.error("--solver viterbi requires --ubodt")
     print('input file:', args.ifile)
     print('facility:', args.facility)
     print('output file:', args.ofile)
 
     logging.basicConfig(level=logging.INFO)
 
-    with open(args.facility, 'rb') as f:
-        graph = pickle.load(f)
-    graph.build_spatial_edge_index()
-    graph.build_spatial_node_index()
+    graph = bundle.open_graph(args.facility, args.tile_capacity)
+    graph.build_segment_table()
+    if args.ubodt is not None:
+        graph.ubodt = ubodt.UBODT.load(args.ubodt)
 
     weights = numpy.array([
         -1.16736728,  0.40705898,  0.98938962,  1.00983071,  0.04520515,  0.70477058,
@@ -76,22 +106,22 @@ def main(argv):
     link_weights = weights[0:14]
     intersection_weights = weights[14:21]
 
-    intersection_collections = {
-        'end_of_facility': features.match_intersections(
-            features.load_discontinuity("data/discontinuity/end_of_facility"), graph),
-        'change_of_facility_type': features.match_intersections(
-            features.load_discontinuity("data/discontinuity/change_of_facility_type"), graph),
-        'intersections_disc': features.match_intersections(
-            features.load_discontinuity("data/intersections/intersections_on_bike_network_with_change_in_road_type"),
-            graph),
-        'traffic_lights': features.match_intersections(
-            features.load_traffic_lights("data/traffic_lights/All_lights"), graph),
-    }
+    intersection_collections = features.load_intersection_collections(graph, args.intersection_cache, args.facility)
 
     elevation = raster.RasterImage("data/elevation/30n090w_20101117_gmted_min075.tif")
     dst_proj = pyproj.Proj(init='epsg:4326')
 
+    edge_costs = None
+    if not isinstance(graph, bundle.TiledGraph):
+        edge_features = features.EdgeFeatures.load_or_build(
+            args.edge_features, graph,
+            lambda nodes: features.node_elevations(graph, elevation, nodes, dst_proj),
+            facility=args.facility, raster_path=elevation.path)
+        edge_costs = edge_features.costs(link_weights)
+
     def distance_cost(length, start, end, link):
+        if link is not None and edge_costs is not None:
+            return edge_costs[edge_features.index(link)] * length
         start_elevation = elevation.at(start, dst_proj)
         end_elevation = elevation.at(end, dst_proj)
         cost = numpy.dot(features.link_features(length, start_elevation, end_elevation, link, graph), link_weights)
@@ -99,19 +129,37 @@ def main(argv):
             cost += 30.0 * length
         return cost
 
+    def distance_cost_many(lengths, starts, ends, link):
+        if link is not None and edge_costs is not None:
+            return edge_costs[edge_features.index(link)] * lengths
+        rise = elevation.sample(ends, dst_proj=dst_proj) - elevation.sample(starts, dst_proj=dst_proj)
+        slope = numpy.zeros(len(lengths))
+        numpy.divide(rise, lengths, out=slope, where=lengths > 0.0)
+        unit = numpy.dot(features.link_features(1.0, 0.0, 0.0, link, graph)[0:12], link_weights[0:12])
+        cost = lengths * (unit + link_weights[12] * slope**2 + link_weights[13] * slope**3)
+        if link is None:
+            cost += 30.0 * lengths
+        return cost
+
     def intersection_cost(a, b):
         return numpy.dot(features.intersection_features(a, b, graph, intersection_collections), intersection_weights)
 
+    def match(trajectory):
+        smoothed_trajectory = smooth.smooth_state(trajectory)
+        if smoothed_trajectory is None:
+            return None
+        matched_trajectory = mapmatch.solve(smoothed_trajectory, graph, distance_cost, intersection_cost,
+                                            args.factor, args.solver, args.max_queue,
+                                            distance_cost_many, args.viterbi_candidates)
+        if matched_trajectory is not None and args.original_edges:
+            matched_trajectory['segment'] = list(mapmatch.split_segments(matched_trajectory['segment'], graph))
+        return matched_trajectory
+
     matched = []
     with open(args.ifile, 'r') as f:
         input_data = csv.reader(f)
-        for trajectory in utility.take(load.load_csv(input_data), args.max):
-            #if trajectory['id'] != '1012':
-            #    continue
-            smoothed_trajectory = smooth.smooth_state(trajectory)
-            if smoothed_trajectory is None:
-                continue
-            matched_trajectory = mapmatch.solve(smoothed_trajectory, graph, distance_cost, intersection_cost, args.factor)
+        trajectories = utility.take(load.load_csv(input_data), args.max)
+        for matched_trajectory in parallel.fork_map(match, trajectories, args.workers):
             if matched_trajectory is None:
                 continue
             matched.append(matched_trajectory)
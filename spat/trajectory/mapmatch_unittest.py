@@ -0,0 +1,145 @@
+import tempfile
+import unittest
+import numpy
+import shapely.geometry as sg
+
+from spat import bundle, kalman, raster, testing, ubodt
+from spat.trajectory import features, mapmatch, model, smooth
+
+
+def make_compressible_graph():
+    """make_loop_graph with a pendant edge at nodes 0 and 3, so that compression merges 0 - 1 - 2 - 3."""
+    graph = testing.make_loop_graph()
+    for u, v, line in [(0, 4, [(0.0, 0.0), (-50.0, 0.0)]), (3, 5, [(0.0, 120.0), (0.0, 170.0)])]:
+        graph.graph.add_node(v, geometry=sg.Point(line[-1]))
+        k = graph.graph.add_edge(u, v, order=True, type=11, sens=0)
+        graph.geometry[u, v, k] = sg.LineString(line)
+        graph.geometry[v, u, k] = sg.LineString(list(reversed(line)))
+    return graph
+
+
+def make_transitions(count):
+    return smooth.transition(numpy.ones(count - 1))
+
+
+class TestMapmatch(unittest.TestCase):
+
+    def test_project_segments(self):
+        graph = testing.make_loop_graph()
+        table = graph.segment_table
+        state = kalman.KalmanFilter([30.0, 4.0, 1.5, 0.3],
+                                    numpy.identity(4) * 10.0 + numpy.ones((4, 4)))
+        rows = numpy.arange(len(table))
+        width = (2.0 / (2.33*2.0))**2.0
+        cost, X, P, projected_x, projected_P = mapmatch.project_segments(
+            state, table.normal, table.direction,
+            numpy.einsum('ij,ij->i', table.normal, table.origin),
+            numpy.einsum('ij,ij->i', table.direction, table.origin),
+            table.length, numpy.full(len(table), width))
+
+        link_manager = mapmatch.LinkManager(graph, make_transitions(2))
+        for row in rows:
+            segment = link_manager.at(table.edges[table.edge[row]])[table.offset[row]]
+            expected_cost, expected_state, expected_projection = segment.project(state.copy())
+            if expected_state is None:
+                self.assertEqual(cost[row], numpy.inf)
+                continue
+            self.assertAlmostEqual(cost[row], expected_cost)
+            numpy.testing.assert_allclose(X[row], expected_state.x, atol=1e-8)
+            numpy.testing.assert_allclose(P[row], expected_state.P, atol=1e-8)
+            numpy.testing.assert_allclose(projected_x[row], expected_projection.x, atol=1e-8)
+            numpy.testing.assert_allclose(projected_P[row], expected_projection.P, atol=1e-8)
+
+    def test_project_state(self):
+        graph = testing.make_loop_graph()
+        states = [kalman.KalmanFilter([30.0, 2.0, 1.0, 0.0], numpy.identity(4) * 10.0),
+                  kalman.KalmanFilter([101.0, 20.0, 0.0, 1.0], numpy.identity(4) * 10.0)]
+        projections = mapmatch.ProjectionManager(
+            states, graph, mapmatch.LinkManager(graph, make_transitions(2)))
+
+        self.assertEqual(projections.project_state(0), {(0, 1, 0): [0], (1, 0, 0): [1]})
+        self.assertEqual(projections.project_state(1), {(1, 2, 0): [0], (2, 1, 0): [0]})
+
+    def test_find_path_viterbi(self):
+        graph = testing.make_loop_graph()
+        states = [kalman.KalmanFilter([x, y, vx, vy], numpy.identity(4) * 4.0) for x, y, vx, vy in [
+            (40.0, 1.0, 20.0, 0.0), (60.0, -1.0, 20.0, 0.0), (80.0, 1.0, 20.0, 0.0),
+            (101.0, 10.0, 0.0, 20.0), (99.0, 30.0, 0.0, 20.0), (101.0, 50.0, 0.0, 20.0)]]
+        link_manager = mapmatch.LinkManager(graph, make_transitions(len(states)))
+        projections = mapmatch.ProjectionManager(states, graph, link_manager)
+
+        def distance_cost(length, start, end, link):
+            return length * (1.0 if link is not None else 30.0)
+
+        def intersection_cost(a, b):
+            return 1.0
+
+        def distance_cost_many(lengths, starts, ends, link):
+            return lengths * (1.0 if link is not None else 30.0)
+
+        self.assertRaises(ValueError, mapmatch.find_path_viterbi, states, graph, projections, link_manager,
+                          distance_cost, intersection_cost)
+        graph.compile()
+        graph.ubodt = ubodt.build(graph, 500.0)
+        path = mapmatch.find_path_viterbi(states, graph, projections, link_manager,
+                                          distance_cost, intersection_cost)
+        segments = list(mapmatch.format_path(path))
+        self.assertEqual([segment.edge for segment in segments], [(0, 1, 0), (1, 2, 0)])
+        self.assertEqual(segments[0].end.idx, 3)
+        self.assertEqual(segments[1].end.idx, len(states))
+
+        vectorized = mapmatch.find_path_viterbi(states, graph, projections, link_manager,
+                                                distance_cost, intersection_cost, distance_cost_many, k=2)
+        self.assertEqual([str(node) for node in vectorized], [str(node) for node in path])
+        astar = mapmatch.find_path_astar(states, graph, projections, link_manager,
+                                         distance_cost, intersection_cost, 0.0, None)
+        self.assertEqual([segment.edge for segment in mapmatch.format_path(astar)], [(0, 1, 0), (1, 2, 0)])
+
+    def test_split_segments(self):
+        graph = make_compressible_graph()
+        self.assertEqual(graph.compress(), 2)
+        # (0, 1), (1, 2) and (2, 3) are merged, with cuts at 100.0 and 180.0
+        edge = (0, 3, 1)
+        self.assertEqual(graph.original_edges(edge)[1], ((1, 2, 0), 100.0, 180.0))
+        Bound = model.MatchedSegment.Bound
+        segments = [
+            model.MatchedSegment(None, [(-5.0, 0.0)], Bound(None, False, 0), Bound(None, False, 2)),
+            model.MatchedSegment(edge, [(100.0, 20.0), (100.0, 60.0), (80.0, 88.0)],
+                                 Bound(120.0, False, 2), Bound(201.5, True, 12)),
+        ]
+        pieces = list(mapmatch.split_segments(segments, graph))
+        self.assertIs(pieces[0], segments[0])
+        self.assertEqual([piece.edge for piece in pieces[1:]], [(1, 2, 0), (2, 3, 0)])
+        first, second = pieces[1:]
+        self.assertEqual((first.begin.projection, first.end.projection), (20.0, 80.0))
+        self.assertTrue(first.end.attached and second.begin.attached)
+        self.assertEqual((first.end.idx, second.begin.idx), (10, 10))
+        self.assertAlmostEqual(second.end.projection, 21.5)
+        self.assertEqual(first.geometry, [(100.0, 20.0), (100.0, 60.0), (100.0, 80.0)])
+        self.assertEqual(second.geometry, [(100.0, 80.0), (80.0, 88.0)])
+
+    def test_split_segments_features(self):
+        # trajectories split on original edges are read with the uncompressed graph
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        bundle.save(make_compressible_graph(), directory.name)
+        graph = make_compressible_graph()
+        graph.compress()
+        Bound = model.MatchedSegment.Bound
+        segments = [model.MatchedSegment((0, 3, 1), [(100.0, 20.0), (100.0, 60.0), (80.0, 88.0)],
+                                         Bound(120.0, False, 0), Bound(201.5, True, 4))]
+        trajectory = {'id': 'a', 'segment': list(mapmatch.split_segments(segments, graph)), 'time': None}
+
+        original = bundle.load(directory.name)
+        elevation = raster.RasterImage.from_array(numpy.zeros((16, 16)), (-60.0, 20.0, 0.0, 180.0, 0.0, -20.0),
+                                                  'epsg:3857', 'epsg:3857')
+        collections = {name: {} for name in features.INTERSECTION_COLLECTIONS}
+        extractor = features.FeatureExtractor(original, collections, elevation, None, 'epsg:3857')
+        _, matrix = extractor.matrix([trajectory])
+        row = dict(zip(features.FEATURE_COLUMNS, matrix[0].tolist()))
+        self.assertAlmostEqual(row['length'], 81.5)
+        self.assertEqual(row['intersections'], 2)
+        self.assertEqual(row['duration'], 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,55 @@
+import numpy
+
+from spat import kalman
+
+
+class TrajectoryStates:
+    """ Sequence of Kalman states of a trajectory, stored as contiguous arrays.
+
+    States are kept in |x| (T x n) and |P| (T x n x n) instead of one KalmanFilter per step,
+    which keeps long trajectories compact in memory and fast to pickle.
+    Indexing returns a KalmanFilter view on a row, slicing returns a TrajectoryStates
+    view on a range of rows. Assigning a KalmanFilter to an index copies it in place.
+    """
+    def __init__(self, x, P):
+        self.x = numpy.ascontiguousarray(x, dtype=float)
+        self.P = numpy.ascontiguousarray(P, dtype=float)
+
+    @classmethod
+    def empty(cls, count, dimension=4):
+        return cls(numpy.zeros((count, dimension)), numpy.zeros((count, dimension, dimension)))
+
+    @classmethod
+    def from_states(cls, states):
+        states = list(states)
+        return cls(numpy.array([state.x for state in states]),
+                   numpy.array([numpy.asarray(state.P) for state in states]))
+
+    def __len__(self):
+        return self.x.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            states = TrajectoryStates.__new__(TrajectoryStates)
+            states.x = self.x[key]
+            states.P = self.P[key]
+            return states
+        return kalman.KalmanFilter.view(self.x[key], self.P[key])
+
+    def __setitem__(self, key, state):
+        self.x[key] = state.x
+        self.P[key] = state.P
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __reversed__(self):
+        for i in reversed(range(len(self))):
+            yield self[i]
+
+    def copy(self):
+        return TrajectoryStates(self.x.copy(), self.P.copy())
 
 
 class MatchedSegment:
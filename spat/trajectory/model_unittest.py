@@ -0,0 +1,88 @@
+import pickle
+import unittest
+import numpy
+
+from spat import kalman
+from spat.trajectory import model
+
+
+def make_states(count=5):
+    x = numpy.arange(count * 4, dtype=float).reshape(count, 4)
+    P = numpy.array([numpy.identity(4) * (i + 1.0) for i in range(count)])
+    return model.TrajectoryStates(x, P)
+
+
+class TestTrajectoryStates(unittest.TestCase):
+
+    def test_index_view(self):
+        states = make_states()
+        state = states[2]
+        self.assertIsInstance(state, kalman.KalmanFilter)
+        numpy.testing.assert_array_equal(state.x, [8.0, 9.0, 10.0, 11.0])
+
+        # in place updates write through to the arrays
+        state.x[0] = -1.0
+        state.P[1, 1] = 7.0
+        self.assertEqual(states.x[2, 0], -1.0)
+        self.assertEqual(states.P[2, 1, 1], 7.0)
+
+    def test_slice_view(self):
+        states = make_states()
+        part = states[1:4]
+        self.assertIsInstance(part, model.TrajectoryStates)
+        self.assertEqual(len(part), 3)
+        part.x[0, 0] = -1.0
+        part[2].P[0, 0] = 9.0
+        self.assertEqual(states.x[1, 0], -1.0)
+        self.assertEqual(states.P[3, 0, 0], 9.0)
+        self.assertEqual([state.x[0] for state in reversed(part)], [12.0, 8.0, -1.0])
+
+    def test_setitem_copies(self):
+        states = make_states()
+        state = kalman.KalmanFilter([1.0, 2.0, 3.0, 4.0], numpy.identity(4) * 5.0)
+        states[0] = state
+        numpy.testing.assert_array_equal(states.x[0], [1.0, 2.0, 3.0, 4.0])
+        numpy.testing.assert_array_equal(states.P[0], numpy.identity(4) * 5.0)
+
+        state.x[0] = -1.0
+        state.P[0, 0] = -1.0
+        self.assertEqual(states.x[0, 0], 1.0)
+        self.assertEqual(states.P[0, 0, 0], 5.0)
+
+    def test_pickle(self):
+        states = make_states()
+        loaded = pickle.loads(pickle.dumps(states))
+        numpy.testing.assert_array_equal(loaded.x, states.x)
+        numpy.testing.assert_array_equal(loaded.P, states.P)
+
+        part = pickle.loads(pickle.dumps(states[1:3]))
+        numpy.testing.assert_array_equal(part.x, states.x[1:3])
+        part.x[0, 0] = -1.0
+        self.assertEqual(states.x[1, 0], 4.0)
+
+    def test_from_states(self):
+        filters = [kalman.KalmanFilter([i, 0.0, 1.0, 2.0], numpy.identity(4) * i) for i in range(3)]
+        states = model.TrajectoryStates.from_states(iter(filters))
+        self.assertEqual(len(states), 3)
+        for state, expected in zip(states, filters):
+            numpy.testing.assert_array_equal(state.x, expected.x)
+            numpy.testing.assert_array_equal(state.P, expected.P)
+        self.assertEqual(states.x.shape, (3, 4))
+        self.assertEqual(states.P.shape, (3, 4, 4))
+
+    def test_copy(self):
+        states = make_states()
+        copy = states.copy()
+        copy.x[0, 0] = -1.0
+        copy[1].P[0, 0] = -1.0
+        self.assertEqual(states.x[0, 0], 0.0)
+        self.assertEqual(states.P[1, 0, 0], 2.0)
+        numpy.testing.assert_array_equal(copy.x[1:], states.x[1:])
+
+        empty = model.TrajectoryStates.empty(2)
+        self.assertEqual(empty.x.shape, (2, 4))
+        self.assertEqual(empty.P.shape, (2, 4, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
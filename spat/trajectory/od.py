@@ -0,0 +1,113 @@
+import csv
+import numpy
+
+from spat import utility
+from spat.trajectory import features
+
+# facility type columns of features.FEATURE_COLUMNS, whose lengths are accumulated per cell
+TYPE_COLUMNS = features.FEATURE_COLUMNS[1:11]
+VALUE_COLUMNS = ['count', 'length', 'duration'] + TYPE_COLUMNS
+
+
+class ODMatrix:
+    """Sparse zone x zone accumulator of matched trips.
+
+    Each non empty (origin, destination) cell holds the sums of VALUE_COLUMNS over its
+    trips: their count, length, duration and length on every facility type. Zones are
+    region ids of a features.RegionPartition, -1 for trips that begin or end outside of
+    every region. Matrices accumulated over separate inputs or processes add up with
+    |merge|.
+    """
+    def __init__(self):
+        self.cells = {}
+
+    def __len__(self):
+        return len(self.cells)
+
+    def add(self, origins, destinations, values):
+        """Adds trips from zones |origins| to zones |destinations| with |values| rows of VALUE_COLUMNS."""
+        values = numpy.asarray(values, dtype=float).reshape(-1, len(VALUE_COLUMNS))
+        if len(values) == 0:
+            return self
+        pairs, inverse = numpy.unique(numpy.column_stack([origins, destinations]).astype(numpy.int64),
+                                      axis=0, return_inverse=True)
+        sums = numpy.zeros((len(pairs), len(VALUE_COLUMNS)))
+        numpy.add.at(sums, inverse.reshape(-1), values)
+        for pair, row in zip(map(tuple, pairs.tolist()), sums):
+            cell = self.cells.get(pair)
+            if cell is None:
+                self.cells[pair] = row
+            else:
+                cell += row
+        return self
+
+    def merge(self, other):
+        for pair, row in other.cells.items():
+            cell = self.cells.get(pair)
+            if cell is None:
+                self.cells[pair] = row.copy()
+            else:
+                cell += row
+        return self
+
+    def arrays(self):
+        """Origins, destinations and values (cell count x VALUE_COLUMNS) of the cells, sorted by pair."""
+        pairs = sorted(self.cells)
+        origins = numpy.array([o for o, _ in pairs], dtype=numpy.int64)
+        destinations = numpy.array([d for _, d in pairs], dtype=numpy.int64)
+        values = numpy.array([self.cells[pair] for pair in pairs]).reshape(-1, len(VALUE_COLUMNS))
+        return origins, destinations, values
+
+    def save(self, filename):
+        origins, destinations, values = self.arrays()
+        numpy.savez(filename, origin=origins, destination=destinations, values=values,
+                    columns=numpy.array(VALUE_COLUMNS))
+
+    @classmethod
+    def load(cls, filename):
+        with numpy.load(filename) as data:
+            if data['columns'].tolist() != VALUE_COLUMNS:
+                raise ValueError("unexpected OD columns %s in %s" % (data['columns'].tolist(), filename))
+            return cls().add(data['origin'], data['destination'], data['values'])
+
+    def write_csv(self, f):
+        """Writes one row per cell with totals, mean trip length and duration, and type length shares."""
+        writer = csv.writer(f)
+        writer.writerow(['origin', 'destination'] + VALUE_COLUMNS[0:3] + ['mean_length', 'mean_duration'] +
+                        ['share_' + column[len('length_'):] for column in TYPE_COLUMNS])
+        origins, destinations, values = self.arrays()
+        for o, d, row in zip(origins.tolist(), destinations.tolist(), values.tolist()):
+            count, length, duration = row[0:3]
+            shares = [value / length if length > 0.0 else 0.0 for value in row[3:]]
+            writer.writerow([o, d, int(count), length, duration, length / count, duration / count] + shares)
+
+
+def trip_values(trajectory, link_types):
+    """VALUE_COLUMNS of a single matched |trajectory|, with |link_types| a features.LinkTypeTable."""
+    values = numpy.zeros(len(VALUE_COLUMNS))
+    values[0] = 1.0
+    lengths = link_types.lengths(trajectory['segment'], numpy.zeros(12))
+    values[1] = lengths[0]
+    values[2] = features.extract_duration(trajectory)
+    values[3:] = lengths[1:11]
+    return values
+
+
+def aggregate(trajectories, graph, partition, od=None, batch_size=1024):
+    """Accumulates matched |trajectories| into |od|, a new ODMatrix by default.
+
+    Trajectories are consumed |batch_size| at a time, and their origin and destination
+    zones located in |partition| with one fit_many call per batch, so that only
+    |batch_size| trajectories are held in memory at once.
+    """
+    if od is None:
+        od = ODMatrix()
+    link_types = features.LinkTypeTable(graph)
+    iterator = iter(trajectories)
+    while True:
+        batch = list(utility.take(iterator, batch_size))
+        if not batch:
+            return od
+        origins = partition.fit_many([trajectory['segment'][0].geometry[0][0:2] for trajectory in batch])
+        destinations = partition.fit_many([trajectory['segment'][-1].geometry[-1][0:2] for trajectory in batch])
+        od.add(origins, destinations, [trip_values(trajectory, link_types) for trajectory in batch])
@@ -0,0 +1,66 @@
+import sys, argparse, fnmatch, logging
+import pickle
+
+from spat.trajectory import features, od
+from spat import bundle, parallel
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="""
+    Aggregates mapmatched bike trajectories in an origin-destination matrix between
+    the regions of a partition. Every cell holds the trip count, total length and
+    duration, and the length on every facility type.
+    """, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--ifile', default = ['data/bike_path/mm.pickle'], nargs='*',
+                        help='input pickle files of mapmatched (with spat.trajectory.mapmatch) data.')
+    parser.add_argument('--merge', default = [], nargs='*',
+                        help='OD matrix files (*.npz) of other inputs, added to the output')
+    parser.add_argument('--facility', default = 'data/mtl_geobase/mtl.pickle',
+                        help="""input pickle file or bundle directory containing the facility graph
+    (with spat.geobase.preprocess) representing the road network. Trajectories mapmatched with
+    --original_edges take the uncompressed graph (spat.geobase.preprocess --original)""")
+    parser.add_argument('--partition', default = 'data/partition/ZT2013_MTL_region',
+                        help='shapefile of the regions')
+    parser.add_argument('-o', '--ofile',
+                        default = ['data/bike_path/od.npz'], nargs='+',
+                        help="""output file containing the OD matrix.
+    Supported formats include *.npz, which can be merged later, and *.csv""")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="""number of worker processes. Input files are aggregated by the
+    workers, and their matrices merged""")
+    parser.add_argument('--batch_size', type=int, default=1024,
+                        help='number of trajectories located in the partition at once')
+
+    args = parser.parse_args()
+    print('input file:', args.ifile)
+    print('facility:', args.facility)
+    print('output file:', args.ofile)
+
+    logging.basicConfig(level=logging.INFO)
+
+    graph = bundle.open_graph(args.facility)
+    partition = features.RegionPartition(args.partition)
+
+    def aggregate(filename):
+        with open(filename, 'rb') as f:
+            trajectories = pickle.load(f)
+        logging.info("aggregating %d trajectories of %s", len(trajectories), filename)
+        return od.aggregate(trajectories, graph, partition, batch_size=args.batch_size)
+
+    matrix = od.ODMatrix()
+    for filename in args.merge:
+        matrix.merge(od.ODMatrix.load(filename))
+    for partial in parallel.fork_map(aggregate, args.ifile, args.workers):
+        matrix.merge(partial)
+    logging.info("od: %d cells", len(matrix))
+
+    for output in args.ofile:
+        if fnmatch.fnmatch(output, '*.csv'):
+            with open(output, 'w') as f:
+                matrix.write_csv(f)
+        else:
+            matrix.save(output)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,76 @@
+import io
+import os
+import tempfile
+import unittest
+import numpy
+import shapefile
+
+from spat import bundle
+from spat.trajectory import features, od, testing
+
+
+def values(count, length, duration):
+    row = numpy.zeros(len(od.VALUE_COLUMNS))
+    row[0:3] = count, length, duration
+    row[3] = length / 2.0
+    return row
+
+
+class TestODMatrix(unittest.TestCase):
+
+    def test_merge(self):
+        a = od.ODMatrix().add([1, 1, 2], [2, 2, -1], [values(1, 10.0, 5.0), values(1, 30.0, 7.0),
+                                                      values(1, 4.0, 1.0)])
+        self.assertEqual(len(a), 2)
+        numpy.testing.assert_array_equal(a.cells[1, 2], values(2, 40.0, 12.0))
+        b = od.ODMatrix().add([2, 3], [-1, 1], [values(1, 6.0, 2.0), values(1, 1.0, 1.0)])
+        a.merge(b)
+        self.assertEqual(sorted(a.cells), [(1, 2), (2, -1), (3, 1)])
+        numpy.testing.assert_array_equal(a.cells[2, -1], values(2, 10.0, 3.0))
+        numpy.testing.assert_array_equal(b.cells[2, -1], values(1, 6.0, 2.0))
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'od.npz')
+            a.save(filename)
+            loaded = od.ODMatrix.load(filename)
+        for array, expected in zip(loaded.arrays(), a.arrays()):
+            numpy.testing.assert_array_equal(array, expected)
+
+        f = io.StringIO()
+        a.write_csv(f)
+        rows = f.getvalue().splitlines()
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1].split(',')[0:8], ['1', '2', '2', '40.0', '12.0', '20.0', '6.0', '0.5'])
+
+
+class TestAggregate(testing.BundleTestCase):
+
+    def test_aggregate(self):
+        graph = self.graph
+        filename = os.path.join(self.directory.name, 'region')
+        writer = shapefile.Writer(filename, shapeType=shapefile.POLYGON)
+        writer.field('ID', 'N')
+        writer.poly([[(0.0, -5.0), (50.0, -5.0), (50.0, 50.0), (0.0, 50.0), (0.0, -5.0)]])
+        writer.record(7)
+        writer.close()
+        partition = features.RegionPartition(filename)
+
+        trajectory = testing.make_trajectory(graph)
+        matrix = od.aggregate([trajectory] * 5, graph, partition, batch_size=2)
+        self.assertEqual(list(matrix.cells), [(7, -1)])
+        row = matrix.cells[7, -1]
+        self.assertEqual(row[0], 5.0)
+        self.assertAlmostEqual(row[1], 5.0 * features.extract_length(trajectory, lambda link: True))
+        self.assertEqual(row[2], 5.0 * 14)
+        for value, predicate in zip(row[3:].tolist(), features.LINK_TYPE_PREDICATES[1:11]):
+            self.assertAlmostEqual(value, 5.0 * features.extract_length(
+                trajectory, features.link_type_predicate(graph, predicate)))
+
+        tiles = os.path.join(self.directory.name, 'tiles')
+        bundle.save_tiles(graph, tiles, 60.0)
+        tiled = od.aggregate([trajectory] * 5, bundle.open_graph(tiles), partition, batch_size=2)
+        numpy.testing.assert_allclose(tiled.cells[7, -1], row)
+
+
+if __name__ == '__main__':
+    unittest.main()
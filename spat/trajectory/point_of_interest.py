@@ -1,39 +1,46 @@
 from sklearn import cluster
 from sklearn.neighbors import kneighbors_graph
-import rtree
 import shapely.geometry as sg
 
 import numpy as np
 
 from spat.kalman import KalmanFilter
+from spat import spatial_index
+from spat.trajectory import smooth
 from spat.utility import *
 
 def extract_poi(trajectory):
-  (F, Q) = trajectory['transition']
+  states = trajectory['state']
+  if 'time' in trajectory:
+    time = np.asarray(trajectory['time'], dtype=float)
+  else:
+    time = np.arange(len(states), dtype=float)
+  # transition of every step, the first state is predicted from itself one second before
+  F, Q = smooth.transition(np.diff(time, prepend=time[0] - 1.0))
   stopped = True
-  previous_state = trajectory['state'][0].copy()
-  count = 20
-  for state in trajectory['state']:
+  previous_state = states[0].copy()
+  stop_time = -np.inf
+  for t, state in enumerate(states):
     if stopped == True:
       y = np.concatenate((state.x[0:2], np.zeros(2)))
       R = np.zeros((4,4))
       R[0:2,0:2] = state.P[0:2,0:2]
       state = previous_state.copy()
-      state.time_update(F, Q)
+      state.time_update(F[t], Q[t])
       l = state.measurment_update(y, np.identity(4), R)
 
       if l > 2.33:
-        if count >= 20:
+        # stopped for at least 20 seconds
+        if time[t] - stop_time >= 20.0:
           yield previous_state
         stopped = False
       previous_state = state
-      count += 1
 
     else:
       l = state.eq_constraint_distance(np.zeros(2), np.identity(4)[2:4,:])
       if l < 0.05:
         stopped = True
-        count = 0
+        stop_time = time[t]
         previous_state = state.copy()
 
   yield state.copy()
@@ -58,10 +65,9 @@ def cluster_trajectories(trajectories):
       result['trajectories'][label] = set([])
     result['trajectories'][label].add(index)
 
-  spatial_idx = rtree.index.Index()
-  for label, center in enumerate(result['center']):
-    coord = result['coord'][center]
-    spatial_idx.insert(label, sg.Point(coord).bounds)
+  spatial_idx = spatial_index.bulk_load(
+    (label, sg.Point(result['coord'][center]).bounds, None)
+    for label, center in enumerate(result['center']))
 
   print result['label']
   print result['center'] 
@@ -1,102 +1,163 @@
 import logging
-import math
 import numpy
 
 from spat import kalman
-from spat import utility
+from spat.trajectory import model
 
 
 def obs_transition_speed(x):
-    return [x[0], x[1], math.sqrt(x[2]**2 + x[3]**2)]
+    return numpy.stack((x[..., 0], x[..., 1], numpy.hypot(x[..., 2], x[..., 3])), axis=-1)
 
 
 def obs_transition(x):
-    return [x[0], x[1]]
+    return x[..., 0:2]
+
+
+def transition(dt, noise=2.0):
+    """Constant velocity transition over |dt| seconds.
+
+    The process noise is the one accumulated by |dt| one second steps of the unit model,
+    whose noise is |noise| * I, so a gap costs a single step.
+    |dt| may be an array, in which case one transition per element is returned.
+    """
+    dt = numpy.asarray(dt, dtype=float)
+    s1 = dt * (dt - 1.0) / 2.0
+    s2 = (dt - 1.0) * dt * (2.0*dt - 1.0) / 6.0
+
+    F = numpy.zeros(dt.shape + (4, 4))
+    Q = numpy.zeros(dt.shape + (4, 4))
+    for i in range(2):
+        F[..., i, i] = 1.0
+        F[..., i+2, i+2] = 1.0
+        F[..., i, i+2] = dt
+        Q[..., i, i] = noise * (dt + s2)
+        Q[..., i, i+2] = noise * s1
+        Q[..., i+2, i] = noise * s1
+        Q[..., i+2, i+2] = noise * dt
+    return F, Q
+
+
+def step_transitions(trajectory):
+    """Transitions between consecutive states of |trajectory|, one per step."""
+    if 'time' not in trajectory:
+        return transition(numpy.ones(len(trajectory['state']) - 1))
+    return transition(numpy.diff(trajectory['time']))
 
 
 def filter_state(trajectory):
     P = numpy.identity(4) * 10.0
-    F = numpy.identity(4)
-    F[0][2] = 1.0
-    F[1][3] = 1.0
-    Q = numpy.diag([2.0, 2.0, 2.0, 2.0])
 
     y = trajectory['observations'][0]
-    state = kalman.KalmanFilter(y[0:2] + [0.0, 0.0], P)
-    trajectory['state'] = []
-    trajectory['transition'] = (F, Q)
-
-    for observation, accuracy, link in zip(
+    x = numpy.array(y[0:2] + [0.0, 0.0])
+    states = model.TrajectoryStates.empty(len(trajectory['observations']))
+    trajectory['state'] = states
+
+    if 'time' in trajectory:
+        trajectory['time'] = numpy.asarray(trajectory['time'], dtype=float)
+        steps = numpy.diff(trajectory['time'], prepend=trajectory['time'][0] - 1.0)
+    else:
+        steps = numpy.ones(len(states))
+    step_F, step_Q = transition(steps)
+
+    for t, (observation, accuracy, link) in enumerate(zip(
             trajectory['observations'],
             trajectory['accuracy'],
-            trajectory['link']):
+            trajectory['link'])):
         error = 0.0
-        state.time_update(F, Q)
+        x = numpy.dot(step_F[t], x)
+        P = numpy.dot(numpy.dot(step_F[t], P), step_F[t].T) + step_Q[t]
         if observation != None:
             if observation[2] >= 0.0:
                 R = numpy.diag([accuracy[0]**2, accuracy[1]**2, 1.0])
-                error = state.unscented_measurment_update(observation,
-                                                          obs_transition_speed, R)
+                x, P, error = kalman.unscented_measurment_update(x, P, observation,
+                                                                 obs_transition_speed, R)
             else:
                 R = numpy.diag([accuracy[0]**2, accuracy[1]**2])
-                error = state.unscented_measurment_update(observation[0:2],
-                                                          obs_transition, R)
+                x, P, error = kalman.unscented_measurment_update(x, P, observation[0:2],
+                                                                 obs_transition, R)
 
             if error > 50.0**2: # trajectory is broken
                 logging.warning("trashing %s due to broken path", trajectory['id'])
                 return None
-        trajectory['state'].append(state.copy())
+        states.x[t] = x
+        states.P[t] = P
 
     if len(trajectory['state']) >= 2:
         return trajectory
     return None
 
 
+def midstep_covariance(filtered_P, smoothed_P, dt):
+    """Smoothed covariance halfway through each step.
+
+    This is where uncertainty peaks inside a gap between two observations.
+    For one second steps, it is the smoothed covariance of the state starting the step.
+    """
+    before = numpy.floor(dt / 2.0)
+    F1, Q1 = transition(before)
+    F2, Q2 = transition(dt - before)
+    P = numpy.matmul(numpy.matmul(F1, filtered_P[:-1]), F1.transpose(0, 2, 1)) + Q1
+    predicted_P = numpy.matmul(numpy.matmul(F2, P), F2.transpose(0, 2, 1)) + Q2
+    K = numpy.matmul(numpy.matmul(P, F2.transpose(0, 2, 1)), kalman.inv4(predicted_P))
+    return P - numpy.matmul(numpy.matmul(K, predicted_P - smoothed_P[1:]), K.transpose(0, 2, 1))
+
+
+def stationary_distance(x, P, reference_x, reference_P, Q):
+    """Measurment distance of each state to a stationary observation at its reference state.
+
+    |Q| is the process noise of the step between each state and its reference.
+    """
+    y = numpy.zeros(x.shape)
+    y[:, 0:2] = reference_x[:, 0:2]
+    R = numpy.zeros(P.shape) + Q
+    R[:, 0:2, 0:2] += reference_P[:, 0:2, 0:2]
+    S = kalman.inv4(P + R)
+    z = y - x
+    return numpy.einsum('ti,tij,tj->t', z, S, z) / 2
+
+
+def trim_bounds(x, P, Q):
+    """Finds the range of states where the trajectory is moving.
+
+    The trajectory starts at the first state that is too far from being a stationary
+    continuation of the previous one, and ends at the last state that is too far
+    from being a stationary continuation of the next one.
+    |Q| is the process noise of each step, or of all of them.
+    """
+    count = len(x)
+    forward = stationary_distance(x[1:], P[1:], x[:-1], P[:-1], Q)
+    backward = stationary_distance(x[:-1], P[:-1], x[1:], P[1:], Q)
+
+    moving = numpy.flatnonzero(forward > 1.04)
+    begin = moving[0] + 1 if len(moving) > 0 else count - 1
+
+    moving = numpy.flatnonzero(backward[begin:] > 1.04)
+    end = begin + moving[-1] + 1 if len(moving) > 0 else begin + 1
+    return begin, end
+
+
 def smooth_state(trajectory):
     trajectory = filter_state(trajectory)
     if trajectory is None:
         return None
-    (F, Q) = trajectory['transition']
-    next_state = trajectory['state'][-1]
-
-    for i, _ in utility.drop(utility.enumerate_reversed(trajectory['state']), 1):
-        trajectory['state'][i].smooth_update(next_state, F, Q)
-        next_state = trajectory['state'][i]
-        determinant = numpy.linalg.det(next_state.P)
-        if determinant > 0.0 and math.log10(determinant) > 5*next_state.P.shape[0]:
+    states = trajectory['state']
+    F, Q = step_transitions(trajectory)
+
+    x, P = kalman.rts_smooth(states.x, states.P, F, Q)
+    dt = numpy.diff(trajectory['time']) if 'time' in trajectory else numpy.ones(len(x) - 1)
+    determinant = kalman.det4(midstep_covariance(states.P, P, dt))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        if numpy.any((determinant > 0.0) & (numpy.log10(determinant) > 5*P.shape[1])):
             logging.warning("trashing %s due to missing data", trajectory['id'])
             return None
 
-    previous_state = None
-    for i, state in enumerate(trajectory['state']):
-        if previous_state is not None:
-          y = numpy.concatenate((previous_state.x[0:2], numpy.zeros(2)))
-          R = Q
-          R[0:2,0:2] += previous_state.P[0:2,0:2]
-          l = state.measurment_update(y, numpy.identity(4), R)
-          if l > 1.04:
-              break
-        previous_state = state
-
-    logging.warning("starting trajectory at %d", i)
-    if i > 0:
-      trajectory['state'] = trajectory['state'][i:]
-
-    next_state = None
-    for i, state in enumerate(reversed(trajectory['state'])):
-        if next_state is not None:
-            y = numpy.concatenate((next_state.x[0:2], numpy.zeros(2)))
-            R = Q
-            R[0:2,0:2] += next_state.P[0:2,0:2]
-            l = state.measurment_update(y, numpy.identity(4), R)
-            if l > 1.04:
-                break
-        next_state = state
-
-    logging.warning("ending trajectory at %d", i)
-    if i > 0:
-      trajectory['state'] = trajectory['state'][:-i]
+    begin, end = trim_bounds(x, P, Q)
+    logging.warning("starting trajectory at %d", begin)
+    logging.warning("ending trajectory at %d", len(x) - end)
+    trajectory['state'] = model.TrajectoryStates(x[begin:end], P[begin:end])
+    if 'time' in trajectory:
+        trajectory['time'] = trajectory['time'][begin:end]
 
     if len(trajectory['state']) >= 2:
         return trajectory
-    return None
\ No newline at end of file
+    return None
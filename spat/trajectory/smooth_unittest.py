@@ -0,0 +1,133 @@
+import unittest
+import numpy
+
+from spat import kalman
+from spat.trajectory import model, smooth
+
+
+def make_trajectory(time, seed=0, moving=(0.0, numpy.inf)):
+    """Trip with noisy observations at |time|, None where |time| is None.
+
+    It is stopped before and after the |moving| time range, and at a constant velocity within.
+    """
+    rng = numpy.random.RandomState(seed)
+    observations = []
+    for t in time:
+        noise = rng.randn(2) * 2.0
+        if t is None:
+            observations.append(None)
+        else:
+            d = min(max(t, moving[0]), moving[1]) - moving[0]
+            observations.append([5.0 * d + noise[0], 2.0 * d + noise[1], -1.0])
+    return {'id': 'a', 'observations': observations, 'accuracy': [(3.0, 3.0)] * len(time),
+            'link': [None] * len(time)}
+
+
+def baseline_smooth_state(trajectory):
+    """Per state filter, smoother and trimming loops that smooth_state replaced.
+
+    Returns the trim bounds, the kept states and every smoothed state before trimming.
+    """
+    F, Q = smooth.transition(1.0)
+    y = trajectory['observations'][0]
+    state = kalman.KalmanFilter(y[0:2] + [0.0, 0.0], numpy.identity(4) * 10.0)
+    states = []
+    for observation, accuracy in zip(trajectory['observations'], trajectory['accuracy']):
+        state.time_update(F, Q)
+        if observation is not None:
+            R = numpy.diag([accuracy[0]**2, accuracy[1]**2])
+            state.unscented_measurment_update(observation[0:2], smooth.obs_transition, R)
+        states.append(state.copy())
+    for i in reversed(range(len(states) - 1)):
+        states[i].smooth_update(states[i + 1], F, Q)
+    smoothed = model.TrajectoryStates.from_states(states)
+
+    previous_state = None
+    for i, state in enumerate(states):
+        if previous_state is not None:
+            y = numpy.concatenate((previous_state.x[0:2], numpy.zeros(2)))
+            R = Q
+            R[0:2,0:2] += previous_state.P[0:2,0:2]
+            if state.measurment_update(y, numpy.identity(4), R) > 1.04:
+                break
+        previous_state = state
+    begin = i
+
+    next_state = None
+    for i, state in enumerate(reversed(states[begin:])):
+        if next_state is not None:
+            y = numpy.concatenate((next_state.x[0:2], numpy.zeros(2)))
+            R = Q
+            R[0:2,0:2] += next_state.P[0:2,0:2]
+            if state.measurment_update(y, numpy.identity(4), R) > 1.04:
+                break
+        next_state = state
+    end = len(states) - i
+    return begin, end, model.TrajectoryStates.from_states(states[begin:end]), smoothed
+
+
+class TestTransition(unittest.TestCase):
+
+    def test_gap(self):
+        F1, Q1 = smooth.transition(1.0)
+        F, Q = F1, Q1
+        for dt in range(2, 8):
+            F = numpy.dot(F1, F)
+            Q = numpy.dot(numpy.dot(F1, Q), F1.T) + Q1
+            gap_F, gap_Q = smooth.transition(float(dt))
+            numpy.testing.assert_allclose(gap_F, F)
+            numpy.testing.assert_allclose(gap_Q, Q)
+
+        many_F, many_Q = smooth.transition([1.0, 7.0])
+        numpy.testing.assert_allclose(many_F[1], F)
+        numpy.testing.assert_allclose(many_Q[0], Q1)
+
+    def test_padded(self):
+        # a gap gives the same states as unobserved one second steps through it
+        observed = [0, 1, 2, 3, 4, 5, 9, 10, 11, 12, 18, 19, 20, 21, 22, 23, 24]
+        padded = make_trajectory([t if t in observed else None for t in range(observed[-1] + 1)])
+        padded['time'] = list(range(observed[-1] + 1))
+        gapped = {'id': 'a', 'time': observed,
+                  'observations': [padded['observations'][t] for t in observed],
+                  'accuracy': [padded['accuracy'][t] for t in observed],
+                  'link': [None] * len(observed)}
+
+        filtered = smooth.filter_state(dict(gapped))
+        filtered_padded = smooth.filter_state(dict(padded))
+        numpy.testing.assert_allclose(filtered['state'].x, filtered_padded['state'].x[observed], atol=1e-8)
+        numpy.testing.assert_allclose(filtered['state'].P, filtered_padded['state'].P[observed], atol=1e-8)
+
+        smoothed = smooth.smooth_state(dict(gapped))
+        smoothed_padded = smooth.smooth_state(dict(padded))
+        common, i, j = numpy.intersect1d(smoothed['time'], smoothed_padded['time'], return_indices=True)
+        self.assertGreater(len(common), 10)
+        numpy.testing.assert_allclose(smoothed['state'].x[i], smoothed_padded['state'].x[j], atol=1e-8)
+        numpy.testing.assert_allclose(smoothed['state'].P[i], smoothed_padded['state'].P[j], atol=1e-8)
+
+
+class TestSmoothState(unittest.TestCase):
+
+    def test_baseline(self):
+        trajectory = make_trajectory(range(60), moving=(12.0, 45.0))
+        trajectory['time'] = list(range(60))
+        begin, end, kept, smoothed = baseline_smooth_state(make_trajectory(range(60), moving=(12.0, 45.0)))
+
+        result = smooth.smooth_state(trajectory)
+        new_begin, new_end = int(result['time'][0]), int(result['time'][-1]) + 1
+        # trim bounds move by at most one state
+        self.assertLessEqual(abs(new_begin - begin), 1)
+        self.assertLessEqual(abs(new_end - end), 1)
+        self.assertGreater(begin, 0)
+        self.assertLess(end, 60)
+
+        # kept states are the smoothed ones, including the first and the last
+        numpy.testing.assert_allclose(result['state'].x, smoothed.x[new_begin:new_end], atol=1e-8)
+        numpy.testing.assert_allclose(result['state'].P, smoothed.P[new_begin:new_end], atol=1e-8)
+        # while the baseline applied the stationary measurment to its first and last states
+        numpy.testing.assert_allclose(kept.x[1:-1], smoothed.x[begin + 1:end - 1], atol=1e-8)
+        self.assertFalse(numpy.allclose(kept.x[0], smoothed.x[begin]))
+        self.assertFalse(numpy.allclose(kept.x[-1], smoothed.x[end - 1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""Fixtures shared by the unit tests of spat.trajectory."""
+import tempfile
+import unittest
+import shapely.geometry as sg
+
+from spat import bundle, facility
+from spat.trajectory import model
+
+
+def make_graph():
+    graph = facility.SpatialGraph()
+    points = [(0.0, 0.0), (100.0, 0.0), (100.0, 80.0), (0.0, 120.0)]
+    for u, p in enumerate(points):
+        graph.graph.add_node(u, geometry=sg.Point(p))
+    edges = [(0, 1, 11, 0), (1, 2, 6, 1), (2, 3, 13, -1), (3, 0, 0, 0), (0, 2, 17, 1)]
+    for u, v, link_type, sens in edges:
+        line = [points[u], points[v]]
+        k = graph.graph.add_edge(u, v, order=u < v, type=link_type, sens=sens)
+        graph.geometry[u, v, k] = sg.LineString(line)
+        graph.geometry[v, u, k] = sg.LineString(list(reversed(line)))
+    return graph
+
+
+def make_trajectory(graph):
+    Bound = model.MatchedSegment.Bound
+    segments = [
+        model.MatchedSegment((0, 1, 0), [(20.0, 0.0), (100.0, 0.0)], Bound(20.0, False, 0), Bound(100.0, True, 3)),
+        model.MatchedSegment((1, 2, 0), [(100.0, 0.0), (100.0, 80.0)], Bound(0.0, True, 3), Bound(80.0, True, 6)),
+        model.MatchedSegment((2, 3, 0), [(100.0, 80.0), (50.0, 100.0)], Bound(0.0, True, 6),
+                             Bound(graph.edge_geometry((2, 3, 0)).length / 2.0, False, 8)),
+        model.MatchedSegment(None, [(50.0, 100.0), (40.0, 130.0), (0.0, 130.0)], Bound(None, False, 8),
+                             Bound(None, False, 10)),
+        model.MatchedSegment((3, 0, 0), [(0.0, 120.0), (0.0, 0.0)], Bound(0.0, True, 10), Bound(120.0, True, 12)),
+        model.MatchedSegment((0, 2, 0), [(0.0, 0.0), (60.0, 48.0)], Bound(0.0, True, 12), Bound(76.8, False, 14)),
+    ]
+    return {'id': 'a', 'segment': segments, 'time': None}
+
+
+class BundleTestCase(unittest.TestCase):
+    """Test case with make_graph saved as a bundle in a temporary |directory|, and loaded as |graph|."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        bundle.save(make_graph(), self.directory.name)
+        self.graph = bundle.load(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
@@ -0,0 +1,118 @@
+import csv
+import numpy
+import geojson
+import shapely.geometry as sg
+
+from spat import stats
+
+
+class EdgeTraffic:
+    """Traffic on every directed edge of a compiled facility graph, accumulated over matched trajectories.
+
+    Slots are indexed by directed edge id. Every matched segment on an edge is one
+    traversal: it is counted, its speed (distance along the edge over elapsed time) goes
+    in running moments, and its start time in a histogram of |bins| slices of the day.
+    States without a trajectory time are one second apart and left out of the histogram.
+    Accumulators of the same graph merge, so that new batches of matched trajectories
+    are added to stored totals.
+    """
+    def __init__(self, edge_count, bins=24):
+        self.count = numpy.zeros(edge_count, dtype=numpy.int64)
+        self.speed = stats.RunningStatsArray(edge_count)
+        self.time_of_day = numpy.zeros((edge_count, bins), dtype=numpy.int64)
+
+    def __len__(self):
+        return len(self.count)
+
+    def add(self, trajectories, compiled):
+        """Adds the traversals of matched |trajectories| on the edges of the compiled graph |compiled|."""
+        bins = self.time_of_day.shape[1]
+        edges = []
+        speed_rows, speeds = [], []
+        time_rows, time_bins = [], []
+        for trajectory in trajectories:
+            time = trajectory.get('time')
+
+            def time_at(i):
+                if time is None:
+                    return float(i)
+                # |i| may be one past the last state
+                return float(time[i]) if i < len(time) else float(time[-1]) + (i - len(time) + 1)
+
+            for segment in trajectory['segment']:
+                if segment.edge is None:
+                    continue
+                begin = time_at(segment.begin.idx)
+                duration = time_at(segment.end.idx) - begin
+                if duration > 0.0:
+                    speed_rows.append(len(edges))
+                    speeds.append((segment.end.projection - segment.begin.projection) / duration)
+                if time is not None:
+                    time_rows.append(len(edges))
+                    time_bins.append(int(begin % 86400.0 * bins // 86400.0))
+                edges.append(segment.edge)
+        if not edges:
+            return self
+
+        # directed edge ids of every traversal, looked up at once
+        ids = compiled.edge_indices(*zip(*edges))
+        numpy.add.at(self.count, ids, 1)
+        self.speed.push(ids[numpy.array(speed_rows, dtype=numpy.int64)], speeds)
+        numpy.add.at(self.time_of_day, (ids[numpy.array(time_rows, dtype=numpy.int64)],
+                                        numpy.array(time_bins, dtype=numpy.int64)), 1)
+        return self
+
+    def merge(self, other):
+        if self.time_of_day.shape != other.time_of_day.shape:
+            raise ValueError("cannot merge traffic of %s edges and bins with %s" %
+                             (self.time_of_day.shape, other.time_of_day.shape))
+        self.count += other.count
+        self.speed.merge(other.speed)
+        self.time_of_day += other.time_of_day
+        return self
+
+    def save(self, filename):
+        numpy.savez(filename, count=self.count, time_of_day=self.time_of_day,
+                    speed_weight=self.speed.totalWeight, speed_mean=self.speed.m,
+                    speed_M2=self.speed.M2, speed_M3=self.speed.M3)
+
+    @classmethod
+    def load(cls, filename):
+        with numpy.load(filename) as data:
+            traffic = cls(*data['time_of_day'].shape)
+            traffic.count[:] = data['count']
+            traffic.time_of_day[:] = data['time_of_day']
+            traffic.speed.totalWeight[:] = data['speed_weight']
+            traffic.speed.m[:] = data['speed_mean']
+            traffic.speed.M2[:] = data['speed_M2']
+            traffic.speed.M3[:] = data['speed_M3']
+        return traffic
+
+    def rows(self, compiled):
+        """Statistics of every traversed edge, as dicts keyed by column name."""
+        mean, variance, skewness = self.speed.mean(), self.speed.variance(), self.speed.skewness()
+        for i in numpy.flatnonzero(self.count).tolist():
+            u, v, k = compiled.source[i].item(), compiled.target[i].item(), compiled.key[i].item()
+            yield {'source': u, 'target': v, 'key': k, 'count': int(self.count[i]),
+                   'speed_mean': float(mean[i]), 'speed_std': float(numpy.sqrt(variance[i])),
+                   'speed_skewness': float(skewness[i]), 'time_of_day': self.time_of_day[i].tolist()}
+
+    def write_csv(self, f, compiled):
+        writer = csv.writer(f)
+        bins = self.time_of_day.shape[1]
+        columns = ['source', 'target', 'key', 'count', 'speed_mean', 'speed_std', 'speed_skewness']
+        writer.writerow(columns + ['time_of_day_%d' % b for b in range(bins)])
+        for row in self.rows(compiled):
+            writer.writerow([row[column] for column in columns] + row['time_of_day'])
+
+    def volume_map(self, graph):
+        """GeoJSON FeatureCollection of the traversed edges of |graph| with their statistics."""
+        feature = []
+        for row in self.rows(graph.compiled):
+            edge = (row['source'], row['target'], row['key'])
+            feature.append(geojson.Feature(
+                geometry = sg.mapping(graph.edge_geometry(edge)),
+                properties = row))
+        fc = geojson.FeatureCollection(feature)
+        fc['crs'] = {'type': 'EPSG', 'properties': {'code': 2950}}
+        return fc
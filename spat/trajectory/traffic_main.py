@@ -0,0 +1,68 @@
+import sys, argparse, fnmatch, logging
+import pickle, json
+
+from spat.trajectory import traffic
+from spat import bundle, parallel
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="""
+    Accumulates the traffic of mapmatched bike trajectories on every directed edge of
+    the facility graph: traversal counts, speed mean, variance and skewness, and a time
+    of day histogram.
+    """, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--ifile', default = ['data/bike_path/mm.pickle'], nargs='*',
+                        help='input pickle files of mapmatched (with spat.trajectory.mapmatch) data.')
+    parser.add_argument('--merge', default = [], nargs='*',
+                        help='traffic files (*.npz) of the same facility, added to the output')
+    parser.add_argument('--facility', default = 'data/mtl_geobase/mtl.pickle',
+                        help="""input pickle file or bundle directory containing the facility graph
+    (with spat.geobase.preprocess) representing the road network. Trajectories mapmatched with
+    --original_edges take the uncompressed graph (spat.geobase.preprocess --original). Traffic is
+    indexed by the directed edge ids of the whole graph, so a tiled facility is not supported""")
+    parser.add_argument('--bins', type=int, default=24,
+                        help='number of time of day bins')
+    parser.add_argument('-o', '--ofile',
+                        default = ['data/bike_path/traffic.npz'], nargs='+',
+                        help="""output file containing the edge traffic.
+    Supported formats include *.npz, which can be merged later, *.csv and *.geojson""")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="""number of worker processes. Input files are accumulated by the
+    workers, and their traffic merged""")
+
+    args = parser.parse_args()
+    print('input file:', args.ifile)
+    print('facility:', args.facility)
+    print('output file:', args.ofile)
+
+    logging.basicConfig(level=logging.INFO)
+
+    graph = bundle.open_graph(args.facility, tiled=False)
+    compiled = graph.compiled
+
+    def accumulate(filename):
+        with open(filename, 'rb') as f:
+            trajectories = pickle.load(f)
+        logging.info("accumulating %d trajectories of %s", len(trajectories), filename)
+        return traffic.EdgeTraffic(len(compiled), args.bins).add(trajectories, compiled)
+
+    total = traffic.EdgeTraffic(len(compiled), args.bins)
+    for filename in args.merge:
+        total.merge(traffic.EdgeTraffic.load(filename))
+    for partial in parallel.fork_map(accumulate, args.ifile, args.workers):
+        total.merge(partial)
+    logging.info("traffic: %d traversals over %d edges", total.count.sum(), (total.count > 0).sum())
+
+    for output in args.ofile:
+        if fnmatch.fnmatch(output, '*.csv'):
+            with open(output, 'w') as f:
+                total.write_csv(f, compiled)
+        elif fnmatch.fnmatch(output, '*.geojson'):
+            with open(output, 'w') as f:
+                json.dump(total.volume_map(graph), f, indent=2)
+        else:
+            total.save(output)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,51 @@
+import io
+import os
+import unittest
+import numpy
+
+from spat.trajectory import testing, traffic
+
+
+class TestEdgeTraffic(testing.BundleTestCase):
+
+    def test_add(self):
+        compiled = self.graph.compiled
+        untimed = testing.make_trajectory(self.graph)
+        timed = dict(untimed, time=numpy.arange(14) * 2.0 + 7.5 * 3600.0)
+
+        edge_traffic = traffic.EdgeTraffic(len(compiled)).add([untimed, timed], compiled)
+        i = compiled.edge_index((0, 1, 0))
+        self.assertEqual(edge_traffic.count[i], 2)
+        self.assertEqual(edge_traffic.count.sum(), 10)
+        # 80 along the edge over 3 states, one then two seconds apart
+        self.assertAlmostEqual(edge_traffic.speed.mean()[i], (80.0 / 3 + 80.0 / 6) / 2.0)
+        self.assertEqual(edge_traffic.time_of_day[i].tolist(), [0] * 7 + [1] + [0] * 16)
+        # the last segment ends one past the last state
+        j = compiled.edge_index((0, 2, 0))
+        self.assertAlmostEqual(edge_traffic.speed.m[j], (76.8 / 2 + 76.8 / 3) / 2.0)
+        self.assertEqual(edge_traffic.time_of_day.sum(), 5)
+
+    def test_merge(self):
+        compiled = self.graph.compiled
+        trajectory = testing.make_trajectory(self.graph)
+        whole = traffic.EdgeTraffic(len(compiled), 4).add([trajectory] * 3, compiled)
+        partial = traffic.EdgeTraffic(len(compiled), 4).add([trajectory], compiled)
+        filename = os.path.join(self.directory.name, 'traffic.npz')
+        traffic.EdgeTraffic(len(compiled), 4).add([trajectory] * 2, compiled).save(filename)
+        partial.merge(traffic.EdgeTraffic.load(filename))
+
+        numpy.testing.assert_array_equal(partial.count, whole.count)
+        numpy.testing.assert_allclose(partial.speed.variance(), whole.speed.variance())
+        with self.assertRaises(ValueError):
+            partial.merge(traffic.EdgeTraffic(len(compiled), 24))
+
+        f = io.StringIO()
+        whole.write_csv(f, compiled)
+        self.assertEqual(len(f.getvalue().splitlines()), 1 + 5)
+        volume = whole.volume_map(self.graph)
+        self.assertEqual(len(volume['features']), 5)
+        self.assertEqual(volume['features'][0]['properties']['count'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import logging
+import numpy
+import scipy.sparse
+from scipy.sparse import csgraph
+
+
+class UBODT:
+    """Upper-bounded origin-destination table of a facility graph.
+
+    Holds the shortest network path between every pair of nodes that are within an
+    upper bound distance of each other. Rows are sorted by (source, target), so that a
+    pair is found by binary search, and the table can be memory mapped from disk.
+
+    Columns:
+      source, target: node ids of the pair.
+      distance: length of the shortest path from source to target.
+      next_node, next_key: first edge of the path, (source, next_node, next_key).
+      prev_node, prev_key: last edge of the path, (prev_node, target, prev_key).
+    """
+    dtype = numpy.dtype([
+        ('source', numpy.int64),
+        ('target', numpy.int64),
+        ('distance', numpy.float64),
+        ('next_node', numpy.int64),
+        ('next_key', numpy.int32),
+        ('prev_node', numpy.int64),
+        ('prev_key', numpy.int32),
+    ])
+
+    def __init__(self, table):
+        self.table = table
+        self.source = table['source']
+        self.target = table['target']
+
+    @classmethod
+    def load(cls, filename):
+        return cls(numpy.load(filename, mmap_mode='r'))
+
+    def save(self, filename):
+        numpy.save(filename, numpy.asarray(self.table))
+
+    def __len__(self):
+        return len(self.table)
+
+    def lookup(self, source, target):
+        """Row of the pair (|source|, |target|), or None if it is not in the table."""
+        begin = numpy.searchsorted(self.source, source, 'left')
+        end = numpy.searchsorted(self.source, source, 'right')
+        i = begin + numpy.searchsorted(self.target[begin:end], target)
+        if i < end and self.target[i] == target:
+            return self.table[i]
+        return None
+
+    def distance(self, source, target):
+        if source == target:
+            return 0.0
+        row = self.lookup(source, target)
+        if row is None:
+            return numpy.inf
+        return float(row['distance'])
+
+    def first_edge(self, source, target):
+        row = self.lookup(source, target)
+        if row is None:
+            return None
+        return source, int(row['next_node']), int(row['next_key'])
+
+    def path(self, source, target):
+        """Edges (u, v, k) of the shortest path from |source| to |target|.
+
+        Returns an empty list when both nodes are the same, and None when |target| is
+        farther than the upper bound. The path is rebuilt backward through predecessors,
+        which all belong to the shortest path tree of |source|.
+        """
+        edges = []
+        while target != source:
+            row = self.lookup(source, target)
+            if row is None:
+                return None
+            previous = int(row['prev_node'])
+            edges.append((previous, target, int(row['prev_key'])))
+            target = previous
+        edges.reverse()
+        return edges
+
+
+def build(graph, max_distance, batch_size=64):
+    """Builds the UBODT of the facility |graph| for paths up to |max_distance|.
+
+    Edges are traversed in both directions, with the length of their geometry, as
+    listed by the compiled view of |graph|.
+    Shortest paths are computed |batch_size| sources at a time, and only the pairs
+    they reach are walked to find their first edge.
+    """
+    compiled = graph.compiled if graph.compiled is not None else graph.compile()
+    nodes = numpy.asarray(compiled.nodes, dtype=numpy.int64)
+    count = len(nodes)
+
+    u = compiled.node_positions(compiled.source)
+    v = compiled.node_positions(compiled.target)
+    k = compiled.key
+    length = compiled.length
+
+    # keep the shortest of parallel edges
+    order = numpy.lexsort((length, v, u))
+    pair = u[order] * count + v[order]
+    first = numpy.flatnonzero(numpy.diff(pair, prepend=-1) != 0)
+    pair, key, length = pair[first], k[order][first], length[order][first]
+    matrix = scipy.sparse.csr_matrix((length, (pair // count, pair % count)), shape=(count, count))
+
+    def edge_key(a, b):
+        return key[numpy.searchsorted(pair, a * count + b)]
+
+    chunks = []
+    for begin in range(0, count, batch_size):
+        sources = numpy.arange(begin, min(begin + batch_size, count))
+        distance, predecessor = csgraph.dijkstra(matrix, directed=True, indices=sources,
+                                                 return_predecessors=True, limit=max_distance)
+        i, target = numpy.nonzero(numpy.isfinite(distance) & (predecessor >= 0))
+        source = sources[i]
+        previous = predecessor[i, target]
+
+        # climb the shortest path tree of every reached pair up to the first node after
+        # its source, each pair leaving once it gets there
+        hop = target.copy()
+        climbing = numpy.flatnonzero(previous != source)
+        while len(climbing):
+            hop[climbing] = predecessor[i[climbing], hop[climbing]]
+            climbing = climbing[predecessor[i[climbing], hop[climbing]] != source[climbing]]
+
+        chunk = numpy.empty(len(i), dtype=UBODT.dtype)
+        chunk['source'] = nodes[source]
+        chunk['target'] = nodes[target]
+        chunk['distance'] = distance[i, target]
+        chunk['next_node'] = nodes[hop]
+        chunk['next_key'] = edge_key(source, hop)
+        chunk['prev_node'] = nodes[previous]
+        chunk['prev_key'] = edge_key(previous, target)
+        chunks.append(chunk)
+
+    table = numpy.concatenate(chunks) if chunks else numpy.empty(0, dtype=UBODT.dtype)
+    logging.info("ubodt: %d pairs within %.1f over %d nodes", len(table), max_distance, count)
+    return UBODT(table)
@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+import networkx as nx
+
+from spat import testing, ubodt
+
+
+class TestUBODT(unittest.TestCase):
+
+    def test_distance(self):
+        graph = testing.make_grid(4, 10.0)
+        table = ubodt.build(graph, 35.0, batch_size=5)
+        distance = dict(nx.all_pairs_dijkstra_path_length(graph.graph, cutoff=35.0,
+                                                          weight=lambda u, v, d: 10.0))
+        expected = sum(len(targets) - 1 for targets in distance.values())
+        self.assertEqual(len(table), expected)
+        for source, targets in distance.items():
+            for target, length in targets.items():
+                self.assertAlmostEqual(table.distance(source, target), length)
+        self.assertEqual(table.distance(0, 15), float('inf'))
+        self.assertIsNone(table.path(0, 15))
+
+    def test_path(self):
+        graph = testing.make_grid(4, 10.0)
+        table = ubodt.build(graph, 35.0)
+        self.assertEqual(table.path(5, 5), [])
+        self.assertEqual(table.path(0, 1), [(0, 1, 0)])
+        for row in table.table:
+            source, target = int(row['source']), int(row['target'])
+            path = table.path(source, target)
+            self.assertEqual(path[0][0], source)
+            self.assertEqual(path[-1][1], target)
+            self.assertEqual(path[0], table.first_edge(source, target))
+            for (_, v, _), (u, _, _) in zip(path[:-1], path[1:]):
+                self.assertEqual(v, u)
+            length = sum(graph.edge_geometry(edge).length for edge in path)
+            self.assertAlmostEqual(length, row['distance'])
+
+    def test_load(self):
+        graph = testing.make_grid(3, 10.0)
+        table = ubodt.build(graph, 25.0)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'ubodt.npy')
+            table.save(filename)
+            loaded = ubodt.UBODT.load(filename)
+            self.assertEqual(len(loaded), len(table))
+            self.assertEqual(loaded.path(0, 8), table.path(0, 8))
+            del loaded
+
+
+if __name__ == '__main__':
+    unittest.main()
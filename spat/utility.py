@@ -75,3 +75,8 @@ def bb_buffer(point, width):
 
 def intersect(a, b):
     return a[0] < b[2] and a[2] > b[0]  and a[1] < b[3] and a[3] > b[1]
+
+
+def intersect_many(a, b):
+    """Vectorized |intersect| of every row of bounds |a| (Nx4) with bounds |b|."""
+    return (a[:,0] < b[2]) & (a[:,2] > b[0]) & (a[:,1] < b[3]) & (a[:,3] > b[1])